@@ -0,0 +1,179 @@
+"""SMSC Client application built on asyncio streams
+
+Requires Python 3. Many sessions can share one event loop."""
+
+import asyncio
+import logging
+import cimd
+
+class AsyncSMSCClient:
+    """ CIMD session on asyncio streams
+
+    Coroutine methods mirror the SMSC message builders. Each of them sends
+    the request and returns the response as cimd.CIMDFrame, responses are
+    matched by packet number. Up to windowSize requests are in flight.
+    Session stays open, alive is sent after idleTimeout seconds without
+    traffic and the session is closed if it is not answered in time."""
+
+    def __init__(self, host, port, username, password, subAddr=None, windowSize=None,
+                 idleTimeout=60, aliveTimeout=10, inbound=None):
+        self.log = logging.getLogger("AsyncSMSCClient")
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.subAddr = subAddr
+        self.windowSize = windowSize
+        self.smscc = cimd.SMSC()
+        self.etx = cimd.toBytes(cimd.CIMD.specChar['etx'])
+        self.banner = None
+        self.reader = None
+        self.writer = None
+        self.receiver = None
+        self.pending = {}               # Packet number -> response future
+        self.window = asyncio.Semaphore(windowSize or 1)
+        self.idleTimeout = idleTimeout
+        self.aliveTimeout = aliveTimeout
+        self.lastActivity = 0
+        self.keeper = None
+        self.inbound = inbound          # inbound.InboundQueue for delivered messages
+
+    async def connect(self):
+        """ Opens connection, reads banner and logs in """
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.banner = await self.reader.readuntil(b'\n')
+        self.log.info("[Banner] %r", self.banner)
+        self.receiver = asyncio.ensure_future(self.receive())
+        response = await self.login()
+        if self.idleTimeout is not None:
+            self.keeper = asyncio.ensure_future(self.keepalive())
+        return response
+
+    async def close(self):
+        """ Closes connection, pending requests fail """
+        if self.receiver is not None:
+            self.receiver.cancel()
+            self.receiver = None
+        if self.keeper is not None:
+            if self.keeper is not asyncio.current_task():
+                self.keeper.cancel()
+            self.keeper = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        self.failPending(cimd.CIMDError(self.smscc.commError[4], 4))
+
+    def failPending(self, error):
+        pending = self.pending
+        self.pending = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    async def receive(self):
+        """ Reads frames and resolves futures of matching requests
+
+        Pending requests fail however the loop ends."""
+        try:
+            while True:
+                data = await self.reader.readuntil(self.etx)
+                self.lastActivity = asyncio.get_running_loop().time()
+                try:
+                    frame = self.smscc.cimd.parseFrame(data)
+                except cimd.CIMDError:
+                    self.log.warning("[Invalid CIMD frame] %r", data)
+                    continue
+                future = self.pending.pop(frame.packetNumber, None)
+                if future is not None and not future.done():
+                    future.set_result(frame)
+                else:
+                    self.handleFrame(frame)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.log.warning("[Remote connection closed or reset]")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.log.exception("[Receive failed]")
+        finally:
+            self.failPending(cimd.CIMDError(self.smscc.commError[4], 4))
+
+    def handleFrame(self, frame):
+        """ Handles frames which are not responses to our requests
+
+        deliver_msg and deliver_status_rep are acked at once and passed to
+        the inbound queue, nack is sent if it is full."""
+        if frame.opCode != 20 and frame.opCode != 23:
+            self.log.debug("[Unsolicited CIMD] %02d:%03d", frame.opCode, frame.packetNumber)
+            return
+        if self.inbound is None or self.inbound.put(frame):
+            ack = self.smscc.cimd.createAck(frame)
+        else:
+            ack = self.smscc.cimd.createAck(frame, 99)
+        self.writer.write(cimd.toBytes(ack))
+
+    def checkResponse(self, frame):
+        """ Raises CIMDError if the response reports an error """
+        error = self.smscc.responseError(frame)
+        if error is not None:
+            raise error
+        return frame
+
+    async def request(self, builder, *args):
+        """ Builds message once window allows, sends it and waits for response
+
+        Message is built inside the window, so packet numbers of messages
+        in flight never collide. CIMDError is raised if the connection is
+        closed or lost."""
+        async with self.window:
+            if self.writer is None or self.receiver is None or self.receiver.done():
+                raise cimd.CIMDError(self.smscc.commError[4], 4)
+            message = builder(*args)
+            future = asyncio.get_running_loop().create_future()
+            self.pending[int(message[4:7])] = future
+            self.writer.write(cimd.toBytes(message))
+            self.lastActivity = asyncio.get_running_loop().time()
+            frame = await future
+        return self.checkResponse(frame)
+
+    async def keepalive(self):
+        """ Sends alive on idle session, closes it if SMSC does not answer """
+        loop = asyncio.get_running_loop()
+        while True:
+            idle = loop.time() - self.lastActivity
+            if idle < self.idleTimeout:
+                await asyncio.sleep(self.idleTimeout - idle)
+                continue
+            try:
+                await asyncio.wait_for(self.alive(), self.aliveTimeout)
+            except (asyncio.TimeoutError, cimd.CIMDError):
+                self.log.warning("[No alive response from SMSC, closing connection]")
+                await self.close()
+                return
+
+    async def login(self):
+        return await self.request(self.smscc.login, self.username, self.password,
+                                  self.subAddr, self.windowSize)
+
+    async def logout(self):
+        return await self.request(self.smscc.logout)
+
+    async def submitMessage(self, encodedMsgParams):
+        return await self.request(self.smscc.submitMessage, encodedMsgParams)
+
+    async def enquireMessageStatus(self, destAddr, servCentreTimestamp):
+        return await self.request(self.smscc.enquireMessageStatus, destAddr, servCentreTimestamp)
+
+    async def deliveryRequest(self, mode=1):
+        return await self.request(self.smscc.deliveryRequest, mode)
+
+    async def cancelMessage(self, mode, destAddr=None, servCentreTimestamp=None):
+        return await self.request(self.smscc.cancelMessage, mode, destAddr, servCentreTimestamp)
+
+    async def setParam(self, symbol, value):
+        return await self.request(self.smscc.setParam, symbol, value)
+
+    async def getParam(self, symbol):
+        return await self.request(self.smscc.getParam, symbol)
+
+    async def alive(self):
+        return await self.request(self.smscc.alive)
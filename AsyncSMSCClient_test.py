@@ -0,0 +1,194 @@
+""" Unit test for AsyncSMSCClient.py """
+
+import AsyncSMSCClient
+import cimd
+import inbound
+import asyncio
+import unittest
+
+class fakeSMSC:
+    """ Minimal asyncio SMSC answering every request with its response """
+
+    def __init__(self):
+        self.smsc = cimd.SMSC()
+        self.sessions = 0
+        self.received = []
+        self.answerAlive = True
+        self.deliverOnLogin = False
+        self.closeAfterLogin = False
+        self.floodOnSubmit = False
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        self.sessions += 1
+        writer.write(b"FakeCIMD2-A ConnectionInfo: SessionId = 1\n")
+        try:
+            while True:
+                frame = self.smsc.cimd.parseFrame(await reader.readuntil(b'\x03'))
+                self.received.append(frame.opCode)
+                if frame.opCode == 40 and not self.answerAlive or frame.opCode >= 50:
+                    continue
+                if frame.opCode == 3 and self.floodOnSubmit:
+                    writer.write(b'x' * 100000)     # Frame over the reader limit
+                    continue
+                params = []
+                if frame.opCode == 3:
+                    params = [(21, frame.getParamValue(21).decode('latin-1')),
+                              (60, '061006131036')]
+                    if frame.getParamValue(21) == b'000':
+                        params.append((900, 300))
+                response = self.smsc.cimd.createMessage(frame.opCode + 50, params,
+                                                        frame.packetNumber)
+                writer.write(cimd.toBytes(response))
+                if frame.opCode == 1 and self.deliverOnLogin:
+                    writer.write(cimd.toBytes(self.smsc.cimd.createMessage(
+                        20, [(21, '123'), (33, 'hello')], 2)))
+                if frame.opCode == 1 and self.closeAfterLogin:
+                    writer.close()
+                    return
+        except asyncio.IncompleteReadError:
+            writer.close()
+
+class AsyncSMSCClientTestCase(unittest.TestCase):
+    def run_async(self, coroutine):
+        return asyncio.run(asyncio.wait_for(coroutine, 10))
+
+    def testSessions(self):
+        """ Testing concurrent sessions sharing one event loop """
+        async def scenario():
+            server = fakeSMSC()
+            await server.start()
+            clients = [AsyncSMSCClient.AsyncSMSCClient('127.0.0.1', server.port, 'user',
+                                                       'pass', windowSize=8) for i in range(3)]
+            responses = await asyncio.gather(*[client.connect() for client in clients])
+            self.assertEqual([frame.opCode for frame in responses], [51, 51, 51])
+            submits = []
+            for client in clients:
+                for i in range(20):
+                    params = client.smscc.encodeTextMsgParams(destAddr='420%03d' % i,
+                                                              userData='text')
+                    submits.append(client.submitMessage(params))
+            responses = await asyncio.gather(*submits)
+            self.assertEqual([frame.getParamValue(21) for frame in responses],
+                             [('420%03d' % i).encode() for i in range(20)] * 3)
+            frame = await clients[0].alive()
+            self.assertEqual(frame.opCode, 90)
+            frame = await clients[0].enquireMessageStatus('420001', '061006131036')
+            self.assertEqual(frame.opCode, 54)
+            for client in clients:
+                await client.close()
+            await server.stop()
+            return server.sessions
+        self.assertEqual(self.run_async(scenario()), 3)
+
+    def testErrorResponse(self):
+        """ Testing error code in response raises CIMDError """
+        async def scenario():
+            server = fakeSMSC()
+            await server.start()
+            client = AsyncSMSCClient.AsyncSMSCClient('127.0.0.1', server.port, 'user', 'pass')
+            await client.connect()
+            params = client.smscc.encodeTextMsgParams(destAddr='000', userData='text')
+            try:
+                await client.submitMessage(params)
+            except cimd.CIMDError as e:
+                self.assertEqual(str(e), 'Incorrect destination address')
+            else:
+                self.fail('CIMDError not raised')
+            await client.close()
+            await server.stop()
+        self.run_async(scenario())
+
+    def testDeliverAck(self):
+        """ Testing deliver_msg is acked and passed to the inbound queue """
+        async def scenario():
+            server = fakeSMSC()
+            server.deliverOnLogin = True
+            await server.start()
+            queue = inbound.InboundQueue(None)
+            client = AsyncSMSCClient.AsyncSMSCClient('127.0.0.1', server.port, 'user', 'pass',
+                                                     inbound=queue)
+            await client.connect()
+            await client.alive()
+            self.assertEqual(server.received, [1, 70, 40])
+            self.assertEqual(queue.queue.get_nowait().opCode, 20)
+            await client.close()
+            await server.stop()
+        self.run_async(scenario())
+
+    def testConnectionLost(self):
+        """ Testing requests fail once the connection is lost or closed """
+        async def scenario():
+            server = fakeSMSC()
+            server.closeAfterLogin = True
+            await server.start()
+            client = AsyncSMSCClient.AsyncSMSCClient('127.0.0.1', server.port, 'user', 'pass',
+                                                     idleTimeout=None)
+            await client.connect()
+            await client.receiver
+            params = client.smscc.encodeTextMsgParams(destAddr='420123', userData='text')
+            for i in range(2):
+                try:
+                    await client.submitMessage(params)
+                except cimd.CIMDError as e:
+                    self.assertEqual(e.code, 4)
+                else:
+                    self.fail('CIMDError not raised')
+                await client.close()
+            await server.stop()
+        self.run_async(scenario())
+
+    def testReceiveFailure(self):
+        """ Testing requests fail when receiving ends with any error or close """
+        async def scenario():
+            server = fakeSMSC()
+            server.floodOnSubmit = True
+            server.answerAlive = False
+            await server.start()
+            client = AsyncSMSCClient.AsyncSMSCClient('127.0.0.1', server.port, 'user', 'pass',
+                                                     idleTimeout=None)
+            await client.connect()
+            params = client.smscc.encodeTextMsgParams(destAddr='420123', userData='text')
+            with self.assertRaises(cimd.CIMDError) as context:
+                await client.submitMessage(params)
+            self.assertEqual(context.exception.code, 4)
+            self.assertTrue(client.receiver.done())
+            await client.close()
+            await client.connect()
+            alive = asyncio.ensure_future(client.alive())
+            await asyncio.sleep(0.05)
+            await client.close()
+            with self.assertRaises(cimd.CIMDError) as context:
+                await alive
+            self.assertEqual(context.exception.code, 4)
+            await server.stop()
+        self.run_async(scenario())
+
+    def testKeepalive(self):
+        """ Testing alive on idle session and close on missing response """
+        async def scenario():
+            server = fakeSMSC()
+            await server.start()
+            client = AsyncSMSCClient.AsyncSMSCClient('127.0.0.1', server.port, 'user', 'pass',
+                                                     idleTimeout=0.05, aliveTimeout=0.05)
+            await client.connect()
+            await asyncio.sleep(0.2)
+            self.assertTrue(server.received.count(40) >= 2)
+            self.assertTrue(client.writer is not None)
+            server.answerAlive = False
+            await asyncio.sleep(0.3)
+            self.assertTrue(client.writer is None)
+            await server.stop()
+        self.run_async(scenario())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,123 +2,693 @@
 
 import sys, time
 import cimd
+import timer
+import wirelog
+import metrics
+import collections
+import random
 import logging
 import socket,asyncore,asynchat
 
+# Opcode number -> name used as metrics label
+opNames = dict((int(code), name) for name, code in cimd.SMSC.opCode.items())
+
+class ResponseFuture:
+    """ Outcome of one request, resolved by the response to it
+
+    The response is matched by packet number and expected response opcode
+    (request opcode + 50). The future resolves with the response as
+    cimd.CIMDFrame or fails with cimd.CIMDError carrying error text and
+    code of the SMSC. Functions given to addCallback() are called with the
+    future once it is done. callback, if given, is called with response
+    bytes as before futures were introduced; it is not called if the
+    request times out or the connection is lost, use addCallback() to
+    see those failures. messageId of a submit is remembered for its
+    status report, see reports.ReportIndex."""
+
+    def __init__(self, callback=None, messageId=None):
+        self.callback = callback
+        self.messageId = messageId
+        self.spoolEntry = None          # Journal entry of spooled submit
+        self.packetNumber = None
+        self.responseCode = None
+        self.timeout = None             # TimerWheel timer of the request
+        self.frame = None
+        self.error = None
+        self.isDone = False
+        self.doneCallbacks = []
+
+    def done(self):
+        return self.isDone
+
+    def result(self):
+        """ Returns response frame, raises CIMDError if the request failed """
+        if not self.isDone:
+            raise cimd.CIMDError('Response pending')
+        if self.error is not None:
+            raise self.error
+        return self.frame
+
+    def exception(self):
+        return self.error
+
+    def addCallback(self, func):
+        if self.isDone:
+            func(self)
+        else:
+            self.doneCallbacks.append(func)
+
+    def setResult(self, frame):
+        self.frame = frame
+        self.finish()
+
+    def setException(self, error):
+        self.error = error
+        self.finish()
+
+    def finish(self):
+        self.isDone = True
+        if self.timeout is not None:
+            self.timeout.cancel()
+            self.timeout = None
+        callbacks = self.doneCallbacks
+        self.doneCallbacks = []
+        for func in callbacks:
+            func(self)
+
 class SMSCClient(asynchat.async_chat):
     
-    def __init__ (self, host, port, username, password):
-        # Logging setup
-        logItemFormat = "%(asctime)-15s,%(msecs)d %(levelname)s:%(message)s"
-        logDateFormat = "%d.%m.%y %H:%M:%S"
-        logging.basicConfig(filename="client.log",filemode ='a',format=logItemFormat,
-                             datefmt=logDateFormat,level=logging.DEBUG)
+    def __init__ (self, host, port, username, password, windowSize=None,
+                  idleTimeout=60, aliveTimeout=10, scheduler=None,
+                  reconnectDelay=0.5, reconnectTimeout=10, subAddr=None,
+                  traceSampling=None, registry=None, responseTimeout=30,
+                  timeouts=None, inbound=None, reports=None, spool=None,
+                  spoolCommitDelay=0.005, rateLimiter=None, globalLimiter=None):
+        # Logging is set up by the application, wirelog.setup() writes
+        # client.log from a background thread
         self.log = logging.getLogger("SMSCClientl")
         self.log.debug("[SMSCClient started...]")
+        # Sampled wire tracing, see wirelog.setup() for queued file output
+        self.trace = wirelog.WireTrace(self.log, traceSampling)
 
         # Real constructor
         asynchat.async_chat.__init__(self)
         self.connection_phase = 0
-        self.reconnectTimeout = 10
-        self.terminatorBanner = "\n"
-        self.terminatorCIMD = cimd.CIMD.specChar.get('etx')
         self.host = host
         self.port = port
         self.username = username
         self.password = password
+        self.subAddr = subAddr          # Distinguishes sessions of one account
         self.smscc = cimd.SMSC()
         self.banner = ""
-        self.ibuffer = ""
-        self.callback = []
+        self.ibuffer = cimd.FrameBuffer()
+        self.futures = {}               # Packet number -> ResponseFuture
         self.obuffer = ""
+        self.windowSize = windowSize    # Max. number of requests in flight
+        self.sendQueue = collections.deque()        # (encoded params, future)
+        self.requestQueue = collections.deque()     # (builder, args, future)
+
+        # Metrics, sessions may share one metrics.Registry
+        if registry is None:
+            registry = metrics.Registry()
+        self.metrics = registry
+        self.sentAt = {}                # Packet number -> (opcode name, send time)
+        self.framesSent = registry.counter('cimd_frames_sent_total',
+                                           'CIMD frames sent', 'op')
+        self.framesReceived = registry.counter('cimd_frames_received_total',
+                                               'CIMD frames received', 'op')
+        self.errors = registry.counter('cimd_errors_total',
+                                       'Error codes reported by SMSC', 'code')
+        self.latency = registry.histogram('cimd_response_seconds',
+                                          'Request to response latency', label='op')
+        self.occupancy = registry.histogram('cimd_window_occupancy',
+                                            'Requests in flight after send',
+                                            (1, 2, 4, 8, 16, 32, 64, 128))
+        self.inFlightGauge = registry.gauge('cimd_in_flight',
+                                            'Requests waiting for response', 'subaddr')
+
+        # Keepalive: alive is sent after idleTimeout seconds without traffic,
+        # connection is closed if alive_resp does not come in aliveTimeout
+        if scheduler is None:
+            scheduler = timer.defaultScheduler
+        self.scheduler = scheduler
+        self.idleTimeout = idleTimeout
+        self.aliveTimeout = aliveTimeout
+        self.lastActivity = scheduler.clock()
+        self.idleTimer = None
+        self.aliveTimer = None
+
+        # Reconnect: delay doubles with every failed attempt up to
+        # reconnectTimeout seconds, randomized to avoid synchronized retries
+        self.autoReconnect = True
+        self.reconnectDelay = reconnectDelay
+        self.reconnectTimeout = reconnectTimeout
+        self.reconnectTimer = None
+        self.failedAttempts = 0         # Attempts since the link went down
+        self.downSince = None
+        self.reconnectAttempts = 0      # Counters
+        self.reconnects = 0
+        self.lastReconnectDuration = 0.0
+        self.reconnectDowntime = 0.0
+
+        # Requests fail if not answered in responseTimeout seconds, timeouts
+        # of all requests (of all sessions sharing it) live in one TimerWheel
+        self.responseTimeout = responseTimeout
+        if timeouts is None:
+            timeouts = timer.TimerWheel(scheduler)
+        self.timeouts = timeouts
+
+        # deliver_msg and deliver_status_rep go to inbound.InboundQueue,
+        # sessions may share one
+        self.inbound = inbound
+        # Submits with messageId are remembered in reports.ReportIndex,
+        # deliver_status_rep is queued as reports.StatusReport
+        self.reports = reports
+        # Submits are journaled in spool.Spool before they are sent. Journal
+        # is committed at most once per spoolCommitDelay seconds, submits
+        # wait for it, so one msync covers many messages. Entries of
+        # submits which fail are released, their futures report the error.
+        self.spool = spool
+        self.spoolCommitDelay = spoolCommitDelay
+        self.spoolTimer = None
+        self.lastSpoolCommit = 0.0
+
+        # Submits are paced by ratelimit.AIMDLimiter of the session, which
+        # follows congestion errors in responses, and by optional
+        # ratelimit.TokenBucket shared by all sessions
+        self.limiters = [limiter for limiter in (rateLimiter, globalLimiter)
+                         if limiter is not None]
+        self.rateLimiter = rateLimiter
+        self.rateTimer = None
+        self.sendRate = registry.gauge('cimd_send_rate',
+                                       'Submits per second allowed by rate limiter', 'subaddr')
+        if rateLimiter is not None:
+            self.sendRate.set(rateLimiter.rate, subAddr)
+
+        # Optional hooks called with the client as argument, e.g. by SMSCPool
+        self.onLogin = None
+        self.onConnectionLost = None
+        self.onResponse = None
 
         # Initial connect
         self.connect_now()
         
     def connect_now(self):
-        self.set_terminator(self.terminatorBanner)
+        # Frames are split by FrameBuffer, not by asynchat terminator
+        self.set_terminator(None)
         try:
             self.create_socket (socket.AF_INET, socket.SOCK_STREAM)
             self.connect((self.host, self.port))
         except:
             self.handle_error()
-            self.close()        
+            self.connectionLost()
 
     # handle_connect is called when a connection is successfully established.
     def handle_connect(self):
         self.connection_phase = 1
-        msg = "[Connected to "+self.host+":"+repr(self.port)+"]"
-        print msg
-        self.log.info(msg)
+        self.log.info("[Connected to %s:%r]", self.host, self.port)
         #self.push('Connected...\r\n')
 
     # Push overriden for logging
     def push(self,data):
-        self.log.debug("[Push]:"+data)
+        try:
+            opCode = int(data[1:3])
+        except ValueError:
+            opCode = None
+        self.trace.trace("Push", opCode, data)
+        self.lastActivity = self.scheduler.clock()
         asynchat.async_chat.push(self,data)
 
     def handle_error(self):
-        print >>sys.stderr, self.host, sys.exc_info()[1]
+        self.log.error("[Error] %s: %s", self.host, sys.exc_info()[1])
         
     # handle_expt is called when a connection fails (Windows), 
     # or when out-of-band data arrives (Unix)
     def handle_expt(self):
-        self.close()
-        msg = "Failed connect to "+self.host+":"+repr(self.port)
-        print >>sys.stderr, msg
-        self.log.warn(msg)
-        time.sleep(self.reconnectTimeout)
-        self.connect_now()
+        self.log.warn("[Failed connect to %s:%r]", self.host, self.port)
+        self.connectionLost()
 
     def collect_incoming_data(self, data):
-        """ Incoming data buffering """
-        self.ibuffer = self.ibuffer + data
+        """ Incoming data buffering, complete frames are handled at once """
+        self.ibuffer.feed(data)
+        if self.connection_phase == 1:
+            banner = self.ibuffer.readLine()
+            if banner is None:
+                return
+            # Received banner, sending login
+            self.connection_phase = 2
+            self.banner = banner.rstrip()
+            self.log.info("[Banner] %s", self.banner)
+            self.login()
+        for frame in self.ibuffer.frames():
+            self.handleFrame(frame)
         
     # handle_close is called when the socket is closed or reset.
     def handle_close (self):
         self.log.warn("[Remote connection closed or reset]")
-        self.close()
+        self.connectionLost()
         
     # Close overrriden
     def close(self):
         self.connection_phase = 0
+        self.stopKeepalive()
         self.log.info("[Closed connection]")
         asynchat.async_chat.close(self)
 
-    def found_terminator(self):
-        print "Received: "+self.ibuffer
+    def shutdown(self):
+        """ Closes the session for good, no reconnect follows """
+        self.autoReconnect = False
+        if self.reconnectTimer is not None:
+            self.reconnectTimer.cancel()
+            self.reconnectTimer = None
+        self.close()
 
-        if self.connection_phase == 1:
-            # Received banner, sending login
-            self.set_terminator(self.terminatorCIMD)
-            self.connection_phase = 2
-            self.banner = self.ibuffer
-            self.log.info("[Banner] "+self.ibuffer)
-            self.login()
+    def connectionLost(self):
+        """ Closes the connection and schedules reconnect
+
+        Reconnect runs as a scheduler timer, other sessions keep working
+        while this one waits."""
+        self.close()
+        self.discard_buffers()
+        self.ibuffer.clear()
+        futures = self.futures
+        self.futures = {}
+        self.sentAt = {}
+        self.inFlightGauge.set(0, self.subAddr)
+        if futures:
+            self.log.warn("[%d requests lost with connection]", len(futures))
+            error = cimd.CIMDError(self.smscc.commError[4], 4)
+            resend = []
+            for packetNumber in sorted(futures):
+                future = futures[packetNumber]
+                if future.spoolEntry is not None:
+                    resend.append(future)
+                else:
+                    future.setException(error)
+            self.resendSpooled(resend)
+        if self.onConnectionLost is not None:
+            self.onConnectionLost(self)
+        if not self.autoReconnect or self.reconnectTimer is not None:
+            return
+        if self.downSince is None:
+            self.downSince = self.scheduler.clock()
+        delay = min(self.reconnectTimeout, self.reconnectDelay * 2 ** self.failedAttempts)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.failedAttempts += 1
+        self.log.info("[Reconnect in %.2f s]", delay)
+        self.reconnectTimer = self.scheduler.callLater(delay, self.reconnect)
+
+    def reconnect(self):
+        self.reconnectTimer = None
+        self.reconnectAttempts += 1
+        self.connect_now()
+
+    def handleFrame(self, view):
+        """ Processes one received CIMD frame given as memoryview """
+        msg = view.tobytes()
+        now = self.lastActivity = self.scheduler.clock()
+        try:
+            # Parsed from the copy, frame may outlive the receive buffer
+            frame = self.smscc.cimd.parseFrame(msg)
+        except cimd.CIMDError:
+            self.log.warn("[Invalid CIMD frame] %r", msg)
+            return
+        self.trace.trace("CIMD", frame.opCode, msg)
+        self.framesReceived.inc(opNames.get(frame.opCode, frame.opCode))
+        if frame.opCode == 20 or frame.opCode == 23:
+            self.acknowledge(frame, msg)
+            return
+        error = self.smscc.responseError(frame)
+        if error is not None and error.code is not None:
+            self.errors.inc(error.code)
+        # Responses are matched by packet number and opcode, not arrival
+        # order. Nack and general error answer any request.
+        future = self.futures.get(frame.packetNumber)
+        if future is None or (frame.opCode != future.responseCode and frame.opCode < 98):
+            self.default_cb(msg)
         else:
-            # process CIMD msgs here
-            self.log.info("[CIMD] "+self.ibuffer)
-            cb_fun = self.callback.pop (0)
-            if cb_fun:
-                cb_fun(self.ibuffer)
+            del self.futures[frame.packetNumber]
+            sent = self.sentAt.pop(frame.packetNumber, None)
+            if sent is not None:
+                self.latency.observe(now - sent[1], sent[0])
+            if self.rateLimiter is not None and future.responseCode == 53:
+                self.adaptRate(frame, error)
+            if future.spoolEntry is not None:
+                if frame.opCode == 53 and error is None:
+                    self.spool.ack(future.spoolEntry)
+                else:
+                    self.spool.release(future.spoolEntry)
+            if future.callback is not None:
+                future.callback(msg)
+            if (future.messageId is not None and self.reports is not None
+                and frame.opCode == 53 and error is None):
+                self.reports.addResponse(frame, future.messageId)
+            if error is not None:
+                future.setException(error)
             else:
-                default_cb(self.ibuffer)
-            
-            self.close()
+                future.setResult(frame)
+        self.inFlightGauge.set(len(self.futures), self.subAddr)
+        if self.onResponse is not None:
+            self.onResponse(self)
+        self.sendWindow()
+
+    def adaptRate(self, frame, error):
+        """ Feeds submit response to the rate limiter of the session """
+        if error is None:
+            self.rateLimiter.success()
+        elif error.code == 10 or frame.opCode == 99:
+            if self.rateLimiter.congestion():
+                self.log.info("[Congestion, rate lowered to %.1f/s]", self.rateLimiter.rate)
+        else:
+            return
+        self.sendRate.set(self.rateLimiter.rate, self.subAddr)
+
+    def acknowledge(self, frame, msg):
+        """ Answers deliver_msg or deliver_status_rep without waiting
+
+        The frame is passed to the inbound queue, if it is full, nack is
+        sent instead of the ack and SMSC delivers the message again."""
+        if self.inbound is None:
+            self.default_cb(msg)
+            accepted = True
+        elif frame.opCode == 23 and self.reports is not None:
+            # Entry stays for the repeated report if the queue is full
+            report = self.reports.lookup(frame)
+            accepted = self.inbound.put(report)
+            if accepted:
+                self.reports.settle(report)
+        else:
+            accepted = self.inbound.put(frame)
+        if accepted:
+            ack = self.smscc.cimd.createAck(frame)
+        else:
+            ack = self.smscc.cimd.createAck(frame, 99)
+        self.framesSent.inc(opNames.get(int(ack[1:3])))
+        self.push(ack)
 
-        self.ibuffer = ""
-        
     # Default callback
     def default_cb(self, msg):
         self.log.debug("Default callback")
 
+    def expect(self, packetNumber, opCode, future, sentAt):
+        """ Registers future for the response to a sent request """
+        future.packetNumber = packetNumber
+        future.responseCode = opCode + 50
+        self.futures[packetNumber] = future
+        self.sentAt[packetNumber] = (opNames.get(opCode), sentAt)
+        if self.responseTimeout is not None:
+            future.timeout = self.timeouts.callLater(self.responseTimeout,
+                                                     self.responseExpired, future)
+
+    def responseExpired(self, future):
+        """ Fails request not answered in responseTimeout seconds
+
+        Spooled submits are sent again instead, see resendSpooled()."""
+        future.timeout = None
+        if self.futures.get(future.packetNumber) is not future:
+            return
+        del self.futures[future.packetNumber]
+        self.sentAt.pop(future.packetNumber, None)
+        self.log.warn("[No response to packet %d]", future.packetNumber)
+        self.inFlightGauge.set(len(self.futures), self.subAddr)
+        if future.spoolEntry is not None:
+            self.resendSpooled([future])
+        else:
+            future.setException(cimd.CIMDError(self.smscc.commError[5], 5))
+        self.sendWindow()
+
+    def resendSpooled(self, futures):
+        """ Queues spooled submits not answered for sending again
+
+        Their journal entries stay pending and futures wait for the
+        response to the new attempt. They go ahead of the queue, in the
+        given order, once the session is logged in."""
+        for future in reversed(futures):
+            if future.timeout is not None:
+                future.timeout.cancel()
+                future.timeout = None
+            self.sendQueue.appendleft((self.spool.record(future.spoolEntry), future))
+
+    def request(self, message, callback=None, future=None):
+        """ Sends CIMD message at once, returns ResponseFuture of its response """
+        if future is None:
+            future = ResponseFuture(callback)
+        opCode = int(message[1:3])
+        self.expect(int(message[4:7]), opCode, future, self.scheduler.clock())
+        self.framesSent.inc(opNames.get(opCode))
+        self.occupancy.observe(len(self.futures))
+        self.inFlightGauge.set(len(self.futures), self.subAddr)
+        self.push(message)
+        return future
+
+    def queueRequest(self, callback, builder, *args):
+        """ Queues request built by builder(*args) once window allows
+
+        Returns ResponseFuture, it fails if the message cannot be built."""
+        future = ResponseFuture(callback)
+        self.requestQueue.append((builder, args, future))
+        self.sendWindow()
+        return future
+
+    def logout(self, callback=None):
+        return self.queueRequest(callback, self.smscc.logout)
+
+    def enquireMessageStatus(self, destAddr, servCentreTimestamp, callback=None):
+        return self.queueRequest(callback, self.smscc.enquireMessageStatus,
+                                 destAddr, servCentreTimestamp)
+
+    def deliveryRequest(self, mode=1, callback=None):
+        return self.queueRequest(callback, self.smscc.deliveryRequest, mode)
+
+    def cancelMessage(self, mode, destAddr=None, servCentreTimestamp=None, callback=None):
+        return self.queueRequest(callback, self.smscc.cancelMessage, mode,
+                                 destAddr, servCentreTimestamp)
+
+    def setParam(self, symbol, value, callback=None):
+        return self.queueRequest(callback, self.smscc.setParam, symbol, value)
+
+    def getParam(self, symbol, callback=None):
+        return self.queueRequest(callback, self.smscc.getParam, symbol)
+
     def login(self):
-        self.push(self.smscc.login(userID=self.username,password=self.password))
-        self.callback.append(self.login_cb)
+        return self.request(self.smscc.login(userID=self.username,password=self.password,
+                                      subAddr=self.subAddr,windowSize=self.windowSize),
+                     self.login_cb)
     
     def login_cb(self, msg):
         self.log.debug("Login callback")
-        
+        # Error response or nack, the login future fails with it too
+        error = self.smscc.responseError(self.smscc.cimd.parseFrame(msg))
+        if error is not None:
+            self.log.error("[Login failed] %s", error)
+            self.connectionLost()
+            return
+        self.connection_phase = 3
+        self.failedAttempts = 0
+        if self.downSince is not None:
+            self.reconnects += 1
+            self.lastReconnectDuration = self.scheduler.clock() - self.downSince
+            self.reconnectDowntime += self.lastReconnectDuration
+            self.downSince = None
+        self.startKeepalive()
+        if self.onLogin is not None:
+            self.onLogin(self)
+        self.sendWindow()
+
+    def startKeepalive(self):
+        """ Schedules idle check of the logged in session """
+        if self.idleTimeout is not None and self.idleTimer is None:
+            self.idleTimer = self.scheduler.callLater(self.idleTimeout, self.checkIdle)
+
+    def stopKeepalive(self):
+        for timer in (self.idleTimer, self.aliveTimer):
+            if timer is not None:
+                timer.cancel()
+        self.idleTimer = None
+        self.aliveTimer = None
+
+    def checkIdle(self):
+        """ Sends alive if the session was idle for idleTimeout seconds """
+        self.idleTimer = None
+        if self.connection_phase != 3:
+            return
+        idle = self.scheduler.clock() - self.lastActivity
+        if idle < self.idleTimeout:
+            self.idleTimer = self.scheduler.callLater(self.idleTimeout - idle, self.checkIdle)
+            return
+        if self.aliveTimer is None:
+            self.log.debug("[Session idle, sending alive]")
+            self.request(self.smscc.alive(), self.alive_cb)
+            self.aliveTimer = self.scheduler.callLater(self.aliveTimeout, self.aliveExpired)
+
+    def alive_cb(self, msg):
+        self.log.debug("Alive callback")
+        if self.aliveTimer is not None:
+            self.aliveTimer.cancel()
+            self.aliveTimer = None
+        self.startKeepalive()
+
+    def aliveExpired(self):
+        """ Closes the session, SMSC did not answer alive in time """
+        self.aliveTimer = None
+        self.log.warn("[No alive response from SMSC, closing connection]")
+        self.connectionLost()
+
+    def inFlight(self):
+        """ Returns number of requests waiting for response """
+        return len(self.futures)
+
+    def isReady(self):
+        """ Returns True if the session is logged in """
+        return self.connection_phase == 3
+
+    def pending(self):
+        """ Returns number of requests not yet answered by SMSC """
+        return len(self.futures) + len(self.sendQueue) + len(self.requestQueue)
+
+    def load(self):
+        """ Returns sent and queued requests relative to window size """
+        return (float(len(self.futures) + len(self.sendQueue) + len(self.requestQueue))
+                / (self.windowSize or 1))
+
+    def sendWindow(self):
+        """ Sends queued requests while there is free room in the window
+
+        Other requests go first. All submits fitting into the window are
+        encoded into one buffer and sent with a single push."""
+        if self.connection_phase != 3 or not (self.sendQueue or self.requestQueue):
+            return
+        if self.spool is not None and self.spool.uncommitted and not self.commitSpool():
+            return
+        free = (self.windowSize or 1) - len(self.futures)
+        while free > 0 and self.requestQueue:
+            builder, args, future = self.requestQueue.popleft()
+            try:
+                message = builder(*args)
+            except cimd.CIMDError:
+                future.setException(sys.exc_info()[1])
+                continue
+            self.request(message, future=future)
+            free -= 1
+        if self.limiters and self.sendQueue and free > 0:
+            free = self.allowance(free)
+        batch = []
+        while free > 0 and self.sendQueue:
+            batch.append(self.sendQueue.popleft())
+            free -= 1
+        if not batch:
+            return
+        try:
+            buf, offsets = self.smscc.submitMessages([item[0] for item in batch])
+        except cimd.CIMDError:
+            batch = self.rejectInvalid(batch)
+            if not batch:
+                return
+            buf, offsets = self.smscc.submitMessages([item[0] for item in batch])
+        for limiter in self.limiters:
+            limiter.take(len(batch))
+        now = self.scheduler.clock()
+        for i in range(len(batch)):
+            start = offsets[i][0]
+            self.expect(int(buf[start+4:start+7]), 3, batch[i][1], now)
+        self.framesSent.inc('submit_msg', len(batch))
+        self.occupancy.observe(len(self.futures))
+        self.inFlightGauge.set(len(self.futures), self.subAddr)
+        self.push(bytes(buf))
+
+    def rejectInvalid(self, batch):
+        """ Fails futures of submits breaking the schema, returns the rest """
+        opCode = self.smscc.opCode['submit_msg']
+        valid = []
+        for encodedMsgParams, future in batch:
+            try:
+                self.smscc.validate(opCode,encodedMsgParams)
+            except cimd.CIMDError:
+                if future.spoolEntry is not None:
+                    self.spool.release(future.spoolEntry)
+                future.setException(sys.exc_info()[1])
+                continue
+            valid.append((encodedMsgParams, future))
+        return valid
+
+    def allowance(self, free):
+        """ Returns number of submits the rate limiters allow now
+
+        If it is none, sendWindow is scheduled for the time the next
+        submit may go."""
+        for limiter in self.limiters:
+            free = min(free, limiter.available())
+        if free <= 0 and self.rateTimer is None:
+            delay = max([limiter.delay() for limiter in self.limiters])
+            self.rateTimer = self.scheduler.callLater(delay, self.rateDue)
+        return free
+
+    def rateDue(self):
+        self.rateTimer = None
+        self.sendWindow()
+
+    def commitSpool(self):
+        """ Commits spool journal, returns False if the commit has to wait """
+        now = self.scheduler.clock()
+        wait = self.lastSpoolCommit + self.spoolCommitDelay - now
+        if wait > 0:
+            if self.spoolTimer is None:
+                self.spoolTimer = self.scheduler.callLater(wait, self.spoolCommitDue)
+            return False
+        self.spool.commit()
+        self.lastSpoolCommit = now
+        return True
+
+    def spoolCommitDue(self):
+        self.spoolTimer = None
+        self.sendWindow()
+
+    def replaySpool(self, callback=None):
+        """ Queues submits recovered from the spool, returns their futures
+
+        Recovered frames are sent with new packet numbers."""
+        futures = []
+        for entry, record in self.spool.recovered:
+            future = ResponseFuture(callback)
+            future.spoolEntry = entry
+            self.sendQueue.append((record, future))
+            futures.append(future)
+        self.spool.recovered = []
+        self.sendWindow()
+        return futures
+
+    def submitMessage(self, encodedMsgParams, callback=None, messageId=None):
+        """ Queues submit message, it is sent as soon as window allows
+
+        Returns ResponseFuture of submit_msg_resp."""
+        if messageId is None:
+            return self.submitMessages([encodedMsgParams], callback)[0]
+        return self.submitMessages([encodedMsgParams], callback, [messageId])[0]
+
+    def submitMessages(self, listOfEncodedMsgParams, callback=None, messageIds=None):
+        """ Queues batch of submit messages, returns list of ResponseFuture
+
+        messageIds, if given, are message IDs of the submits in order."""
+        opCode = self.smscc.opCode['submit_msg']
+        for encodedMsgParams in listOfEncodedMsgParams:
+            self.smscc.validate(opCode,encodedMsgParams)
+        futures = []
+        for i in range(len(listOfEncodedMsgParams)):
+            encodedMsgParams = listOfEncodedMsgParams[i]
+            future = ResponseFuture(callback, messageIds[i] if messageIds else None)
+            if self.spool is not None:
+                encodedMsgParams, future.spoolEntry = self.spool.add(self.smscc,
+                                                                     encodedMsgParams)
+            self.sendQueue.append((encodedMsgParams, future))
+            futures.append(future)
+        self.sendWindow()
+        return futures
+
+    def queueSubmit(self, encodedMsgParams, future):
+        """ Queues checked submit message with its future, e.g. from SMSCPool """
+        self.sendQueue.append((encodedMsgParams, future))
+        self.sendWindow()
+
         
 
 # 160.218.63.22:9971
@@ -127,6 +697,8 @@ class SMSCClient(asynchat.async_chat):
 
 if __name__ == "__main__":
 
+    logWriter = wirelog.setup("client.log")
     smsccl = SMSCClient('localhost',9971,'test31so','test31so')
-    asyncore.loop()
+    timer.loop()
     smsccl.log.debug("[...SMSCClient finished]\n")
+    logWriter.stop()
@@ -1,8 +1,12 @@
 """ Unit test for SMSCClient.py """
 
 import SMSCClient
+import SMSCSimulator
+import cimd
+import timer
+import time
 import unittest,logging
-import socket,asyncore
+import socket,asyncore,asynchat
 
 class fakeSMSCChannel(asyncore.dispatcher):
     
@@ -90,6 +94,270 @@ class fakeSMSC(asyncore.dispatcher):
     # an abbreviated traceback to sys.stdout.
         
 
+class windowSMSCChannel(asynchat.async_chat):
+    """ Answers login and holds submit responses until the window is full
+
+    Held responses are sent in reverse order, so a client which does not
+    pipeline requests or matches responses by arrival order fails."""
+
+    def __init__(self, channel, window, answerAlive=True):
+        asynchat.async_chat.__init__(self, channel)
+        self.smsc = cimd.SMSC()
+        self.window = window
+        self.answerAlive = answerAlive
+        self.received = []
+        self.subAddrs = []
+        self.ibuffer = ""
+        self.held = []
+        self.maxInFlight = 0
+        self.set_terminator(cimd.CIMD.specChar['etx'])
+        self.push("FakeCIMD2-A ConnectionInfo: SessionId = 1\n")
+
+    def collect_incoming_data(self, data):
+        self.ibuffer = self.ibuffer + data
+
+    def found_terminator(self):
+        msg = self.ibuffer + cimd.CIMD.specChar['etx']
+        self.ibuffer = ""
+        frame = self.smsc.cimd.parseFrame(msg)
+        self.received.append(frame.opCode)
+        if frame.opCode == 1:
+            self.subAddrs.append(frame.getParamValue(12))
+        if frame.opCode == 40 and not self.answerAlive:
+            return
+        if frame.opCode == 3:
+            params = [(21, frame.getParamValue(21)), (60, '061006131036')]
+        else:
+            params = []
+        response = self.smsc.cimd.createMessage(frame.opCode + 50, params, frame.packetNumber)
+        if frame.opCode != 3:
+            self.push(response)
+            return
+        self.held.append(response)
+        self.maxInFlight = max(self.maxInFlight, len(self.held))
+        if len(self.held) == self.window:
+            self.held.reverse()
+            for response in self.held:
+                self.push(response)
+            self.held = []
+
+class windowSMSC(asyncore.dispatcher):
+    """ Listener spawning windowSMSCChannel on an ephemeral port """
+    def __init__(self, window, answerAlive=True, port=0):
+        asyncore.dispatcher.__init__(self)
+        self.window = window
+        self.answerAlive = answerAlive
+        self.channels = []
+        self.create_socket(socket.AF_INET,socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind(("127.0.0.1",port))
+        self.listen(5)
+        self.port = self.getsockname()[1]
+
+    def handle_accept(self):
+        channel, addr = self.accept()
+        self.channels.append(windowSMSCChannel(channel, self.window, self.answerAlive))
+
+def loopUntil(condition, timeout=5.0, scheduler=None):
+    """ Runs asyncore loop until condition() is true or timeout expires """
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        timer.loop(scheduler, timeout=0.01, count=1)
+    return condition()
+
+class SMSCWindowTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+    def tearDown(self):
+        asyncore.close_all()
+    def testWindowedSubmit(self):
+        """ Testing pipelined submits matched by packet number """
+        server = windowSMSC(window=4)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=4,
+                                       scheduler=self.scheduler)
+        results = []
+        def submitted(msg, destAddr):
+            self.assertEqual(client.smscc.cimd.extractParamValue(msg,21),destAddr)
+            results.append(destAddr)
+        for i in range(8):
+            destAddr = '12345%03d' % i
+            params = client.smscc.encodeTextMsgParams(destAddr=destAddr,userData='text')
+            client.submitMessage(params, lambda msg, destAddr=destAddr: submitted(msg, destAddr))
+        self.assertTrue(loopUntil(lambda: len(results) == 8, scheduler=self.scheduler))
+        self.assertEqual(sorted(results),['12345%03d' % i for i in range(8)])
+        self.assertEqual(server.channels[0].maxInFlight,4)
+        self.assertEqual(client.inFlight(),0)
+        self.assertEqual(client.connection_phase,3)
+    def testMetrics(self):
+        """ Testing sent, received and latency metrics of the session """
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=2,
+                                       scheduler=self.scheduler)
+        for i in range(4):
+            client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='123',userData='x'))
+        self.assertTrue(loopUntil(lambda: client.pending() == 0, scheduler=self.scheduler))
+        self.assertEqual(client.framesSent.get('login'),1)
+        self.assertEqual(client.framesSent.get('submit_msg'),4)
+        self.assertEqual(client.framesReceived.get('submit_msg_resp'),4)
+        self.assertEqual(client.latency.get('submit_msg'),4)
+        self.assertEqual(client.occupancy.get(),4)
+        self.assertEqual(client.inFlightGauge.get(),0)
+        self.assertTrue('cimd_response_seconds_count{op="submit_msg"} 4' in client.metrics.render())
+
+class SMSCFutureTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+    def tearDown(self):
+        asyncore.close_all()
+    def testFutures(self):
+        """ Testing requests return futures resolved by matching responses """
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=2,
+                                       scheduler=self.scheduler)
+        done = []
+        futures = client.submitMessages([client.smscc.encodeTextMsgParams(destAddr=destAddr,
+                                                                          userData='x')
+                                         for destAddr in ('111','222')])
+        futures[0].addCallback(done.append)
+        getFuture = client.getParam(501)
+        self.assertFalse(getFuture.done())
+        self.assertRaises(cimd.CIMDError, getFuture.result)
+        self.assertTrue(loopUntil(lambda: getFuture.done() and client.pending() == 0,
+                                  scheduler=self.scheduler))
+        self.assertEqual(done,[futures[0]])
+        self.assertEqual([future.result().getParamValue(21) for future in futures],[b'111',b'222'])
+        self.assertEqual(futures[0].responseCode,53)
+        self.assertEqual(getFuture.result().opCode,59)
+        self.assertEqual(client.pending(),0)
+    def testResponseTimeout(self):
+        """ Testing unanswered request fails and frees its window slot """
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=2,
+                                       scheduler=self.scheduler,responseTimeout=0.2)
+        future = client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='123',
+                                                                       userData='x'))
+        self.assertTrue(loopUntil(future.done, scheduler=self.scheduler))
+        self.assertEqual(future.exception().code,5)
+        self.assertEqual(str(future.exception()),'No response from MC')
+        self.assertEqual(client.inFlight(),0)
+        self.assertEqual(len(client.timeouts),0)
+    def testInvalidSubmit(self):
+        """ Testing invalid queued submit fails only its own future """
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=4,
+                                       scheduler=self.scheduler)
+        self.assertRaises(cimd.CIMDError, client.submitMessages, [[('021','12a')]])
+        self.assertEqual(client.pending(),0)
+        futures = [SMSCClient.ResponseFuture() for i in range(3)]
+        client.queueSubmit(client.smscc.encodeTextMsgParams(destAddr='111',userData='x'),
+                           futures[0])
+        client.queueSubmit([('021','12a'),('033','x')], futures[1])
+        client.queueSubmit(client.smscc.encodeTextMsgParams(destAddr='333',userData='x'),
+                           futures[2])
+        self.assertTrue(loopUntil(lambda: all([future.done() for future in futures]),
+                                  scheduler=self.scheduler))
+        self.assertTrue(isinstance(futures[1].exception(), cimd.CIMDError))
+        self.assertEqual([futures[i].result().getParamValue(21) for i in (0, 2)],
+                         [b'111',b'333'])
+        self.assertEqual(client.pending(),0)
+    def testErrorResponse(self):
+        """ Testing error response fails the future with error code and text """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, congestionRate=1.0)
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',
+                                       scheduler=self.scheduler)
+        future = client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='123',
+                                                                       userData='x'))
+        self.assertTrue(loopUntil(future.done, scheduler=self.scheduler))
+        self.assertEqual(future.exception().code,10)
+        self.assertEqual(str(future.exception()),'Temporary congestion error')
+        self.assertEqual(client.errors.get(10),1)
+    def testConnectionLost(self):
+        """ Testing requests in flight fail when the connection is lost """
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=2,
+                                       scheduler=self.scheduler)
+        future = client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='123',
+                                                                       userData='x'))
+        self.assertTrue(loopUntil(lambda: client.isReady() and client.inFlight() == 1,
+                                  scheduler=self.scheduler))
+        client.shutdown()
+        client.connectionLost()
+        self.assertEqual(future.exception().code,4)
+        self.assertEqual(len(client.timeouts),0)
+
+class SMSCKeepaliveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+    def tearDown(self):
+        asyncore.close_all()
+    def testIdleAlive(self):
+        """ Testing alive is sent on idle session which stays open """
+        server = windowSMSC(window=1)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',
+                                       idleTimeout=0.1,aliveTimeout=0.5,
+                                       scheduler=self.scheduler)
+        self.assertTrue(loopUntil(lambda: server.channels and
+                                  server.channels[0].received.count(40) == 2,
+                                  scheduler=self.scheduler))
+        self.assertTrue(loopUntil(lambda: client.inFlight() == 0, scheduler=self.scheduler))
+        self.assertEqual(client.connection_phase,3)
+    def testAliveTimeout(self):
+        """ Testing session is closed when alive is not answered """
+        server = windowSMSC(window=1, answerAlive=False)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',
+                                       idleTimeout=0.1,aliveTimeout=0.1,
+                                       scheduler=self.scheduler)
+        self.assertTrue(loopUntil(lambda: server.channels and
+                                  40 in server.channels[0].received,
+                                  scheduler=self.scheduler))
+        self.assertEqual(client.connection_phase,3)
+        self.assertTrue(loopUntil(lambda: client.connection_phase == 0,
+                                  scheduler=self.scheduler))
+
+class SMSCReconnectTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+    def tearDown(self):
+        asyncore.close_all()
+    def testReconnect(self):
+        """ Testing reconnect with backoff after the SMSC comes back """
+        server = windowSMSC(window=1)
+        port = server.port
+        server.close()
+        client = SMSCClient.SMSCClient('127.0.0.1',port,'user','pass',
+                                       scheduler=self.scheduler,
+                                       reconnectDelay=0.01,reconnectTimeout=0.05)
+        self.assertTrue(loopUntil(lambda: client.reconnectAttempts >= 4,
+                                  scheduler=self.scheduler))
+        self.assertEqual(client.reconnects,0)
+        server = windowSMSC(window=1, port=port)
+        self.assertTrue(loopUntil(lambda: client.connection_phase == 3,
+                                  scheduler=self.scheduler))
+        self.assertEqual(client.reconnects,1)
+        self.assertTrue(client.lastReconnectDuration > 0)
+        self.assertEqual(client.reconnectDowntime,client.lastReconnectDuration)
+        # Remote close triggers reconnect, other timers keep running
+        server.channels[0].close()
+        self.assertTrue(loopUntil(lambda: client.reconnects == 2 and
+                                  client.connection_phase == 3, scheduler=self.scheduler))
+        client.shutdown()
+        self.assertEqual(self.scheduler.nextTimeout(),None)
+    def testLoginNack(self):
+        """ Testing nack to login is a failed login, not a session """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, nackRate=1.0)
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',
+                                       scheduler=self.scheduler,reconnectDelay=10)
+        futures = []
+        def login(login=client.login):
+            futures.append(login())
+        client.login = login
+        self.assertTrue(loopUntil(lambda: futures and futures[0].done(),
+                                  scheduler=self.scheduler))
+        self.assertEqual(str(futures[0].exception()),'Negative acknowledgement')
+        self.assertNotEqual(client.connection_phase,3)
+        self.assertTrue(client.reconnectTimer is not None)
+        client.shutdown()
+
 class SMSCClientTestCase(unittest.TestCase):
     def setUp(self):
         pass
@@ -0,0 +1,143 @@
+"""Pool of SMSC sessions sharing one account"""
+
+import collections
+import logging
+import cimd
+import timer
+import metrics
+import ratelimit
+import SMSCClient
+
+class SMSCPool:
+    """ Several sessions of one account logged in with distinct subaddr
+
+    Submits wait in the pool queue and are passed to the logged in session
+    with the lowest window occupancy as soon as its window has room.
+    Sessions which lose connection leave the rotation until they log in
+    again, their queued messages return to the pool queue. If rate is
+    given, each session starts at rate submits per second and adapts it
+    to congestion errors, globalRate caps the sum of all sessions."""
+
+    # Subaddr is a single digit
+    maxSessions = 10
+
+    def __init__(self, host, port, username, password, sessions=2, windowSize=None,
+                 scheduler=None, rate=None, globalRate=None, **clientArgs):
+        if sessions < 1 or sessions > self.maxSessions:
+            raise cimd.CIMDError('Invalid number of sessions')
+        self.log = logging.getLogger("SMSCPool")
+        if scheduler is None:
+            scheduler = timer.defaultScheduler
+        self.scheduler = scheduler
+        self.smscc = cimd.SMSC()
+        self.queue = collections.deque()    # Messages waiting for a session
+        self.sessions = []
+        # Sessions report into one registry unless given their own
+        self.metrics = clientArgs.setdefault('registry', metrics.Registry())
+        # and keep response timeouts in one timer wheel
+        self.timeouts = clientArgs.setdefault('timeouts', timer.TimerWheel(scheduler))
+        self.spool = clientArgs.get('spool')
+        if globalRate is not None:
+            clientArgs['globalLimiter'] = ratelimit.TokenBucket(globalRate, clock=scheduler.clock)
+        for subAddr in range(sessions):
+            if rate is not None:
+                clientArgs['rateLimiter'] = ratelimit.AIMDLimiter(rate, maxRate=globalRate,
+                                                                  clock=scheduler.clock)
+            client = SMSCClient.SMSCClient(host, port, username, password,
+                                           windowSize=windowSize, scheduler=scheduler,
+                                           subAddr=subAddr, **clientArgs)
+            client.onLogin = self.sessionReady
+            client.onConnectionLost = self.sessionLost
+            client.onResponse = self.windowOpen
+            self.sessions.append(client)
+
+    def activeSessions(self):
+        """ Returns list of logged in sessions """
+        return [session for session in self.sessions if session.isReady()]
+
+    def leastLoaded(self):
+        """ Returns logged in session with the lowest load and free window
+
+        If all windows are full, None is returned."""
+        best = None
+        bestLoad = 1.0
+        for session in self.sessions:
+            if session.isReady():
+                load = session.load()
+                if load < bestLoad:
+                    best = session
+                    bestLoad = load
+        return best
+
+    def dispatch(self):
+        """ Moves queued messages into free windows of the sessions """
+        while self.queue:
+            session = self.leastLoaded()
+            if session is None:
+                break
+            encodedMsgParams, future = self.queue.popleft()
+            session.queueSubmit(encodedMsgParams, future)
+
+    def pending(self):
+        """ Returns number of messages not yet answered by SMSC """
+        count = len(self.queue)
+        for session in self.sessions:
+            count += session.inFlight() + len(session.sendQueue)
+        return count
+
+    def submitMessage(self, encodedMsgParams, callback=None, messageId=None):
+        """ Queues submit message for the least loaded session
+
+        Returns SMSCClient.ResponseFuture of submit_msg_resp."""
+        if messageId is None:
+            return self.submitMessages([encodedMsgParams], callback)[0]
+        return self.submitMessages([encodedMsgParams], callback, [messageId])[0]
+
+    def submitMessages(self, listOfEncodedMsgParams, callback=None, messageIds=None):
+        opCode = self.smscc.opCode['submit_msg']
+        for encodedMsgParams in listOfEncodedMsgParams:
+            self.smscc.validate(opCode,encodedMsgParams)
+        futures = []
+        for i in range(len(listOfEncodedMsgParams)):
+            encodedMsgParams = listOfEncodedMsgParams[i]
+            future = SMSCClient.ResponseFuture(callback, messageIds[i] if messageIds else None)
+            if self.spool is not None:
+                encodedMsgParams, future.spoolEntry = self.spool.add(self.smscc,
+                                                                     encodedMsgParams)
+            self.queue.append((encodedMsgParams, future))
+            futures.append(future)
+        self.dispatch()
+        return futures
+
+    def replaySpool(self, callback=None):
+        """ Queues submits recovered from the shared spool, returns their futures """
+        futures = []
+        for entry, record in self.spool.recovered:
+            future = SMSCClient.ResponseFuture(callback)
+            future.spoolEntry = entry
+            self.queue.append((record, future))
+            futures.append(future)
+        self.spool.recovered = []
+        self.dispatch()
+        return futures
+
+    def sessionReady(self, session):
+        self.log.info("[Session %d ready]", session.subAddr)
+        self.dispatch()
+
+    def windowOpen(self, session):
+        self.dispatch()
+
+    def sessionLost(self, session):
+        """ Session left rotation, its queued messages return to the pool """
+        self.log.warn("[Session %d lost, %d queued messages returned]",
+                      session.subAddr, len(session.sendQueue))
+        queue = session.sendQueue
+        session.sendQueue = collections.deque()
+        queue.reverse()
+        self.queue.extendleft(queue)
+        self.dispatch()
+
+    def shutdown(self):
+        for session in self.sessions:
+            session.shutdown()
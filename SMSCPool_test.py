@@ -0,0 +1,70 @@
+""" Unit test for SMSCPool.py """
+
+import SMSCPool
+import SMSCClient
+import cimd
+import timer
+import unittest
+import asyncore
+from SMSCClient_test import windowSMSC, loopUntil
+
+class SMSCPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+        self.server = windowSMSC(window=1)
+        self.pool = SMSCPool.SMSCPool('127.0.0.1',self.server.port,'user','pass',sessions=3,
+                                      windowSize=4,scheduler=self.scheduler)
+        self.results = []
+    def tearDown(self):
+        self.pool.shutdown()
+        asyncore.close_all()
+    def submitted(self, msg):
+        self.results.append(cimd.CIMD().extractParamValue(msg,21))
+    def params(self, count):
+        smsc = cimd.SMSC()
+        return [smsc.encodeTextMsgParams(destAddr='420%03d' % i,userData='text')
+                for i in range(count)]
+    def testDistinctSubaddr(self):
+        """ Testing sessions log in with distinct subaddr """
+        self.assertTrue(loopUntil(lambda: len(self.pool.activeSessions()) == 3,
+                                  scheduler=self.scheduler))
+        subAddrs = sorted([channel.subAddrs[0] for channel in self.server.channels])
+        self.assertEqual(subAddrs,['0','1','2'])
+        self.assertRaises(cimd.CIMDError,SMSCPool.SMSCPool,'127.0.0.1',1,'u','p',sessions=11)
+    def testLoadBalancing(self):
+        """ Testing submits are spread over sessions, queued before login """
+        self.pool.submitMessages(self.params(30), self.submitted)
+        self.assertEqual(len(self.pool.queue),30)
+        self.assertTrue(loopUntil(lambda: len(self.results) == 30, scheduler=self.scheduler))
+        self.assertEqual(sorted(self.results),['420%03d' % i for i in range(30)])
+        self.assertEqual(self.pool.pending(),0)
+        # All sessions logged in, windows fill evenly
+        self.assertTrue(loopUntil(lambda: len(self.pool.activeSessions()) == 3,
+                                  scheduler=self.scheduler))
+        for channel in self.server.channels:
+            channel.received = []
+        self.pool.submitMessages(self.params(30), self.submitted)
+        self.assertEqual([session.inFlight() for session in self.pool.sessions],[4,4,4])
+        self.assertEqual(len(self.pool.queue),18)
+        self.assertTrue(loopUntil(lambda: len(self.results) == 60, scheduler=self.scheduler))
+        self.assertEqual(sum([channel.received.count(3) for channel in self.server.channels]),30)
+        for channel in self.server.channels:
+            self.assertTrue(channel.received.count(3) >= 4)
+    def testFailedSession(self):
+        """ Testing queued messages of a failed session are not lost """
+        self.assertTrue(loopUntil(lambda: len(self.pool.activeSessions()) == 3,
+                                  scheduler=self.scheduler))
+        failed = self.pool.sessions[0]
+        failed.autoReconnect = False
+        failed.sendQueue.extend([(params, SMSCClient.ResponseFuture(self.submitted))
+                                 for params in self.params(6)])
+        failed.connectionLost()
+        self.assertEqual(len(self.pool.activeSessions()),2)
+        self.assertEqual(len(failed.sendQueue),0)
+        self.assertTrue(loopUntil(lambda: len(self.results) == 6, scheduler=self.scheduler))
+        self.pool.submitMessages(self.params(4), self.submitted)
+        self.assertTrue(loopUntil(lambda: len(self.results) == 10, scheduler=self.scheduler))
+        self.assertEqual(self.server.channels[0].received.count(3),0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,304 @@
+"""Local SMSC emulator for offline load and end-to-end tests"""
+
+import sys, time
+import cimd
+import timer
+import random
+import logging
+import socket,asyncore,asynchat
+
+class SimulatorChannel(asynchat.async_chat):
+    """ One client session of SMSCSimulator
+
+    Requests are answered after the configured latency. Requests over the
+    negotiated window are answered with nack. SMSC originated messages
+    use even packet numbers."""
+
+    def __init__(self, server, sock):
+        asynchat.async_chat.__init__(self, sock)
+        self.server = server
+        self.smscc = cimd.SMSC()
+        self.ibuffer = cimd.FrameBuffer()
+        self.set_terminator(None)
+        self.loggedIn = False
+        self.username = None
+        self.subAddr = None
+        self.windowSize = 1
+        self.inFlight = 0               # Requests received and not answered
+        self.packetNumber = 0           # Last SMSC originated packet number
+        self.unacked = {}               # Packet number -> SMSC originated message
+        self.push("%s ConnectionInfo: SessionId = %d PortId = %d Time = %s "
+                  "AccessType = TCPIP_SOCKET\n" % (server.bannerText, id(self) % 10000000,
+                  server.port, time.strftime('%y%m%d%H%M%S')))
+
+    def collect_incoming_data(self, data):
+        self.ibuffer.feed(data)
+        for view in self.ibuffer.frames():
+            self.handleFrame(view)
+            if not self.connected:
+                break
+
+    def handle_close(self):
+        self.close()
+
+    def close(self):
+        self.server.sessionClosed(self)
+        asynchat.async_chat.close(self)
+
+    def nextPacketNumber(self):
+        self.packetNumber = (self.packetNumber + 2) % 256
+        return self.packetNumber
+
+    def handleFrame(self, view):
+        server = self.server
+        try:
+            frame = self.smscc.cimd.parseFrame(view)
+        except cimd.CIMDError:
+            server.count('invalid')
+            return
+        opCode = frame.opCode
+        server.count(opCode)
+        if opCode >= 50:
+            # Client response to deliver_msg or deliver_status_rep
+            self.unacked.pop(frame.packetNumber, None)
+            return
+        rnd = server.random
+        if server.disconnectRate and rnd.random() < server.disconnectRate:
+            server.count('disconnect')
+            self.close()
+            return
+        self.inFlight += 1
+        if self.inFlight > self.windowSize:
+            server.count('window_exceeded')
+            response = self.smscc.cimd.createMessage(self.smscc.opCode['nack'], [],
+                                                     frame.packetNumber)
+        elif server.nackRate and rnd.random() < server.nackRate:
+            server.count('nack')
+            response = self.smscc.cimd.createMessage(self.smscc.opCode['nack'], [],
+                                                     frame.packetNumber)
+        elif (server.congestionRate and opCode != 1 and opCode != 40
+              and rnd.random() < server.congestionRate):
+            server.count('congestion')
+            response = self.createResponse(frame, [], 10)
+        else:
+            response = self.answer(frame)
+        latency = server.latency()
+        if latency > 0:
+            server.scheduler.callLater(latency, self.respond, response, opCode)
+        else:
+            self.respond(response, opCode)
+
+    def respond(self, response, opCode):
+        if not self.connected:
+            return
+        self.inFlight -= 1
+        self.push(response)
+        if opCode == 2:
+            self.close_when_done()
+
+    def createResponse(self, frame, params, errorCode=None):
+        if errorCode is not None:
+            params = params + [(self.smscc.symbol['error_code'], errorCode),
+                               (self.smscc.symbol['error_text'],
+                                self.smscc.commError.get(errorCode, ''))]
+        return self.smscc.cimd.createMessage(frame.opCode + 50, params, frame.packetNumber,
+                                             frame.checksum is not None)
+
+    def answer(self, frame):
+        """ Returns response to a request """
+        symbol = self.smscc.symbol
+        opCode = frame.opCode
+        if opCode == 1:
+            return self.login(frame)
+        if not self.loggedIn:
+            return self.createResponse(frame, [], 1)
+        if opCode == 3:
+            destAddr = frame.getParamValue(symbol['dest_addr'])
+            if not destAddr:
+                return self.createResponse(frame, [], 300)
+            destAddr = cimd.toNative(destAddr)
+            scts = self.server.timestamp(destAddr)
+            if self.server.statusReports or frame.hasParam(symbol['status_report_req']):
+                self.server.scheduler.callLater(self.server.statusReportDelay,
+                                                self.deliverStatusReport, destAddr, scts)
+            return self.createResponse(frame, [(symbol['dest_addr'], destAddr),
+                                               (symbol['serv_centre_timestamp'], scts)])
+        if opCode == 4:
+            destAddr = frame.getParamValue(symbol['dest_addr'])
+            scts = frame.getParamValue(symbol['serv_centre_timestamp'])
+            if destAddr is None:
+                return self.createResponse(frame, [], 400)
+            if scts is None:
+                return self.createResponse(frame, [], 401)
+            return self.createResponse(frame, [(symbol['dest_addr'], cimd.toNative(destAddr)),
+                                               (symbol['serv_centre_timestamp'], cimd.toNative(scts)),
+                                               (symbol['status_code'], self.server.reportStatus)])
+        if opCode == 5:
+            return self.createResponse(frame, [(symbol['msg_count'], 0)])
+        if opCode == 9:
+            return self.createResponse(frame, [(symbol['mc_time'], self.server.timestamp())])
+        # logout, cancel, set and alive need no response parameters
+        return self.createResponse(frame, [])
+
+    def login(self, frame):
+        symbol = self.smscc.symbol
+        username = frame.getParamValue(symbol['user_id'])
+        password = frame.getParamValue(symbol['password'])
+        accounts = self.server.accounts
+        if username is None or password is None:
+            return self.createResponse(frame, [], 100)
+        username = cimd.toNative(username)
+        if accounts is not None and accounts.get(username) != cimd.toNative(password):
+            return self.createResponse(frame, [], 100)
+        windowSize = frame.getParamValue(symbol['window_size'])
+        if windowSize is not None:
+            windowSize = int(windowSize)
+            if windowSize < 1 or windowSize > 128:
+                return self.createResponse(frame, [], 104)
+            self.windowSize = windowSize
+        subAddr = frame.getParamValue(symbol['subaddr'])
+        if subAddr is not None:
+            self.subAddr = int(subAddr)
+        self.username = username
+        self.loggedIn = True
+        return self.createResponse(frame, [])
+
+    def pushOriginated(self, opCode, params):
+        packetNumber = self.nextPacketNumber()
+        message = self.smscc.cimd.createMessage(opCode, params, packetNumber)
+        self.unacked[packetNumber] = message
+        self.push(message)
+        self.server.count(int(opCode))
+
+    def deliverMessage(self, origAddr, destAddr, userData):
+        """ Pushes mobile originated message to the client """
+        symbol = self.smscc.symbol
+        self.pushOriginated(self.smscc.opCode['deliver_msg'],
+                            [(symbol['dest_addr'], destAddr),
+                             (symbol['orig_addr'], origAddr),
+                             (symbol['serv_centre_timestamp'], self.server.timestamp()),
+                             (symbol['user_data'], userData)])
+
+    def deliverStatusReport(self, destAddr, scts):
+        if not self.connected:
+            return
+        symbol = self.smscc.symbol
+        self.pushOriginated(self.smscc.opCode['deliver_status_rep'],
+                            [(symbol['dest_addr'], destAddr),
+                             (symbol['serv_centre_timestamp'], scts),
+                             (symbol['status_code'], self.server.reportStatus),
+                             (symbol['discharge_time'], self.server.timestamp())])
+
+class SMSCSimulator(asyncore.dispatcher):
+    """ SMSC emulator answering all CIMD operations
+
+    latency is response delay in seconds, fixed or (min, max) range.
+    congestionRate, nackRate and disconnectRate are probabilities of
+    answering a request with error 10, nack or closing the session.
+    Submits requesting status report (or all, if statusReports is set)
+    get deliver_status_rep after statusReportDelay seconds. accounts maps
+    user_id to password, None accepts any login. Run it with timer.loop()
+    which uses poll(), so thousands of sessions fit one process."""
+
+    bannerText = "CIMD2-A SMSCSimulator"
+    maxTimestamps = 100000              # Destinations tracked before pruning
+
+    def __init__(self, host='127.0.0.1', port=0, scheduler=None, latency=0.0,
+                 congestionRate=0.0, nackRate=0.0, disconnectRate=0.0,
+                 statusReports=False, statusReportDelay=0.0, reportStatus=4,
+                 accounts=None, seed=None, backlog=1024):
+        asyncore.dispatcher.__init__(self)
+        self.log = logging.getLogger("SMSCSimulator")
+        if scheduler is None:
+            scheduler = timer.defaultScheduler
+        self.scheduler = scheduler
+        self.latencyRange = latency
+        self.congestionRate = congestionRate
+        self.nackRate = nackRate
+        self.disconnectRate = disconnectRate
+        self.statusReports = statusReports
+        self.statusReportDelay = statusReportDelay
+        self.reportStatus = reportStatus
+        self.accounts = accounts
+        self.random = random.Random(seed)
+        self.sessions = []
+        self.counters = {}              # Opcode or event name -> count
+        self.lastTimestamps = {}        # Destination -> last scts in seconds
+        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.set_reuse_addr()
+        self.bind((host, port))
+        self.listen(backlog)
+        self.port = self.getsockname()[1]
+        self.log.info("[Listening on %s:%d]", host, self.port)
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is None:
+            return
+        self.sessions.append(SimulatorChannel(self, pair[0]))
+
+    def sessionClosed(self, channel):
+        if channel in self.sessions:
+            self.sessions.remove(channel)
+
+    def count(self, key):
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def latency(self):
+        if isinstance(self.latencyRange, tuple):
+            return self.random.uniform(*self.latencyRange)
+        return self.latencyRange
+
+    def timestamp(self, destAddr=None):
+        """ Returns service centre timestamp of now
+
+        Timestamps have seconds resolution. If destAddr is given, the
+        timestamp is unique for the destination, submits to it within
+        one second are stepped one second apart, so (dest_addr, scts)
+        identifies a submit."""
+        now = int(time.time())
+        if destAddr is not None:
+            last = self.lastTimestamps.get(destAddr)
+            if last is not None and now <= last:
+                now = last + 1
+            self.lastTimestamps[destAddr] = now
+            if len(self.lastTimestamps) > self.maxTimestamps:
+                # Only timestamps not yet passed can collide
+                current = int(time.time())
+                self.lastTimestamps = dict([(addr, last) for addr, last
+                                            in self.lastTimestamps.items() if last >= current])
+        return time.strftime('%y%m%d%H%M%S', time.localtime(now))
+
+    def loggedIn(self):
+        """ Returns logged in sessions """
+        return [channel for channel in self.sessions if channel.loggedIn]
+
+    def deliverMessage(self, origAddr, destAddr, userData, username=None):
+        """ Pushes deliver_msg to a random logged in session
+
+        If username is given, only sessions of that account are used.
+        Returns the session or None if there is none."""
+        sessions = [channel for channel in self.loggedIn()
+                    if username is None or channel.username == username]
+        if not sessions:
+            return None
+        channel = self.random.choice(sessions)
+        channel.deliverMessage(origAddr, destAddr, userData)
+        return channel
+
+    def shutdown(self):
+        for channel in list(self.sessions):
+            channel.close()
+        self.close()
+
+if __name__ == "__main__":
+    # Standalone emulator, e.g. python SMSCSimulator.py 9971 0.01
+    logging.basicConfig(level=logging.INFO)
+    port = 9971
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    latency = 0.0
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+    simulator = SMSCSimulator('', port, latency=latency, statusReports=True)
+    timer.loop()
@@ -0,0 +1,127 @@
+""" Unit test for SMSCSimulator.py """
+
+import SMSCSimulator
+import SMSCClient
+import cimd
+import timer
+import asyncore
+import unittest
+from SMSCClient_test import loopUntil
+
+class SMSCSimulatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+    def tearDown(self):
+        asyncore.close_all()
+    def client(self, server, **args):
+        return SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',
+                                     scheduler=self.scheduler, **args)
+    def submit(self, client, count, results):
+        for i in range(count):
+            params = client.smscc.encodeTextMsgParams(destAddr='4201%05d' % i,userData='text')
+            client.submitMessage(params, results.append)
+    def testSubmitAndReports(self):
+        """ Testing windowed submits get scts and status reports """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler,latency=(0.001,0.01),
+                                             statusReports=True)
+        reports = []
+        client = self.client(server, windowSize=4)
+        client.default_cb = reports.append
+        results = []
+        self.submit(client, 20, results)
+        self.assertTrue(loopUntil(lambda: len(reports) == 20, scheduler=self.scheduler))
+        for msg in results:
+            self.assertEqual(len(client.smscc.cimd.extractParamValue(msg,60)),12)
+            self.assertEqual(client.smscc.cimd.extractParamValue(msg,900),None)
+        self.assertEqual(server.counters[3],20)
+        self.assertEqual(server.counters[23],20)
+        self.assertFalse('window_exceeded' in server.counters)
+        self.assertEqual(client.smscc.cimd.parseFrame(reports[0]).opCode,23)
+    def testUniqueTimestamps(self):
+        """ Testing scts of submits to one destination are unique """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler)
+        stamps = [server.timestamp('420123') for i in range(3)]
+        self.assertEqual(len(set(stamps)),3)
+        self.assertEqual(sorted(stamps),stamps)
+        self.assertEqual(len(server.timestamp('420999')),12)
+        server.maxTimestamps = 1
+        server.timestamp('420888')
+        self.assertTrue(len(server.lastTimestamps) <= 3)
+    def testRequests(self):
+        """ Testing every request operation is answered """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler)
+        client = self.client(server)
+        self.assertTrue(loopUntil(client.isReady, scheduler=self.scheduler))
+        smscc = client.smscc
+        responses = []
+        for message in (smscc.enquireMessageStatus('123','061006131036'),
+                        smscc.deliveryRequest(1), smscc.cancelMessage(1,'123'),
+                        smscc.setParam(11,'new'), smscc.getParam(501),
+                        smscc.alive(), smscc.logout()):
+            client.request(message, responses.append)
+            self.assertTrue(loopUntil(lambda: client.inFlight() == 0, scheduler=self.scheduler))
+        opCodes = [smscc.cimd.parseFrame(msg).opCode for msg in responses]
+        self.assertEqual(opCodes,[54,55,56,58,59,90,52])
+        self.assertEqual(len(smscc.cimd.extractParamValue(responses[4],501)),12)
+    def testInvalidLogin(self):
+        """ Testing login is refused for unknown account """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler,accounts={'user':'secret'})
+        client = self.client(server, reconnectDelay=5)
+        self.assertTrue(loopUntil(lambda: client.errors.get(100) == 1, scheduler=self.scheduler))
+        self.assertFalse(client.isReady())
+    def testWindowExceeded(self):
+        """ Testing requests over the negotiated window are nacked """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler,latency=0.05)
+        client = self.client(server, windowSize=2)
+        self.assertTrue(loopUntil(client.isReady, scheduler=self.scheduler))
+        client.windowSize = 3           # Client breaks the negotiated window
+        results = []
+        self.submit(client, 3, results)
+        self.assertTrue(loopUntil(lambda: len(results) == 3, scheduler=self.scheduler))
+        self.assertEqual(server.counters['window_exceeded'],1)
+        self.assertEqual(client.framesReceived.get('nack'),1)
+    def testErrorInjection(self):
+        """ Testing congestion errors, nacks and disconnects """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler,congestionRate=1.0)
+        client = self.client(server)
+        results = []
+        self.submit(client, 2, results)
+        self.assertTrue(loopUntil(lambda: len(results) == 2, scheduler=self.scheduler))
+        self.assertEqual(client.errors.get(10),2)
+        server.congestionRate = 0.0
+        server.nackRate = 1.0
+        self.submit(client, 1, results)
+        self.assertTrue(loopUntil(lambda: len(results) == 3, scheduler=self.scheduler))
+        self.assertEqual(client.framesReceived.get('nack'),1)
+        server.nackRate = 0.0
+        server.disconnectRate = 1.0
+        client.reconnectDelay = 0.01
+        self.submit(client, 1, results)
+        self.assertTrue(loopUntil(lambda: client.reconnectAttempts >= 1, scheduler=self.scheduler))
+        self.assertEqual(server.counters['disconnect'],1)
+    def testDeliverMessage(self):
+        """ Testing mobile originated message is pushed to a session """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler)
+        received = []
+        client = self.client(server)
+        client.default_cb = received.append
+        self.assertTrue(loopUntil(client.isReady, scheduler=self.scheduler))
+        self.assertTrue(server.deliverMessage('420123456789','12345','STOP') is not None)
+        self.assertTrue(loopUntil(lambda: received, scheduler=self.scheduler))
+        frame = client.smscc.cimd.parseFrame(received[0])
+        self.assertEqual(frame.opCode,20)
+        self.assertEqual(frame.packetNumber % 2,0)
+        self.assertEqual(frame.getParamValue(33),b'STOP')
+    def testManySessions(self):
+        """ Testing hundreds of concurrent sessions """
+        server = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler)
+        clients = [self.client(server, windowSize=8) for i in range(300)]
+        results = []
+        for client in clients:
+            self.submit(client, 5, results)
+        self.assertTrue(loopUntil(lambda: len(results) == 1500, timeout=30,
+                                  scheduler=self.scheduler))
+        self.assertEqual(len(server.loggedIn()),300)
+
+if __name__ == "__main__":
+    unittest.main()
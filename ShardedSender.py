@@ -0,0 +1,194 @@
+"""Multiprocess sender for bulk campaigns
+
+Destinations are sharded over worker processes by a stable hash of the
+destination address. Every worker encodes its messages with its own
+SMSC builder and drives its own session."""
+
+import multiprocessing
+import sys
+import time
+import zlib
+import cimd
+import timer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def shardOf(destAddr, shards):
+    """ Returns shard index of the destination address
+
+    CRC32 does not depend on the interpreter hash seed, so the same
+    destination always ends up in the same worker."""
+    return (zlib.crc32(cimd.toBytes(destAddr)) & 0xFFFFFFFF) % shards
+
+def worker(index, inbox, outbox, sessionFactory, collectResults, drainTimeout=None):
+    """ Worker process main loop
+
+    Reads batches of encodeTextMsgParams keyword dictionaries, submits
+    them through the session and reports results and counters. If the
+    session fails or responses do not come in drainTimeout seconds after
+    a batch, the error is reported and the worker stops. Counters are
+    reported in any case."""
+    smsc = cimd.SMSC()
+    counters = {'submitted': 0, 'accepted': 0, 'rejected': 0, 'invalid': 0}
+    errors = {}
+    results = []
+
+    def submitted(future, destAddr):
+        # Error responses, nacks, timeouts and lost connections all fail
+        # the future, code of the error is None for nack
+        error = future.exception()
+        errorCode = None
+        if error is None:
+            counters['accepted'] += 1
+        else:
+            errorCode = error.code
+            counters['rejected'] += 1
+            errors[errorCode] = errors.get(errorCode, 0) + 1
+        if collectResults:
+            results.append((destAddr, errorCode))
+
+    try:
+        session = sessionFactory(index)
+        while True:
+            batch = inbox.get()
+            if batch is None:
+                break
+            for msgParams in batch:
+                try:
+                    encodedMsgParams = smsc.encodeTextMsgParams(**msgParams)
+                except cimd.CIMDError:
+                    counters['invalid'] += 1
+                    continue
+                destAddr = msgParams['destAddr']
+                future = session.submitMessage(encodedMsgParams)
+                future.addCallback(lambda future, destAddr=destAddr: submitted(future, destAddr))
+                counters['submitted'] += 1
+            if drainTimeout is not None:
+                deadline = time.time() + drainTimeout
+            while session.pending():
+                if drainTimeout is not None and time.time() > deadline:
+                    raise cimd.CIMDError('%d requests not answered in %s s'
+                                         % (session.pending(), drainTimeout))
+                timer.loop(timeout=0.05, count=1)
+            if results:
+                outbox.put(('results', index, results))
+                results = []
+    except Exception:
+        outbox.put(('error', index, '%s: %s' % (sys.exc_info()[0].__name__, sys.exc_info()[1])))
+    if results:
+        outbox.put(('results', index, results))
+    outbox.put(('done', index, (counters, errors)))
+
+class ShardedSender:
+    """ Process pool sending messages sharded by destination address
+
+        Parameters:
+            sessionFactory --- module level callable creating the session of
+                               a worker from its index, e.g. SMSCClient or
+                               SMSCPool; it is called in the worker process
+            workers --- number of worker processes, CPU count by default
+            batchSize --- messages handed to a worker at once
+            collectResults --- keep (destAddr, errorCode) of every message
+            drainTimeout --- seconds a worker waits for responses to a batch
+            pollInterval --- seconds between checks of worker processes
+
+        Workers which failed or exited without reporting are listed in
+        failures as {worker index : error text}.
+    """
+
+    def __init__(self, sessionFactory, workers=None, batchSize=500, collectResults=False,
+                 drainTimeout=300, pollInterval=1.0):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.sessionFactory = sessionFactory
+        self.workers = workers
+        self.batchSize = batchSize
+        self.collectResults = collectResults
+        self.drainTimeout = drainTimeout
+        self.pollInterval = pollInterval
+        self.processes = []
+        self.inboxes = []
+        self.outbox = None
+        self.batches = [[] for i in range(workers)]
+        self.counters = {}
+        self.errors = {}
+        self.results = []
+        self.failures = {}
+
+    def start(self):
+        self.outbox = multiprocessing.Queue()
+        for index in range(self.workers):
+            inbox = multiprocessing.Queue()
+            process = multiprocessing.Process(target=worker,
+                        args=(index, inbox, self.outbox, self.sessionFactory,
+                              self.collectResults, self.drainTimeout))
+            process.daemon = True
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+
+    def submit(self, **msgParams):
+        """ Queues message given as encodeTextMsgParams keyword arguments """
+        destAddr = msgParams.get('destAddr')
+        if destAddr is None:
+            raise cimd.CIMDError('Destination address missing')
+        index = shardOf(destAddr, self.workers)
+        batch = self.batches[index]
+        batch.append(msgParams)
+        if len(batch) >= self.batchSize:
+            self.inboxes[index].put(batch)
+            self.batches[index] = []
+
+    def flush(self):
+        """ Hands partially filled batches to the workers """
+        for index in range(self.workers):
+            if self.batches[index]:
+                self.inboxes[index].put(self.batches[index])
+                self.batches[index] = []
+
+    def close(self):
+        """ Waits for all workers and collects their results and counters
+
+        Returns aggregated counters."""
+        self.flush()
+        for inbox in self.inboxes:
+            inbox.put(None)
+        running = set(range(len(self.processes)))
+        exited = set()
+        while running:
+            try:
+                kind, index, data = self.outbox.get(timeout=self.pollInterval)
+            except queue.Empty:
+                # Process flushes its queue before it exits, so a worker
+                # found dead on two polls in a row will not report anymore
+                for index in list(running):
+                    process = self.processes[index]
+                    if process.is_alive():
+                        continue
+                    if index in exited:
+                        running.discard(index)
+                        self.failures.setdefault(index, 'Worker exited with code %s'
+                                                 % process.exitcode)
+                    else:
+                        exited.add(index)
+                continue
+            if kind == 'results':
+                self.results.extend(data)
+            elif kind == 'error':
+                self.failures[index] = data
+            else:
+                counters, errors = data
+                for name, value in counters.items():
+                    self.counters[name] = self.counters.get(name, 0) + value
+                for code, value in errors.items():
+                    self.errors[code] = self.errors.get(code, 0) + value
+                running.discard(index)
+        for index in self.failures:
+            # Batches left unread must not block exit of this process
+            self.inboxes[index].cancel_join_thread()
+        for process in self.processes:
+            process.join()
+        return self.counters
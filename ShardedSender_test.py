@@ -0,0 +1,95 @@
+""" Unit test for ShardedSender.py """
+
+import ShardedSender
+import SMSCClient
+import cimd
+import unittest
+
+class immediateSession:
+    """ Session double answering every submit at once
+
+    Destinations ending with 000 are rejected as incorrect, those
+    ending with 999 fail as if the response did not come in time."""
+    def __init__(self, index):
+        self.index = index
+        self.smsc = cimd.SMSC()
+    def submitMessage(self, encodedMsgParams):
+        destAddr = encodedMsgParams[0][1]
+        params = [(21, destAddr)]
+        if destAddr.endswith('000'):
+            params.append((900, 300))
+        frame = self.smsc.cimd.parseFrame(self.smsc.cimd.createMessage(53, params))
+        future = SMSCClient.ResponseFuture()
+        error = self.smsc.responseError(frame)
+        if destAddr.endswith('999'):
+            error = cimd.CIMDError(self.smsc.commError[5], 5)
+        if error is None:
+            future.setResult(frame)
+        else:
+            future.setException(error)
+        return future
+    def pending(self):
+        return 0
+
+class silentSession(immediateSession):
+    """ Session double which never gets any response """
+    def submitMessage(self, encodedMsgParams):
+        return SMSCClient.ResponseFuture()
+    def pending(self):
+        return 1
+
+def failingSession(index):
+    if index == 1:
+        raise cimd.CIMDError('Login failed')
+    return immediateSession(index)
+
+class ShardedSenderTestCase(unittest.TestCase):
+    def testShardOf(self):
+        """ Check for stable sharding of destination addresses """
+        self.assertEqual(ShardedSender.shardOf('420123456789',7),
+                         ShardedSender.shardOf(u'420123456789',7))
+        shards = [ShardedSender.shardOf('420%06d' % i, 4) for i in range(1000)]
+        for shard in range(4):
+            self.assertTrue(shards.count(shard) > 150)
+    def testCampaign(self):
+        """ Testing messages are sent once and counters are collected """
+        sender = ShardedSender.ShardedSender(immediateSession, workers=3, batchSize=64,
+                                             collectResults=True)
+        sender.start()
+        for i in range(1000):
+            sender.submit(destAddr='420%06d' % i, userData='text %d' % i)
+        sender.submit(destAddr='420999999', alphaOrigAddr='far too long sender')
+        self.assertRaises(cimd.CIMDError, sender.submit, userData='text')
+        counters = sender.close()
+        self.assertEqual(counters['submitted'],1000)
+        self.assertEqual(counters['invalid'],1)
+        self.assertEqual(counters['rejected'],2)
+        self.assertEqual(counters['accepted'],998)
+        self.assertEqual(sender.errors,{300:1,5:1})
+        self.assertEqual(sorted([destAddr for destAddr, errorCode in sender.results]),
+                         ['420%06d' % i for i in range(1000)])
+        self.assertTrue(('420000000',300) in sender.results)
+        self.assertTrue(('420000999',5) in sender.results)
+    def testFailedWorker(self):
+        """ Testing failed session factory is reported and close returns """
+        sender = ShardedSender.ShardedSender(failingSession, workers=2, pollInterval=0.1)
+        sender.start()
+        for i in range(100):
+            sender.submit(destAddr='420%06d' % i, userData='text')
+        counters = sender.close()
+        self.assertEqual(list(sender.failures),[1])
+        self.assertTrue('Login failed' in sender.failures[1])
+        self.assertEqual(counters['submitted'],
+                         len([i for i in range(100) if ShardedSender.shardOf('420%06d' % i,2) == 0]))
+    def testDrainTimeout(self):
+        """ Testing worker gives up on responses after drainTimeout """
+        sender = ShardedSender.ShardedSender(silentSession, workers=1, drainTimeout=0.2,
+                                             pollInterval=0.1)
+        sender.start()
+        sender.submit(destAddr='420123456789', userData='text')
+        counters = sender.close()
+        self.assertEqual(counters['submitted'],1)
+        self.assertTrue('not answered' in sender.failures[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,12 +2,257 @@
 """
 # (C) JG 2006
 
-import string
 import re
+import sys
+
+try:
+    import numpy                # Optional, speeds up batch checksums
+except ImportError:
+    numpy = None
 
 class CIMDError(Exception):
-    """Base class for exceptions in this module."""
-    pass
+    """Base class for exceptions in this module.
+
+    code is the CIMD error code if the error was reported by SMSC."""
+
+    def __init__(self, message='', code=None):
+        Exception.__init__(self, message)
+        self.code = code
+
+def toBytes(message):
+    """ Returns message as byte string
+
+    Messages are built as native strings, in Python 3 they are converted
+    using latin-1 so that every character maps to one byte."""
+    if isinstance(message, bytes):
+        return message
+    return message.encode('latin-1')
+
+def toNative(message):
+    """ Returns byte string as native string, inverse of toBytes() """
+    if isinstance(message, str):
+        return message
+    return bytes(message).decode('latin-1')
+
+class CIMDFrame:
+    """ Parsed CIMD frame
+
+    Parameter values are kept as (start, end) offsets into the original
+    buffer, lookups return memoryview slices without copying the data."""
+
+    def __init__(self, buf, opCode, packetNumber, checksum, params, start, end, checksumOffset):
+        self.buffer = buf
+        self.view = memoryview(buf)
+        self.opCode = opCode                # Integer operation code
+        self.packetNumber = packetNumber    # Integer packet number
+        self.checksum = checksum            # Integer checksum or None
+        self.params = params                # {param code : [(start, end), ...]}
+        self.start = start                  # Offset of STX
+        self.end = end                      # Offset just past ETX
+        self.checksumOffset = checksumOffset
+
+    def _paramCode(self, paramCode):
+        if type(paramCode) is not int:
+            paramCode = int(paramCode)
+        return paramCode
+
+    def hasParam(self, paramCode):
+        """ Returns True if the parameter is present in the frame """
+        return self._paramCode(paramCode) in self.params
+
+    def getParam(self, paramCode):
+        """ Returns memoryview of the first value of the parameter
+
+        If the parameter is not present, None is returned."""
+        spans = self.params.get(paramCode)
+        if spans is None and type(paramCode) is not int:
+            spans = self.params.get(self._paramCode(paramCode))
+        if spans is None:
+            return None
+        start, end = spans[0]
+        return self.view[start:end]
+
+    def getParams(self, paramCode):
+        """ Returns list of memoryviews of all values of the parameter """
+        spans = self.params.get(self._paramCode(paramCode), ())
+        return [self.view[start:end] for start, end in spans]
+
+    def getParamValue(self, paramCode):
+        """ Returns first value of the parameter as a byte string or None """
+        value = self.getParam(paramCode)
+        if value is not None:
+            value = value.tobytes()
+        return value
+
+    def verifyChecksum(self):
+        """ Returns True if the frame checksum matches its content
+
+        Frames without checksum are always considered valid."""
+        if self.checksum is None:
+            return True
+        data = bytearray(self.view[self.start:self.checksumOffset])
+        return sum(data) & 0xFF == self.checksum
+
+class FrameBuffer:
+    """ Receive buffer splitting incoming data into CIMD frames
+
+    Data is appended to a reusable bytearray and scanned in place for
+    STX/ETX boundaries, every byte is scanned once. Complete frames are
+    returned as memoryview slices, consumed data is dropped only when it
+    grows over compactSize bytes."""
+
+    def __init__(self, compactSize=65536):
+        self.buffer = bytearray()
+        self.start = 0                  # First unconsumed byte
+        self.scan = 0                   # ETX search resumes here
+        self.compactSize = compactSize
+
+    def __len__(self):
+        """ Returns number of unconsumed bytes """
+        return len(self.buffer) - self.start
+
+    def clear(self):
+        self.buffer = bytearray()
+        self.start = 0
+        self.scan = 0
+
+    def feed(self, data):
+        """ Appends received data
+
+        Frame views returned earlier must not be used after feed()."""
+        try:
+            if self.start >= self.compactSize or (self.start and self.start == len(self.buffer)):
+                del self.buffer[:self.start]
+                self.scan -= self.start
+                self.start = 0
+            self.buffer += data
+        except BufferError:
+            # Frame views are still held, continue in a new buffer
+            self.buffer = self.buffer[self.start:] + data
+            self.scan -= self.start
+            self.start = 0
+
+    def readLine(self):
+        """ Returns data up to and including LF (e.g. banner) or None """
+        end = self.buffer.find(b'\n', self.start)
+        if end < 0:
+            return None
+        line = bytes(self.buffer[self.start:end + 1])
+        self.start = self.scan = end + 1
+        return line
+
+    def frames(self):
+        """ Yields complete frames as memoryview slices
+
+        Data in front of STX is dropped."""
+        buf = self.buffer
+        view = memoryview(buf)
+        while True:
+            end = buf.find(b'\x03', self.scan)
+            if end < 0:
+                self.scan = len(buf)
+                return
+            start = buf.rfind(b'\x02', self.start, end)
+            self.start = self.scan = end + 1
+            if start >= 0:
+                yield view[start:end + 1]
+                if buf is not self.buffer:
+                    return              # Cleared or replaced meanwhile
+
+class MessageTemplate:
+    """ Precompiled message with fixed parameter layout
+
+    Created by SMSC.compileTemplate(). Static header and parameter blocks
+    are rendered once, render() only fills in variable parameter values,
+    packet number and checksum."""
+
+    # 0-padded ASCII packet numbers and their checksums
+    packetNumbers = ['%03d' % n for n in range(256)]
+    packetNumberChecksums = [sum(bytearray(pn.encode('latin-1'))) for pn in packetNumbers]
+
+    def __init__(self, smsc, segments, slotIndex):
+        self.smsc = smsc
+        self.segments = segments        # Static parts between variable values
+        self.slotIndex = slotIndex      # Argument index of each variable slot
+        self.staticChecksum = 0
+        for segment in segments:
+            self.staticChecksum = smsc.cimd.calcChecksum(segment,self.staticChecksum)
+        self.etx = smsc.cimd.specChar['etx']
+
+    def render(self, *values):
+        """ Returns complete message with the given variable values
+
+        Values are given in the order of compileTemplate variables."""
+        if len(values) != len(self.slotIndex):
+            raise CIMDError('Invalid number of template values')
+        cimd = self.smsc.cimd
+        packetNo = cimd.packetNumber
+        cimd.incPacketNumber()
+
+        segments = self.segments
+        output = [segments[0], self.packetNumbers[packetNo]]
+        for i in range(len(self.slotIndex)):
+            value = values[self.slotIndex[i]]
+            if type(value) is int:
+                value = repr(value)
+            output.append(segments[i + 1])
+            output.append(value)
+        output.append(segments[-1])
+
+        if self.smsc.useChecksum:
+            checksum = self.staticChecksum + self.packetNumberChecksums[packetNo]
+            for value in output[3:-1:2]:
+                checksum = cimd.calcChecksum(value,checksum)
+            output.append('%02X' % (checksum & 0xFF))
+        output.append(self.etx)
+        return ''.join(output)
+
+class SubmitRecord(object):
+    """ Compact message parameters for queueing
+
+    Only destination address and user data are kept per message, other
+    encoded parameters are given as options, usually one tuple shared by
+    all messages of a campaign. Records iterate as (code, value) tuples
+    and are accepted wherever encoded message parameters are."""
+
+    __slots__ = ('destAddr', 'userData', 'options')
+
+    def __init__(self, destAddr, userData=None, options=()):
+        self.destAddr = destAddr
+        self.userData = userData
+        self.options = tuple(options)
+
+    def __iter__(self):
+        yield ('021', self.destAddr)
+        for param in self.options:
+            yield param
+        if self.userData is not None:
+            yield ('033', self.userData)
+
+    def hasParam(self, code):
+        if code == '021':
+            return self.destAddr is not None
+        if code == '033':
+            return self.userData is not None
+        for param in self.options:
+            if param[0] == code:
+                return True
+        return False
+
+class EncodedRecord(object):
+    """ Message parameters pre-encoded into one string
+
+    Created by SMSC.encodeRecord(). Holds the parameter blocks of a
+    message as they go on the wire, so building the message only adds
+    header and trailer."""
+
+    __slots__ = ('body',)
+
+    def __init__(self, body):
+        self.body = body
+
+    def hasParam(self, code):
+        return self.body.startswith(code + ':') or ('\t' + code + ':') in self.body
 
 class CIMD:
 
@@ -22,6 +267,21 @@ class CIMD:
         'tab' : '\x09'
     }
 
+    # Precompiled parameter patterns used by extract* methods
+    reParam = re.compile(r"\t(\d{3}):([^\t]*)")
+    reParamCache = {}
+
+    # Precompiled frame grammar used by parseFrame
+    reFrameHeader = re.compile(br'\x02(\d{2}):(\d{3})\t')
+    reFrameBody = re.compile(br'((?:\d{3}:[^\t]*\t)*)([0-9A-Fa-f]{2})?\x03')
+    frameCodes = {}                     # Parameter code cache {b'021' : 21}
+
+    # re module of Python 2 does not accept memoryview
+    reAcceptsView = sys.version_info[0] >= 3
+
+    # Parameterless responses by (opcode, packet number, checksum usage)
+    responseCache = {}
+
     
     # Class constructor
     def __init__(self):
@@ -52,13 +312,43 @@ class CIMD:
         else:
             raise CIMDError('Invalid packet number')
 
-    def calcChecksum(self, message):
-        """ Returns 8-bit message checksum """
-        checksum = 0
-        for byte in message:
-            checksum += ord(byte)
-            checksum &= 0xFF
-        return checksum
+    def calcChecksum(self, message, checksum=0):
+        """ Returns 8-bit message checksum
+
+        Passing checksum of the preceding data continues the computation,
+        so the checksum can be maintained while the message is built."""
+        if not isinstance(message, (bytes, bytearray, memoryview)):
+            message = message.encode('latin-1')
+        return (checksum + sum(bytearray(message))) & 0xFF
+
+    def calcChecksums(self, buf, spans):
+        """ Returns list of 8-bit checksums of many messages at once
+
+        buf is a contiguous buffer, spans is a sequence of (start, end)
+        offsets of the checksummed parts. NumPy is used when available,
+        otherwise every part is checksummed by calcChecksum()."""
+        if numpy is not None:
+            data = numpy.frombuffer(buf, dtype=numpy.uint8)
+            sums = numpy.zeros(len(data) + 1, dtype=numpy.uint64)
+            numpy.cumsum(data, dtype=numpy.uint64, out=sums[1:])
+            bounds = numpy.array(spans, dtype=numpy.intp).reshape(-1, 2)
+            return ((sums[bounds[:, 1]] - sums[bounds[:, 0]]) & 0xFF).tolist()
+        calcChecksum = self.calcChecksum
+        return [calcChecksum(buf[start:end]) for start, end in spans]
+
+    def calcChecksumsOfMessages(self, messages):
+        """ Returns list of 8-bit checksums of the given messages """
+        if numpy is None:
+            return [self.calcChecksum(message) for message in messages]
+        spans = []
+        offset = 0
+        for message in messages:
+            spans.append((offset, offset + len(message)))
+            offset += len(message)
+        buf = ''.join(messages)
+        if not isinstance(buf, bytes):
+            buf = buf.encode('latin-1')
+        return self.calcChecksums(buf, spans)
 
     def decode(self,message):
         """ Returns human-readable representation of CIMD message """
@@ -89,7 +379,7 @@ class CIMD:
                 output += message[ptr]
                 ptr += 1
             else:
-                specCharId = string.lower(message[ptr+1:ptr+4])
+                specCharId = message[ptr+1:ptr+4].lower()
                 output += self.specChar[specCharId]
                 ptr += 5
         return output
@@ -128,18 +418,46 @@ class CIMD:
                 trailer = '%02X' % self.calcChecksum(message)
         return trailer + self.specChar['etx']
     
+    def createAck(self, frame, opCode=None):
+        """ Returns parameterless response to received CIMDFrame
+
+        Response opcode is frame opcode + 50 unless given, e.g. nack (99).
+        Checksum is added if the frame has one. Only the frame header is
+        used and the few hundred possible responses are cached."""
+        if opCode is None:
+            opCode = frame.opCode + 50
+        key = (opCode, frame.packetNumber, frame.checksum is not None)
+        message = self.responseCache.get(key)
+        if message is None:
+            message = self.createMessage(opCode, [], frame.packetNumber, key[2])
+            self.responseCache[key] = message
+        return message
+
     def createMessage(self, opCode, listOfParamTuples=None, packetNo=None, useChecksum=False):
         """ Builds complete message from opcode and list of parameter tuples """
         
-        output = self.createHeader(opCode,packetNo)
-        if listOfParamTuples is not None:
-            for tuple in listOfParamTuples:
-                output += self.createParamBlock(tuple[0],tuple[1])
+        header = self.createHeader(opCode,packetNo)
+        if isinstance(listOfParamTuples, EncodedRecord):
+            message = header + listOfParamTuples.body
+            if useChecksum:
+                return message + '%02X' % self.calcChecksum(message) + self.specChar['etx']
+            return message + self.specChar['etx']
+        output = [header]
         if useChecksum:
-            output += self.createTrailer(output)
+            # Checksum is maintained block by block, no second pass needed
+            checksum = self.calcChecksum(header)
+            if listOfParamTuples is not None:
+                for tuple in listOfParamTuples:
+                    block = self.createParamBlock(tuple[0],tuple[1])
+                    checksum = self.calcChecksum(block,checksum)
+                    output.append(block)
+            output.append('%02X' % checksum + self.specChar['etx'])
         else:
-            output += self.createTrailer()
-        return output
+            if listOfParamTuples is not None:
+                for tuple in listOfParamTuples:
+                    output.append(self.createParamBlock(tuple[0],tuple[1]))
+            output.append(self.createTrailer())
+        return ''.join(output)
         
 
     def extractParamValue(self, message, paramCode):
@@ -154,21 +472,218 @@ class CIMD:
                 paramCode = int(paramCode)
 
         value = None
-        paramCode = '%03d' % paramCode
-        searchPattern = self.specChar['tab']+ paramCode + r":(?P<value>\w*)"
-        reObj = re.compile(searchPattern)
+        reObj = self.reParamCache.get(paramCode)
+        if reObj is None:
+            searchPattern = self.specChar['tab'] + ('%03d' % paramCode) + r":([^\t]*)"
+            reObj = re.compile(searchPattern)
+            self.reParamCache[paramCode] = reObj
         resultObj = reObj.search(message)
         if resultObj is not None:
-            value = resultObj.groupdict()['value']
+            value = resultObj.group(1)
         return value
 
-    def extractAllParamValues(self, message):
-        """ Extracts all available parameters into dictionary """
-        
-        searchPattern = self.specChar['tab']+r"(?P<parID>\d{3}):(?P<value>\w*)"
-        reObj = re.compile(searchPattern)
-        return reObj.findall(message)
-    
+    def extractAllParamValues(self, message, multiValue=False):
+        """ Extracts all available parameters into dictionary
+
+        Dictionary is keyed by integer parameter code. Values are captured
+        up to the next TAB. If multiValue is set, every value is a list of
+        all occurrences of the parameter (e.g. several destination
+        addresses), otherwise the first occurrence is returned."""
+        params = {}
+        if multiValue:
+            for code, value in self.reParam.findall(message):
+                code = int(code)
+                if code in params:
+                    params[code].append(value)
+                else:
+                    params[code] = [value]
+        else:
+            for code, value in self.reParam.findall(message):
+                code = int(code)
+                if code not in params:
+                    params[code] = value
+        return params
+
+    def parseFrame(self, buf):
+        """ Parses a complete CIMD frame in a single pass
+
+        Accepts bytes, bytearray, memoryview or native string and returns
+        CIMDFrame object. Parameter values are indexed by offset and are
+        not copied."""
+        bufType = type(buf)
+        if bufType is not bytes and bufType is not bytearray:
+            if bufType is not memoryview:
+                buf = toBytes(buf)
+            elif not self.reAcceptsView:
+                buf = buf.tobytes()
+
+        header = self.reFrameHeader.search(buf)
+        if header is None:
+            raise CIMDError('Invalid frame header')
+        pos = header.end()
+        body = self.reFrameBody.match(buf, pos)
+        if body is None:
+            raise CIMDError('Invalid frame trailer')
+
+        # Body is validated, parameter blocks are split at TABs and
+        # indexed by offset
+        params = {}
+        codes = self.frameCodes
+        fields = body.group(1).split(b'\t')
+        fields.pop()
+        for field in fields:
+            end = pos + len(field)
+            span = (pos + 4, end)       # Skip 'NNN:'
+            pos = end + 1
+            key = field[:3]
+            code = codes.get(key)
+            if code is None:
+                code = codes[key] = int(key)
+            if code in params:
+                params[code].append(span)
+            else:
+                params[code] = [span]
+
+        checksum = body.group(2)
+        if checksum is not None:
+            checksum = int(checksum, 16)
+
+        return CIMDFrame(buf, int(header.group(1)), int(header.group(2)), checksum,
+                         params, header.start(), body.end(), pos)
+
+class ParamRule:
+    """ Constraints of one parameter value
+
+    kind is 'int' (decimal number within minValue..maxValue), 'str',
+    'digits' (address, optionally with leading +), 'text' (any text
+    without control characters, e.g. GSM default alphabet) or 'hex'.
+    maxLength applies to string kinds, numbers given to 'str' are
+    measured in their decimal form.
+    check(value) is compiled once, it raises CIMDError if value breaks
+    the rule. placeholder is a shortest value passing the check."""
+
+    patterns = {
+        'digits': r"\+?[0-9]{0,%s}\Z",
+        'text': r"[^\x00-\x1f\x7f]{0,%s}\Z",
+        'hex': r"(?:[0-9A-Fa-f]{2}){0,%s}\Z",
+    }
+
+    def __init__(self, kind, maxLength=None, minValue=None, maxValue=None, name=None):
+        self.kind = kind
+        self.maxLength = maxLength
+        self.minValue = minValue
+        self.maxValue = maxValue
+        self.name = name
+        self.placeholder = '0'
+        if kind == 'int':
+            self.placeholder = repr(minValue)
+            self.check = self.compileInt()
+        elif kind == 'str':
+            self.check = self.compileStr()
+        else:
+            if kind == 'hex':
+                self.placeholder = '00'
+            self.check = self.compilePattern()
+
+    def compileInt(self):
+        error = 'Invalid ' + self.name
+        low = self.minValue
+        high = self.maxValue
+        def check(value):
+            if type(value) is not int:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise CIMDError(error)
+            if value < low or value > high:
+                raise CIMDError(error)
+        return check
+
+    def compileStr(self):
+        error = 'Invalid ' + self.name + ', too long'
+        maxLength = self.maxLength
+        def check(value):
+            try:
+                length = len(value)
+            except TypeError:
+                length = len(str(value))
+            if length > maxLength:
+                raise CIMDError(error)
+        return check
+
+    def compilePattern(self):
+        error = 'Invalid ' + self.name
+        count = ''
+        if self.maxLength is not None:
+            count = self.maxLength
+            if self.kind == 'hex':
+                count = self.maxLength // 2
+        match = re.compile(self.patterns[self.kind] % count).match
+        def check(value):
+            if type(value) is int:
+                value = repr(value)
+            if match(value) is None:
+                raise CIMDError(error)
+        return check
+
+class ValidatedParams(list):
+    """ Encoded parameters already checked by SMSC.encodeTextMsgParams
+
+    Builders only look for required parameters in it, values are not
+    checked for the second time."""
+
+    def hasParam(self, code):
+        for param in self:
+            if param[0] == code:
+                return True
+        return False
+
+class Schema:
+    """ Parameters of one operation
+
+    required is a sequence of (code, error text) pairs, exclusive of
+    (code, code, error text) triples, rules maps parameter code to
+    ParamRule. validate() checks all of it in one pass over the params."""
+
+    def __init__(self, required=(), exclusive=(), rules=None):
+        self.required = tuple(required)
+        self.exclusive = tuple(exclusive)
+        self.checks = {}
+        for code, rule in (rules or {}).items():
+            self.checks[code] = rule.check
+        # Only codes needed by required and exclusive are tracked
+        self.tracked = {}
+        for item in self.required + self.exclusive:
+            for code in item[:-1]:
+                self.tracked[code] = True
+
+    def validate(self, encodedMsgParams):
+        """ Raises CIMDError if encoded message parameters break the schema
+
+        Values of EncodedRecord and ValidatedParams are taken as
+        validated when encoded."""
+        if isinstance(encodedMsgParams, (EncodedRecord, ValidatedParams)):
+            for code, error in self.required:
+                if not encodedMsgParams.hasParam(code):
+                    raise CIMDError(error)
+            return
+        checks = self.checks
+        tracked = self.tracked
+        seen = {}
+        for code, value in encodedMsgParams or ():
+            if type(code) is int:
+                code = '%03d' % code
+            check = checks.get(code)
+            if check is not None:
+                check(value)
+            if code in tracked:
+                seen[code] = True
+        for code, error in self.required:
+            if code not in seen:
+                raise CIMDError(error)
+        for first, second, error in self.exclusive:
+            if first in seen and second in seen:
+                raise CIMDError(error)
 
 class SMSC:
     """ SMSC communication and status data """
@@ -228,6 +743,7 @@ class SMSC:
         'protocol_id'           : '052',
         'first_deli_time_rel'   : '053',
         'fisrt_deli_time_abs'   : '054',
+        'first_deli_time_abs'   : '054',
         'reply_path'            : '055',
         'status_report_req'     : '056',
         'cancel_enabled'        : '058',
@@ -321,6 +837,19 @@ class SMSC:
         # GET error codes
         900 : 'Unsupported item requested'
     }
+
+    # CIMD status codes of deliver_status_rep
+    statusCode = {
+        1 : 'In process',
+        2 : 'Validity period expired',
+        3 : 'Delivery failed',
+        4 : 'Delivery successful',
+        5 : 'No response',
+        6 : 'Last no response',
+        7 : 'Message cancelled',
+        8 : 'Message deleted',
+        9 : 'Message deleted by cancel'
+    }
     
     # CIMD status error codes
     statusError = {
@@ -382,9 +911,104 @@ class SMSC:
         768 : 'Release, USSD not supported'
     }
 
-    def __init__(self):
+    # Keyword arguments of encodeTextMsgParams and their CIMD symbols
+    textMsgParams = {
+        'destAddr'              : 'dest_addr',
+        'origAddr'              : 'orig_addr',
+        'origIMSI'              : 'orig_imsi',
+        'alphaOrigAddr'         : 'alpha_orig_addr',
+        'origVMSC'              : 'orig_vmsc_addr',
+        'dataCoding'            : 'data_coding_scheme',
+        'userDataHeader'        : 'user_data_header',
+        'userData'              : 'user_data',
+        'userDataBinary'        : 'user_data_binary',
+        'moreMsgs'              : 'more_msgs',
+        'validPeriodRel'        : 'validity_period_rel',
+        'validPeriodAbs'        : 'validity_period_abs',
+        'protoID'               : 'protocol_id',
+        'firstDelivRel'         : 'first_deli_time_rel',
+        'firstDelivAbs'         : 'first_deli_time_abs',
+        'replyPath'             : 'reply_path',
+        'statusReport'          : 'status_report_req',
+        'cancelEnabled'         : 'cancel_enabled',
+        'servCentreTimestamp'   : 'serv_centre_timestamp',
+        'tariffClass'           : 'tariff_class',
+        'servDescr'             : 'service_descr',
+        'priority'              : 'priority',
+        'servCentreAddr'        : 'serv_center_addr',
+        'statusCode'            : 'status_code',
+        'dischargeTime'         : 'discharge_time'
+    }
+
+    # Value rules of parameters, see comments on symbol
+    paramRules = {
+        '010': ParamRule('str', 32, name='user id'),
+        '011': ParamRule('str', 32, name='password'),
+        '012': ParamRule('int', minValue=0, maxValue=9, name='subaddress'),
+        '019': ParamRule('int', minValue=1, maxValue=128, name='window size'),
+        '021': ParamRule('digits', 20, name='destination address'),
+        '023': ParamRule('digits', 20, name='originating address'),
+        '027': ParamRule('text', 11, name='alpha originating address'),
+        '030': ParamRule('int', minValue=0, maxValue=255, name='data coding scheme'),
+        '032': ParamRule('hex', 280, name='user data header'),
+        '034': ParamRule('hex', 280, name='user data binary'),
+        '044': ParamRule('int', minValue=0, maxValue=1, name='more messages'),
+        '050': ParamRule('int', minValue=0, maxValue=255, name='relative validity period'),
+        '052': ParamRule('int', minValue=0, maxValue=255, name='protocol id'),
+        '059': ParamRule('int', minValue=0, maxValue=2, name='cancel mode'),
+        '060': ParamRule('digits', 12, name='service centre timestamp'),
+        '061': ParamRule('int', minValue=0, maxValue=99, name='status code'),
+        '063': ParamRule('digits', 12, name='discharge time'),
+        '068': ParamRule('int', minValue=0, maxValue=2, name='delivery request mode'),
+        '501': ParamRule('digits', 12, name='MC time'),
+    }
+
+    # Mutually exclusive text message parameters
+    textExclusive = (
+        ('033', '034', 'Only one type of user data allowed.'),
+        ('050', '051', 'Only one validity period type allowed.'),
+        ('053', '054', 'Only one type of first delivery time allowed.'),
+    )
+
+    # Validation schema by opcode, 'text' covers encodeTextMsgParams output
+    schemas = {
+        'text': Schema((), textExclusive, paramRules),
+        '01': Schema((('010', 'User ID missing'), ('011', 'Password missing')), (), paramRules),
+        '03': Schema((('021', 'Destination address missing'),), textExclusive, paramRules),
+        '04': Schema((('021', 'Destination address missing'),
+                      ('060', 'Service centre timestamp missing')), (), paramRules),
+        '05': Schema((('068', 'Invalid mode for delivery request'),), (), paramRules),
+        '06': Schema((('059', 'Invalid mode for cancel message'),), (), paramRules),
+        '20': Schema((('021', 'Destination address missing'),
+                      ('023', 'Originating address missing'),
+                      ('060', 'Service centre timestamp missing')), textExclusive, paramRules),
+        '23': Schema((('021', 'Destination address missing'),
+                      ('060', 'Service centre timestamp missing'),
+                      ('061', 'Status code missing'),
+                      ('063', 'Discharge time missing')), (), paramRules),
+    }
+
+    def __init__(self, trusted=False):
         self.useChecksum = False
         self.cimd = CIMD()
+        # Trusted instance skips validation, e.g. for pre-validated templates
+        self.trusted = trusted
+
+    def validate(self, opCode, encodedMsgParams):
+        """ Checks encoded message parameters against schema of opCode """
+        if not self.trusted:
+            self.schemas[opCode].validate(encodedMsgParams)
+
+    def responseError(self, frame):
+        """ Returns CIMDError of negative response CIMDFrame, None otherwise """
+        if frame.opCode == 99:
+            return CIMDError('Negative acknowledgement')
+        errorCode = frame.getParamValue(900)
+        if errorCode is None:
+            return None
+        errorCode = int(errorCode)
+        return CIMDError(self.commError.get(errorCode, 'Unknown error %d' % errorCode),
+                         errorCode)
         
     def setPacketNumber(self,newPacketNumber):
         self.cimd.setPacketNumber(newPacketNumber)
@@ -405,24 +1029,13 @@ class SMSC:
                 windowSize --- window size used for submitting messages
         """
         opCode = self.opCode['login']
-        if len(repr(userID))>32:
-            raise CIMDError('User ID too long')
         paramList = [(self.symbol['user_id'],userID)]         # Username
-        if len(repr(password))>32:
-            raise CIMDError('Password too long')
         paramList.append((self.symbol['password'],password))  # Password
         if subAddr is not None:
-            if len(repr(subAddr))>3:
-                raise CIMDError('Subaddress too high')
-            else:
-                paramList.append((self.symbol['subaddr'],subAddr))
+            paramList.append((self.symbol['subaddr'],subAddr))
         if windowSize is not None:
-            if type(windowSize) is str:
-                windowSize = int(windowSize)
-            if windowSize>128:
-                raise CIMDError('Window size too high')
-            else:
-                paramList.append((self.symbol['window_size'],windowSize))
+            paramList.append((self.symbol['window_size'],windowSize))
+        self.validate(opCode,paramList)
         return self.cimd.createMessage(opCode,paramList,None,self.useChecksum)
 
     def logout(self):
@@ -440,14 +1053,6 @@ class SMSC:
                                 statusCode=None,dischargeTime=None):
         """ Creates list of tuples from text message parameters """
 
-        # General dependency checks
-        if userData is not None and userDataBinary is not None:
-            raise CIMDError('Only one type of user data allowed.')
-        if validPeriodRel is not None and validPeriodAbs is not None:
-            raise CIMDError('Only one validity period type allowed.')
-        if firstDelivRel is not None and firstDelivAbs is not None:
-            raise CIMDError('Only one type of first delivery time allowed.')
-        
         # Message buildup
         paramList=[]
         if destAddr is not None:
@@ -457,19 +1062,13 @@ class SMSC:
         if origIMSI is not None:
             paramList.append((self.symbol['orig_imsi'],origIMSI))
         if alphaOrigAddr is not None:
-            if type(alphaOrigAddr) is str and len(alphaOrigAddr)<12:
-                paramList.append((self.symbol['alpha_orig_addr'],alphaOrigAddr))
-            else:
-                raise CIMDError('Invalid alpha originating address.')                
+            paramList.append((self.symbol['alpha_orig_addr'],alphaOrigAddr))
         if origVMSC is not None:
             paramList.append((self.symbol['orig_vmsc_addr'],origVMSC))
         if dataCoding is not None:
             if type(dataCoding) is not str:
                 dataCoding = repr(dataCoding)
-            if eval(dataCoding)>=0 and eval(dataCoding)<256:
-                paramList.append((self.symbol['data_coding_scheme'],dataCoding))
-            else:
-                raise CIMDError('Invalid data coding scheme.')
+            paramList.append((self.symbol['data_coding_scheme'],dataCoding))
         if userDataHeader is not None:
             paramList.append((self.symbol['user_data_header'],userDataHeader))
         if userData is not None:
@@ -508,11 +1107,66 @@ class SMSC:
             paramList.append((self.symbol['status_code'],statusCode))
         if dischargeTime is not None:
             paramList.append((self.symbol['discharge_time'],dischargeTime))
-        return paramList
+        self.validate('text',paramList)
+        return ValidatedParams(paramList)
     
+    def compileTemplate(self, variables=('destAddr','userData'), **fixedParams):
+        """ Creates precompiled submit message template
+
+            Parameters:
+                variables --- names of encodeTextMsgParams arguments which
+                              differ from message to message
+                fixedParams --- encodeTextMsgParams arguments shared by
+                                all messages
+
+            Static parts of the message are rendered once, see
+            MessageTemplate.render()."""
+        params = dict(fixedParams)
+        for name in variables:
+            if name not in self.textMsgParams:
+                raise CIMDError('Unknown message parameter ' + name)
+            if name in params:
+                raise CIMDError('Parameter ' + name + ' is both fixed and variable')
+            # Placeholder passing value checks of the parameter
+            rule = self.paramRules.get(self.symbol[self.textMsgParams[name]])
+            params[name] = rule.placeholder if rule is not None else '0'
+        encodedMsgParams = self.encodeTextMsgParams(**params)
+        if not self.isOpcodeInEncodedParams(self.symbol['dest_addr'],encodedMsgParams):
+            raise CIMDError('Destination address missing')
+
+        # Variable parameters in the order they appear in the message
+        slotCodes = {}
+        for name in variables:
+            slotCodes[self.symbol[self.textMsgParams[name]]] = name
+        order = []
+        segments = [self.cimd.specChar['stx'] + self.opCode['submit_msg'] + ':']
+        current = self.cimd.specChar['tab']
+        for code, value in encodedMsgParams:
+            if code in slotCodes:
+                order.append(slotCodes[code])
+                segments.append(current + code + ':')
+                current = self.cimd.specChar['tab']
+            else:
+                current += self.cimd.createParamBlock(code,value)
+        segments.append(current)
+
+        # render() takes values in the order of the variables argument
+        slotIndex = [list(variables).index(name) for name in order]
+        return MessageTemplate(self, segments, slotIndex)
+
+    def encodeRecord(self, encodedMsgParams):
+        """ Returns EncodedRecord of encoded message parameters or SubmitRecord
+
+        Parameter values are validated here, not when the record is sent."""
+        self.validate('text',encodedMsgParams)
+        blocks = [self.cimd.createParamBlock(tuple[0],tuple[1]) for tuple in encodedMsgParams]
+        return EncodedRecord(''.join(blocks))
+
     def isOpcodeInEncodedParams(self,Opcode,encodedParamList):
         if Opcode is None or encodedParamList is None:
             return False
+        if isinstance(encodedParamList, (SubmitRecord, EncodedRecord, ValidatedParams)):
+            return encodedParamList.hasParam(Opcode)
         for tuple in encodedParamList:
             if tuple[0] == Opcode:
                 return True
@@ -521,38 +1175,73 @@ class SMSC:
     def submitMessage(self, encodedMsgParams):
         """ Creates submit message packet. """
         opCode = self.opCode['submit_msg']
+        self.validate(opCode,encodedMsgParams)
+        return self.cimd.createMessage(opCode,encodedMsgParams,None,self.useChecksum)
 
-        # Checking for mandatory items
-        # - at least 1 destination address has to be present
-        if not self.isOpcodeInEncodedParams(self.symbol['dest_addr'],encodedMsgParams):
-            raise CIMDError('Destination address missing')
+    def submitMessages(self, listOfEncodedMsgParams):
+        """ Encodes many submit messages into one contiguous buffer
 
-        return self.cimd.createMessage(opCode,encodedMsgParams,None,self.useChecksum)
+        Messages get consecutive packet numbers. Returns tuple (buffer,
+        offsets), where buffer is bytearray holding all messages and
+        offsets is list of (start, end) offsets of the single messages,
+        e.g. for retransmission. Checksums, if used, are computed for
+        the whole batch at once."""
+        opCode = self.opCode['submit_msg']
+        etx = toBytes(self.cimd.specChar['etx'])
+        buf = bytearray()
+        offsets = []
+        for encodedMsgParams in listOfEncodedMsgParams:
+            self.validate(opCode,encodedMsgParams)
+            start = len(buf)
+            buf += toBytes(self.cimd.createHeader(opCode))
+            if isinstance(encodedMsgParams, EncodedRecord):
+                buf += toBytes(encodedMsgParams.body)
+            else:
+                for tuple in encodedMsgParams:
+                    buf += toBytes(self.cimd.createParamBlock(tuple[0],tuple[1]))
+            if self.useChecksum:
+                buf += b'00'            # Placeholder, filled in below
+            buf += etx
+            offsets.append((start, len(buf)))
+
+        if self.useChecksum:
+            spans = [(start, end - 3) for start, end in offsets]
+            checksums = self.cimd.calcChecksums(buf, spans)
+            for i in range(len(spans)):
+                end = spans[i][1]
+                buf[end:end + 2] = toBytes('%02X' % checksums[i])
+        return buf, offsets
 
     def enquireMessageStatus(self, destAddr, servCentreTimestamp):
         """ Creates request for status report on submitted message """
         opCode = self.opCode['enq_msg_status']
         paramList = [(self.symbol['dest_addr'],destAddr)]
         paramList.append((self.symbol['serv_centre_timestamp'],servCentreTimestamp))
+        self.validate(opCode,paramList)
         return self.cimd.createMessage(opCode,paramList,None,self.useChecksum)
 
+    def parseMode(self, mode, error):
+        """ Returns mode 0-2 given as number or string """
+        try:
+            mode = int(mode)
+        except (TypeError, ValueError):
+            raise CIMDError(error)
+        if mode < 0 or mode > 2:
+            raise CIMDError(error)
+        return mode
+
     def deliveryRequest(self, mode=1):
         """ Creates request for message delivery """
         opCode = self.opCode['delivery_req']
-        if type(mode) is not int:
-            mode = eval(mode)
-        if mode < 0 or mode > 2:
-            raise CIMDError('Invalid mode for delivery request')
+        mode = self.parseMode(mode,'Invalid mode for delivery request')
         paramList = [(self.symbol['deli_req_mode'],mode)]
+        self.validate(opCode,paramList)
         return self.cimd.createMessage(opCode,paramList,None,self.useChecksum)
 
     def cancelMessage(self, mode, destAddr=None, servCentreTimestamp=None):
         """ Creates cancel request for earlier messages """
         opCode = self.opCode['cancel_msg']
-        if type(mode) is not int:
-            mode = eval(mode)
-        if mode < 0 or mode > 2:
-            raise CIMDError('Invalid mode for cancel message')
+        mode = self.parseMode(mode,'Invalid mode for cancel message')
         paramList = [(self.symbol['cancel_mode'],mode)]
         if mode == 0 and destAddr is None:
             raise CIMDError('Missing destination address for this cancel mode')
@@ -562,56 +1251,29 @@ class SMSC:
             paramList.append((self.symbol['dest_addr'],destAddr))
         if servCentreTimestamp is not None:
             paramList.append((self.symbol['serv_centre_timestamp'],servCentreTimestamp))
+        self.validate(opCode,paramList)
         return self.cimd.createMessage(opCode,paramList,None,self.useChecksum)
         
     def deliverMessage(self, encodedMsgParams):
         """ Creates deliver message packet (used by SMSC) """
         opCode = self.opCode['deliver_msg']
 
-        # Checking for mandatory items
-        
-        # - at least 1 destination address has to be present
-        if not self.isOpcodeInEncodedParams(self.symbol['dest_addr'],encodedMsgParams):
-            raise CIMDError('Destination address missing')
-
-        # - originating address
-        if not self.isOpcodeInEncodedParams(self.symbol['orig_addr'],encodedMsgParams):
-            raise CIMDError('Originating address missing')
-        
-        # - service centre timestamp
-        if not self.isOpcodeInEncodedParams(self.symbol['serv_centre_timestamp'],encodedMsgParams):
-            raise CIMDError('Service centre timestamp missing')
-        
+        # Mandatory: destination address, originating address and
+        #            service centre timestamp
         # Optional: User data header, User data/User data binary, Protocol id,
         #           Data coding scheme, Originated IMSI, Originated VMSC,
         #           Service center address
-        
+        self.validate(opCode,encodedMsgParams)
         return self.cimd.createMessage(opCode,encodedMsgParams,None,self.useChecksum)
 
     def deliverStatusReport(self, encodedMsgParams):
         """ Creates delivery status report (used by SMSC) """
         opCode = self.opCode['deliver_status_rep']
 
-        # Checking for mandatory items
-
-        # - destination address
-        if not self.isOpcodeInEncodedParams(self.symbol['dest_addr'],encodedMsgParams):
-            raise CIMDError('Destination address missing')
-        
-        # - service centre timestamp
-        if not self.isOpcodeInEncodedParams(self.symbol['serv_centre_timestamp'],encodedMsgParams):
-            raise CIMDError('Service centre timestamp missing')
-        
-        # - status code
-        if not self.isOpcodeInEncodedParams(self.symbol['status_code'],encodedMsgParams):
-            raise CIMDError('Status code missing')
-        
-        # - discharge time
-        if not self.isOpcodeInEncodedParams(self.symbol['discharge_time'],encodedMsgParams):
-            raise CIMDError('Discharge time missing')
-
+        # Mandatory: destination address, service centre timestamp,
+        #            status code and discharge time
         # Optional: Status error code, Originator address
-
+        self.validate(opCode,encodedMsgParams)
         return self.cimd.createMessage(opCode,encodedMsgParams,None,self.useChecksum)
         
     def setParam(self, symbol, value):
@@ -0,0 +1,477 @@
+""" Performance benchmarks for cimd.py
+
+Running the module measures the hot paths of cimd.py over realistic
+message mixes. Results can be saved as JSON baseline and later runs
+compared to it, the run fails if any case got slower than threshold
+or there is no baseline for the interpreter. Allocated bytes per
+operation are reported too where tracemalloc is available (Python 3).
+
+    python cimd_bench.py --save cimd_bench.json
+    python cimd_bench.py --compare cimd_bench.json --threshold 0.2
+
+cimd_bench.json in the repository holds baselines of the reference
+machine, keyed by interpreter version.
+"""
+
+import re
+import sys
+import json
+import timeit
+import optparse
+import cimd
+import gsm
+import spool
+import shutil
+import tempfile
+
+try:
+    import tracemalloc          # Python 3.4+, allocations are not measured without it
+except ImportError:
+    tracemalloc = None
+
+# Reference implementations as of the baseline, kept for comparison
+def legacyExtractParamValue(message, paramCode):
+    paramCode = '%03d' % int(paramCode)
+    searchPattern = '\t' + paramCode + r":(?P<value>\w*)"
+    resultObj = re.compile(searchPattern).search(message)
+    if resultObj is not None:
+        return resultObj.groupdict()['value']
+    return None
+
+def legacyExtractAllParamValues(message):
+    searchPattern = '\t' + r"(?P<parID>\d{3}):(?P<value>\w*)"
+    return re.compile(searchPattern).findall(message)
+
+def legacyCalcChecksum(message):
+    checksum = 0
+    for byte in message:
+        checksum += ord(byte)
+        checksum &= 0xFF
+    return checksum
+
+def submitResponse():
+    """ Returns typical submit_msg_resp message """
+    smsc = cimd.SMSC()
+    return smsc.cimd.createMessage(smsc.opCode['submit_msg_resp'],
+                [(smsc.symbol['dest_addr'],'420123456789'),
+                 (smsc.symbol['serv_centre_timestamp'],'061006131036'),
+                 (smsc.symbol['status_code'],'0'),
+                 (smsc.symbol['error_code'],'0'),
+                 (smsc.symbol['error_text'],'No error')])
+
+def measure(func, number):
+    """ Returns operations per second of func """
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return number / seconds
+
+def benchExtract(number=20000):
+    """ Compares legacy and current parameter extraction """
+    c = cimd.CIMD()
+    msg = submitResponse()
+    codes = (21, 60, 61, 900, 901)
+
+    def legacyLookups():
+        for code in codes:
+            legacyExtractParamValue(msg, code)
+
+    def currentLookups():
+        for code in codes:
+            c.extractParamValue(msg, code)
+
+    def legacyAll():
+        params = legacyExtractAllParamValues(msg)
+        for code in codes:
+            for parID, value in params:
+                if int(parID) == code:
+                    break
+
+    def currentAll():
+        params = c.extractAllParamValues(msg)
+        for code in codes:
+            params.get(code)
+
+    def currentFrame():
+        frame = c.parseFrame(msg)
+        for code in codes:
+            frame.getParam(code)
+
+    return [
+        ('extractParamValue x5 (legacy)', measure(legacyLookups, number)),
+        ('extractParamValue x5', measure(currentLookups, number)),
+        ('extractAllParamValues + 5 lookups (legacy)', measure(legacyAll, number)),
+        ('extractAllParamValues + 5 lookups', measure(currentAll, number)),
+        ('parseFrame + 5 lookups', measure(currentFrame, number)),
+    ]
+
+def benchChecksum(number=2000, batch=1000):
+    """ Compares per-character, per-message and batch checksums """
+    c = cimd.CIMD()
+    messages = [submitResponse()] * batch
+    buf = ''.join(messages)
+    if not isinstance(buf, bytes):
+        buf = buf.encode('latin-1')
+    spans = []
+    offset = 0
+    for message in messages:
+        spans.append((offset, offset + len(message)))
+        offset += len(message)
+
+    def legacy():
+        for message in messages:
+            legacyCalcChecksum(message)
+
+    def current():
+        for message in messages:
+            c.calcChecksum(message)
+
+    def batched():
+        c.calcChecksums(buf, spans)
+
+    perBatch = float(batch)
+    return [
+        ('calcChecksum (legacy)', measure(legacy, number // 10) * perBatch),
+        ('calcChecksum', measure(current, number // 10) * perBatch),
+        ('calcChecksums batch', measure(batched, number // 10) * perBatch),
+        ('createMessage with checksum', measure(lambda: c.createMessage(3,
+                    [(21,'420123456789'),(33,'Hello world')],None,True), number * 10)),
+    ]
+
+def benchTemplate(number=20000):
+    """ Compares submitMessage with precompiled template rendering """
+    smsc = cimd.SMSC()
+    smsc.setChecksumUsage(True)
+    fixed = dict(origAddr='12345', statusReport=14, validPeriodRel=167, priority=1)
+    template = smsc.compileTemplate(**fixed)
+
+    def submit():
+        smsc.submitMessage(smsc.encodeTextMsgParams(destAddr='420123456789',
+                                                    userData='Hello world', **fixed))
+
+    def render():
+        template.render('420123456789', 'Hello world')
+
+    return [
+        ('submitMessage', measure(submit, number)),
+        ('MessageTemplate.render', measure(render, number)),
+    ]
+
+def benchBulk(number=200, batch=100):
+    """ Compares per-message submitMessage with bulk submitMessages """
+    smsc = cimd.SMSC()
+    smsc.setChecksumUsage(True)
+    paramLists = [smsc.encodeTextMsgParams(destAddr='420123456789', userData='Hello world')] * batch
+
+    def single():
+        for params in paramLists:
+            smsc.submitMessage(params)
+
+    def bulk():
+        smsc.submitMessages(paramLists)
+
+    perBatch = float(batch)
+    return [
+        ('submitMessage per message', measure(single, number) * perBatch),
+        ('submitMessages bulk', measure(bulk, number) * perBatch),
+    ]
+
+def benchReceive(number=20, burst=65536):
+    """ Compares string concatenation with FrameBuffer on a deliver burst """
+    c = cimd.CIMD()
+    msg = c.createMessage(20, [(21,'420123456789'), (33,'Hello world')], 1)
+    msg = msg.encode('latin-1')
+    data = msg * (burst // len(msg))
+    chunks = [data[i:i + 65536] for i in range(0, len(data), 65536)]
+    etx = b'\x03'
+
+    def legacy():
+        ibuffer = b''
+        for chunk in chunks:
+            ibuffer = ibuffer + chunk
+            while True:
+                end = ibuffer.find(etx)
+                if end < 0:
+                    break
+                frame = ibuffer[:end + 1]
+                ibuffer = ibuffer[end + 1:]
+
+    def current():
+        fb = cimd.FrameBuffer()
+        for chunk in chunks:
+            fb.feed(chunk)
+            for frame in fb.frames():
+                pass
+
+    frames = float(len(data) // len(msg))
+    return [
+        ('receive burst, string concatenation', measure(legacy, number) * frames),
+        ('receive burst, FrameBuffer', measure(current, number) * frames),
+    ]
+
+def textMix():
+    """ Returns encodeTextMsgParams arguments of typical submits """
+    return [
+        dict(destAddr='420123456789', userData='Your code is 123456'),
+        dict(destAddr='420601234567', origAddr='12345', statusReport=14,
+             validPeriodRel=167, userData='Sale ' * 32),
+        dict(destAddr='420777123456', alphaOrigAddr='Shop', priority=1,
+             userData='Order 8812 was shipped, delivery expected tomorrow'),
+    ]
+
+def receivedMix():
+    """ Returns received messages in typical proportion """
+    smsc = cimd.SMSC()
+    c = smsc.cimd
+    resp = submitResponse()
+    deliver = c.createMessage(smsc.opCode['deliver_msg'],
+                [(smsc.symbol['dest_addr'],'12345'),
+                 (smsc.symbol['orig_addr'],'420601234567'),
+                 (smsc.symbol['data_coding_scheme'],'0'),
+                 (smsc.symbol['user_data'],'STOP'),
+                 (smsc.symbol['serv_centre_timestamp'],'061006131036')], 7, True)
+    report = c.createMessage(smsc.opCode['deliver_status_rep'],
+                [(smsc.symbol['dest_addr'],'420123456789'),
+                 (smsc.symbol['serv_centre_timestamp'],'061006131036'),
+                 (smsc.symbol['status_code'],'4'),
+                 (smsc.symbol['status_error_code'],'0'),
+                 (smsc.symbol['discharge_time'],'061006131040')], 8, True)
+    alive = c.createMessage(smsc.opCode['alive_resp'], [], 9)
+    return [resp] * 4 + [report] * 2 + [deliver, alive]
+
+def benchSpool(number=5, batch=100):
+    """ Compares journal commit per message with one group commit per batch """
+    record = cimd.EncodedRecord('021:420123456789\t033:Hello world\t')
+    directory = tempfile.mkdtemp()
+    journal = spool.Spool(directory)
+
+    def perMessage():
+        for i in range(batch):
+            journal.ack(journal.append(record))
+            journal.commit()
+
+    def grouped():
+        entries = [journal.append(record) for i in range(batch)]
+        journal.commit()
+        for entry in entries:
+            journal.ack(entry)
+
+    perBatch = float(batch)
+    try:
+        return [
+            ('spool, commit per message', measure(perMessage, number) * perBatch),
+            ('spool, group commit', measure(grouped, number) * perBatch),
+        ]
+    finally:
+        journal.close()
+        shutil.rmtree(directory, True)
+
+def suite():
+    """ Returns benchmark cases as list of (name, func, ops per call) """
+    smsc = cimd.SMSC()
+    c = smsc.cimd
+    texts = textMix()
+    encoded = [smsc.encodeTextMsgParams(**kwargs) for kwargs in texts]
+    received = receivedMix()
+    readable = [c.decode(msg) for msg in received]
+    codes = (21, 60, 900)
+
+    def calcChecksum():
+        for msg in received:
+            c.calcChecksum(msg)
+
+    def encode():
+        for msg in readable:
+            c.encode(msg)
+
+    def decode():
+        for msg in received:
+            c.decode(msg)
+
+    def createMessage(useChecksum):
+        def create():
+            for params in encoded:
+                c.createMessage(3, params, None, useChecksum)
+        return create
+
+    def extractParamValue():
+        for msg in received:
+            for code in codes:
+                c.extractParamValue(msg, code)
+
+    def extractAllParamValues():
+        for msg in received:
+            c.extractAllParamValues(msg)
+
+    def encodeTextMsgParams():
+        for kwargs in texts:
+            smsc.encodeTextMsgParams(**kwargs)
+
+    def submitMessage():
+        for params in encoded:
+            smsc.submitMessage(params)
+
+    trusted = cimd.SMSC(trusted=True)
+
+    def submitTrusted():
+        for params in encoded:
+            trusted.submitMessage(params)
+
+    records = [smsc.encodeRecord(params) for params in encoded]
+
+    def submitRecord():
+        for record in records:
+            smsc.submitMessage(record)
+
+    segmenter = gsm.Segmenter(smsc)
+    longTexts = [u'Order 8812 was shipped. ' * 20, u'\u0417\u0430\u043a\u0430\u0437 ' * 40]
+
+    def segment():
+        for text in longTexts:
+            segmenter.encode(text, destAddr='420123456789')
+
+    plainTexts = [kwargs['userData'] for kwargs in texts]
+    specialTexts = [u'Cena 100\u20ac, sleva 20 %', u'\u00c5ngstr\u00f6m @ 10:00', u'user_name']
+    userDataTexts = [gsm.encodeUserData(text) for text in specialTexts]
+
+    def encodePlain():
+        for text in plainTexts:
+            gsm.encodeUserData(text)
+
+    def encodeSpecial():
+        for text in specialTexts:
+            gsm.encodeUserData(text)
+
+    def decodeSpecial():
+        for data in userDataTexts:
+            gsm.decodeUserData(data)
+
+    return [
+        ('calcChecksum', calcChecksum, len(received)),
+        ('encode', encode, len(readable)),
+        ('decode', decode, len(received)),
+        ('createMessage', createMessage(False), len(encoded)),
+        ('createMessage with checksum', createMessage(True), len(encoded)),
+        ('extractParamValue', extractParamValue, len(received) * len(codes)),
+        ('extractAllParamValues', extractAllParamValues, len(received)),
+        ('encodeTextMsgParams', encodeTextMsgParams, len(texts)),
+        ('submitMessage', submitMessage, len(encoded)),
+        ('submitMessage trusted', submitTrusted, len(encoded)),
+        ('submitMessage EncodedRecord', submitRecord, len(records)),
+        ('Segmenter.encode long text', segment, len(longTexts)),
+        ('encodeUserData ASCII', encodePlain, len(plainTexts)),
+        ('encodeUserData special characters', encodeSpecial, len(specialTexts)),
+        ('decodeUserData special characters', decodeSpecial, len(specialTexts)),
+    ]
+
+def allocations(func):
+    """ Returns bytes allocated per operation of func
+
+    A call runs its operations one after another and each frees its
+    temporaries before the next starts, so the peak traced during the
+    call is what the largest single operation allocates. None is
+    returned without tracemalloc (Python 2), CPython 2.7 has no
+    allocation tracing."""
+    if tracemalloc is None:
+        return None
+    func()                              # Caches and interned values are warm
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def runSuite(number=2000):
+    """ Returns {case name: {'ops': ops/s, 'alloc': bytes allocated per op}} """
+    results = {}
+    for name, func, ops in suite():
+        results[name] = {'ops': measure(func, number) * ops,
+                         'alloc': allocations(func)}
+    return results
+
+def baselineKey():
+    """ Baselines are kept per interpreter version """
+    return '%d.%d' % sys.version_info[:2]
+
+def loadBaseline(fileName):
+    try:
+        f = open(fileName)
+    except IOError:
+        return {}
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def saveBaseline(fileName, results):
+    baselines = loadBaseline(fileName)
+    baselines[baselineKey()] = results
+    f = open(fileName, 'w')
+    try:
+        json.dump(baselines, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+def compare(results, baseline, threshold):
+    """ Returns list of (name, baseline ops/s, ops/s) slower than threshold
+
+    threshold is the allowed relative slowdown, e.g. 0.2 for 20 %."""
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['ops']
+        new = results[name]['ops']
+        if new < old * (1 - threshold):
+            regressions.append((name, old, new))
+    return regressions
+
+def reportSuite(results, baseline=None):
+    for name in sorted(results):
+        result = results[name]
+        line = '%-45s %12.0f ops/s' % (name, result['ops'])
+        if result.get('alloc') is not None:
+            line += ' %8d B/op' % result['alloc']
+        if baseline and name in baseline:
+            line += ' %+6.1f %%' % ((result['ops'] / baseline[name]['ops'] - 1) * 100)
+        print(line)
+
+def report(results):
+    for name, opsPerSec in results:
+        print('%-45s %12.0f ops/s' % (name, opsPerSec))
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("--save", metavar="FILE", help="store results as baseline")
+    parser.add_option("--compare", metavar="FILE", help="compare results to baseline")
+    parser.add_option("--threshold", type="float", default=0.2,
+                      help="allowed relative slowdown [default: %default]")
+    parser.add_option("--number", type="int", default=2000,
+                      help="calls of each case per repeat [default: %default]")
+    parser.add_option("--legacy", action="store_true",
+                      help="also compare with legacy implementations")
+    options, args = parser.parse_args()
+
+    results = runSuite(options.number)
+    baseline = None
+    if options.compare:
+        baseline = loadBaseline(options.compare).get(baselineKey())
+        if baseline is None:
+            print('No baseline for Python %s in %s' % (baselineKey(), options.compare))
+            sys.exit(2)
+    reportSuite(results, baseline)
+    if options.legacy:
+        report(benchExtract())
+        report(benchChecksum())
+        report(benchTemplate())
+        report(benchBulk())
+        report(benchReceive())
+        report(benchSpool())
+    if options.save:
+        saveBaseline(options.save, results)
+    if baseline:
+        regressions = compare(results, baseline, options.threshold)
+        for name, old, new in regressions:
+            print('REGRESSION %s: %.0f -> %.0f ops/s' % (name, old, new))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,31 @@
+""" Unit test for cimd_bench.py """
+
+import cimd_bench
+import os
+import tempfile
+import unittest
+
+class BenchTestCase(unittest.TestCase):
+    def testSuite(self):
+        """ Testing all cases run and report ops/s """
+        results = cimd_bench.runSuite(number=1)
+        self.assertEqual(sorted(results),sorted([case[0] for case in cimd_bench.suite()]))
+        for result in results.values():
+            self.assertTrue(result['ops'] > 0)
+    def testCompare(self):
+        """ Testing regressions beyond threshold are reported """
+        baseline = {'fast': {'ops': 100.0}, 'slow': {'ops': 100.0}}
+        results = {'fast': {'ops': 85.0}, 'slow': {'ops': 79.0}, 'new': {'ops': 1.0}}
+        self.assertEqual(cimd_bench.compare(results,baseline,0.2),[('slow',100.0,79.0)])
+    def testBaseline(self):
+        """ Testing baselines are stored per interpreter version """
+        fileName = os.path.join(tempfile.mkdtemp(),'baseline.json')
+        results = {'case': {'ops': 10.0, 'alloc': None}}
+        cimd_bench.saveBaseline(fileName,results)
+        baselines = cimd_bench.loadBaseline(fileName)
+        self.assertEqual(baselines[cimd_bench.baselineKey()],results)
+        os.remove(fileName)
+        os.rmdir(os.path.dirname(fileName))
+
+if __name__ == "__main__":
+    unittest.main()
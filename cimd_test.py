@@ -1,6 +1,8 @@
 """ Unit test for cimd.py"""
 
 import cimd
+import random
+import sys
 import unittest
 
 class CIMDTestCase(unittest.TestCase):
@@ -30,6 +32,15 @@ class CIMDTestCase(unittest.TestCase):
     def testChecksum(self):
         """ Check for correct checksum computation """
         self.assertEqual(self.cimd.calcChecksum("abc123"),188)
+        self.assertEqual(self.cimd.calcChecksum("123",self.cimd.calcChecksum("abc")),188)
+        self.assertEqual(self.cimd.calcChecksum(bytearray(b"abc123")),188)
+    def testBatchChecksum(self):
+        """ Check for correct batch checksum computation """
+        buf = b"abc123" + b"xyz" + b"abc123"
+        checksums = self.cimd.calcChecksums(buf,[(0,6),(6,9),(9,15),(3,3)])
+        self.assertEqual(checksums,[188,self.cimd.calcChecksum("xyz"),188,0])
+        checksums = self.cimd.calcChecksumsOfMessages(["abc123","xyz"])
+        self.assertEqual(checksums,[188,self.cimd.calcChecksum("xyz")])
     def testCodec(self):
         """ Check for correct encoding & decoding of CIMD messages """
         tstStr = chr(0)+chr(2)+chr(3)+'abc123'+chr(9)+chr(0)
@@ -73,7 +84,19 @@ class CIMDTestCase(unittest.TestCase):
         tstStr = self.cimd.decode(self.cimd.extractParamValue(tstMsg,100))
         self.assertEqual(tstStr,'parttwo')
         tstDic = self.cimd.extractAllParamValues(tstMsg)
-        self.assertEqual(tstDic,[('010','partone'),('100','parttwo')])
+        self.assertEqual(tstDic,{10:'partone',100:'parttwo'})
+    def testExtractFullValues(self):
+        """ Check that values are extracted up to the next TAB """
+        tstMsg = "{STX}53:001{TAB}021:111{TAB}021:222{TAB}"
+        tstMsg += "901:Syntax error, see spec.{TAB}033:Hello world!{TAB}{ETX}"
+        tstMsg = self.cimd.encode(tstMsg)
+        self.assertEqual(self.cimd.extractParamValue(tstMsg,901),'Syntax error, see spec.')
+        self.assertEqual(self.cimd.extractParamValue(tstMsg,'033'),'Hello world!')
+        tstDic = self.cimd.extractAllParamValues(tstMsg)
+        self.assertEqual(tstDic,{21:'111',901:'Syntax error, see spec.',33:'Hello world!'})
+        tstDic = self.cimd.extractAllParamValues(tstMsg,True)
+        self.assertEqual(tstDic[21],['111','222'])
+        self.assertEqual(tstDic[33],['Hello world!'])
     def testCreateMessage(self):
         """ Check for correct complete message building """
         expectedStr = "{STX}01:001{TAB}{ETX}"
@@ -93,6 +116,83 @@ class CIMDTestCase(unittest.TestCase):
         expectedStr = "{STX}05:021{TAB}010:partone{TAB}100:parttwo{TAB}EF{ETX}"
         currentStr = self.cimd.decode(self.cimd.createMessage(5,[(10,'partone'),(100,'parttwo')],21,True))
         self.assertEqual(currentStr,expectedStr)
+    def testParseFrame(self):
+        """ Check for correct single pass frame parsing """
+        tstMsg = "{STX}53:007{TAB}021:123456789{TAB}021:987654321{TAB}"
+        tstMsg += "060:060904140021{TAB}901:some error text{TAB}{ETX}"
+        frame = self.cimd.parseFrame(self.cimd.encode(tstMsg))
+        self.assertEqual(frame.opCode,53)
+        self.assertEqual(frame.packetNumber,7)
+        self.assertEqual(frame.checksum,None)
+        self.assertTrue(frame.verifyChecksum())
+        self.assertTrue(isinstance(frame.getParam(21),memoryview))
+        self.assertEqual(frame.getParamValue('021'),b'123456789')
+        self.assertEqual([v.tobytes() for v in frame.getParams(21)],[b'123456789',b'987654321'])
+        self.assertEqual(frame.getParamValue(60),b'060904140021')
+        self.assertEqual(frame.getParamValue(901),b'some error text')
+        self.assertEqual(frame.getParam(33),None)
+        self.assertEqual(frame.getParams(33),[])
+        self.assertFalse(frame.hasParam(33))
+        # Checksummed frame given as memoryview
+        tstMsg = self.cimd.createMessage(5,[(10,'partone'),(100,'parttwo')],21,True)
+        frame = self.cimd.parseFrame(memoryview(tstMsg.encode('latin-1')))
+        self.assertEqual(frame.opCode,5)
+        self.assertEqual(frame.packetNumber,21)
+        self.assertEqual(frame.checksum,0xEF)
+        self.assertTrue(frame.verifyChecksum())
+        self.assertEqual(frame.getParamValue(100),b'parttwo')
+        self.assertRaises(cimd.CIMDError,self.cimd.parseFrame,b'garbage')
+        self.assertRaises(cimd.CIMDError,self.cimd.parseFrame,b'\x0253:001\t021:12')
+    def testCreateAck(self):
+        """ Check for correct parameterless responses to received frames """
+        frame = self.cimd.parseFrame(self.cimd.createMessage(20,[(21,'123')],4))
+        self.assertEqual(self.cimd.createAck(frame),self.cimd.encode("{STX}70:004{TAB}{ETX}"))
+        self.assertEqual(self.cimd.createAck(frame,99),self.cimd.encode("{STX}99:004{TAB}{ETX}"))
+        frame = self.cimd.parseFrame(self.cimd.createMessage(23,[(21,'123')],6,True))
+        self.assertEqual(self.cimd.createAck(frame),self.cimd.createMessage(73,[],6,True))
+        self.assertTrue(self.cimd.createAck(frame) is self.cimd.createAck(frame))
+    def testFrameBuffer(self):
+        """ Check for correct splitting of received data into frames """
+        fb = cimd.FrameBuffer()
+        fb.feed(b'Banner line\n')
+        self.assertEqual(fb.readLine(),b'Banner line\n')
+        self.assertEqual(len(fb),0)
+        msgs = [self.cimd.createMessage(20,[(21,'123456789'),(33,'text %d' % i)],i,True)
+                for i in range(1,4)]
+        data = b'junk' + b''.join([m.encode('latin-1') for m in msgs])
+        # Frame split across feeds, several frames in one chunk
+        fb.feed(data[:10])
+        self.assertEqual(list(fb.frames()),[])
+        fb.feed(data[10:])
+        frames = [view.tobytes() for view in fb.frames()]
+        self.assertEqual(frames,[m.encode('latin-1') for m in msgs])
+        self.assertEqual(len(fb),0)
+        # View held while feeding continues in a new buffer
+        fb.feed(data[4:])
+        view = next(fb.frames())
+        fb.feed(b'\x02')
+        self.assertEqual(view.tobytes(),msgs[0].encode('latin-1'))
+        self.assertEqual(len([v for v in fb.frames()]),2)
+        fb.clear()
+        self.assertEqual(len(fb),0)
+    def testFrameBufferBurst(self):
+        """ Check for 64 KiB deliver burst fed in random chunks """
+        fb = cimd.FrameBuffer(compactSize=4096)
+        msg = self.cimd.createMessage(20,[(21,'123456789'),(33,'x' * 100)],1,True)
+        msg = msg.encode('latin-1')
+        count = 65536 // len(msg) + 1
+        data = msg * count
+        rnd = random.Random(12)
+        pos = received = 0
+        while pos < len(data):
+            size = rnd.randint(1,3000)
+            fb.feed(data[pos:pos + size])
+            pos += size
+            for view in fb.frames():
+                self.assertEqual(self.cimd.parseFrame(view).getParamValue(33),b'x' * 100)
+                received += 1
+        self.assertEqual(received,count)
+        self.assertTrue(len(fb.buffer) < 4096 + 3000)
 
 class SMSCTestCase(unittest.TestCase):
     def setUp(self):
@@ -140,6 +240,137 @@ class SMSCTestCase(unittest.TestCase):
         expectedResult = self.smsc.cimd.encode(expectedResult)
         self.assertEqual(submitResult,expectedResult)
         self.assertRaises(cimd.CIMDError,self.smsc.submitMessage,[])
+    def testCompileTemplate(self):
+        """ Check that template renders the same messages as submitMessage """
+        template = self.smsc.compileTemplate(origAddr="999",statusReport=14,
+                                             validPeriodRel=167)
+        for useChecksum in (False, True):
+            self.smsc.setChecksumUsage(useChecksum)
+            for destAddr, text in (("123456789","first"),("987654321","second text")):
+                self.smsc.cimd.setPacketNumber(253)
+                expectedResult = self.smsc.submitMessage(self.smsc.encodeTextMsgParams(
+                        destAddr=destAddr,origAddr="999",userData=text,
+                        statusReport=14,validPeriodRel=167))
+                self.smsc.cimd.setPacketNumber(253)
+                self.assertEqual(template.render(destAddr,text),expectedResult)
+        self.assertEqual(self.smsc.cimd.getPacketNumber(),255)
+        template = self.smsc.compileTemplate(('userData','destAddr'),protoID=0)
+        expectedResult = "{STX}03:255{TAB}021:123{TAB}033:text{TAB}052:0{TAB}"
+        self.assertTrue(self.smsc.cimd.decode(template.render('text','123')).startswith(expectedResult))
+        self.assertRaises(cimd.CIMDError,template.render,'text')
+        self.assertRaises(cimd.CIMDError,self.smsc.compileTemplate,('userData',))
+        self.assertRaises(cimd.CIMDError,self.smsc.compileTemplate,('destAddr',),destAddr='1')
+        self.assertRaises(cimd.CIMDError,self.smsc.compileTemplate,('destAddr','userData'),
+                          userDataBinary='00')
+        # Variable binary data and header slots
+        template = self.smsc.compileTemplate(('destAddr','userDataHeader','userDataBinary'),
+                                             dataCoding=4)
+        self.smsc.cimd.setPacketNumber(7)
+        expectedResult = self.smsc.submitMessage(self.smsc.encodeTextMsgParams(
+                destAddr="123",dataCoding=4,userDataHeader="050003010201",
+                userDataBinary="C8329BFD06"))
+        self.smsc.cimd.setPacketNumber(7)
+        self.assertEqual(template.render("123","050003010201","C8329BFD06"),expectedResult)
+    def testSubmitMessages(self):
+        """ Check for correct bulk encoding of submit messages """
+        paramLists = [self.smsc.encodeTextMsgParams(destAddr="12345",userData="first"),
+                      self.smsc.encodeTextMsgParams(destAddr="67890",userData="second")]
+        for useChecksum in (False, True):
+            self.smsc.setChecksumUsage(useChecksum)
+            self.smsc.cimd.setPacketNumber(253)
+            expectedResult = [self.smsc.submitMessage(params) for params in paramLists]
+            self.smsc.cimd.setPacketNumber(253)
+            buf, offsets = self.smsc.submitMessages(paramLists)
+            self.assertTrue(isinstance(buf,bytearray))
+            self.assertEqual(len(offsets),2)
+            self.assertEqual(offsets[-1][1],len(buf))
+            for (start, end), expected in zip(offsets, expectedResult):
+                self.assertEqual(bytes(buf[start:end]),cimd.toBytes(expected))
+        self.assertEqual(self.smsc.cimd.getPacketNumber(),1)
+        self.assertEqual(self.smsc.submitMessages([]),(bytearray(),[]))
+        self.assertRaises(cimd.CIMDError,self.smsc.submitMessages,[[]])
+    def testSubmitRecord(self):
+        """ Check for compact records accepted as message parameters """
+        options = tuple(self.smsc.encodeTextMsgParams(origAddr="555",statusReport=14))
+        paramList = [('021','12345'),('023','555'),('056',14),('033','text')]
+        record = cimd.SubmitRecord("12345","text",options)
+        self.assertEqual(list(record),paramList)
+        self.assertTrue(self.smsc.isOpcodeInEncodedParams('056',record))
+        self.assertFalse(self.smsc.isOpcodeInEncodedParams('034',record))
+        encoded = self.smsc.encodeRecord(record)
+        self.assertEqual(encoded.body,"021:12345\t023:555\t056:14\t033:text\t")
+        self.assertTrue(self.smsc.isOpcodeInEncodedParams('021',encoded))
+        self.assertTrue(self.smsc.isOpcodeInEncodedParams('033',encoded))
+        self.assertFalse(self.smsc.isOpcodeInEncodedParams('012',encoded))
+        self.assertRaises(cimd.CIMDError,self.smsc.submitMessage,
+                          self.smsc.encodeRecord([('033','text')]))
+        for useChecksum in (False, True):
+            self.smsc.setChecksumUsage(useChecksum)
+            messages = []
+            for params in (paramList, record, encoded):
+                self.smsc.cimd.setPacketNumber(11)
+                messages.append(self.smsc.submitMessage(params))
+            self.assertEqual(messages[1],messages[0])
+            self.assertEqual(messages[2],messages[0])
+            self.smsc.cimd.setPacketNumber(11)
+            buf, offsets = self.smsc.submitMessages([encoded])
+            self.assertEqual(bytes(buf),cimd.toBytes(messages[0]))
+        # SMSC side builders
+        self.smsc.cimd.setPacketNumber(11)
+        deliver = cimd.SubmitRecord("12345","text",[('023','555'),('060','061006131036')])
+        expected = self.smsc.deliverMessage(list(deliver))
+        self.smsc.cimd.setPacketNumber(11)
+        self.assertEqual(self.smsc.deliverMessage(self.smsc.encodeRecord(deliver)),expected)
+        report = cimd.SubmitRecord("12345",None,[('060','061006131036'),('061','4'),
+                                                 ('063','061006131040')])
+        self.assertEqual(self.smsc.cimd.parseFrame(self.smsc.deliverStatusReport(report)).opCode,23)
+    def testValidation(self):
+        """ Check for schema validation of parameter values """
+        self.assertRaises(cimd.CIMDError,self.smsc.deliveryRequest,"__import__('os')")
+        self.assertRaises(cimd.CIMDError,self.smsc.cancelMessage,'3',"123")
+        self.assertEqual(self.smsc.cimd.extractParamValue(self.smsc.deliveryRequest('2'),68),'2')
+        encode = self.smsc.encodeTextMsgParams
+        self.assertRaises(cimd.CIMDError,encode,destAddr="12a")
+        self.assertRaises(cimd.CIMDError,encode,destAddr="1" * 21)
+        self.assertRaises(cimd.CIMDError,encode,dataCoding="1+1")
+        self.assertRaises(cimd.CIMDError,encode,dataCoding=256)
+        self.assertEqual(encode(alphaOrigAddr="Shop-1 \xe9!"),[('027','Shop-1 \xe9!')])
+        self.assertRaises(cimd.CIMDError,encode,alphaOrigAddr="Shop\tname")
+        self.assertRaises(cimd.CIMDError,encode,alphaOrigAddr="TwelveChars!")
+        self.assertRaises(cimd.CIMDError,encode,userDataBinary="ABC")
+        self.assertRaises(cimd.CIMDError,encode,userData="a",userDataBinary="AB")
+        self.assertRaises(cimd.CIMDError,encode,validPeriodRel=1,validPeriodAbs="061006131036")
+        self.assertEqual(encode(destAddr="+420123",dataCoding=8,userDataBinary="00AB"),
+                         [('021','+420123'),('030','8'),('034','00AB')])
+        self.assertRaises(cimd.CIMDError,self.smsc.login,'name','pass',10)
+        self.assertEqual(self.smsc.cimd.extractParamValue(self.smsc.login(12345,'pass'),10),'12345')
+        self.assertRaises(cimd.CIMDError,self.smsc.login,10 ** 33,'pass')
+        self.assertRaises(cimd.CIMDError,self.smsc.login,'name','pass',None,129)
+        self.assertRaises(cimd.CIMDError,self.smsc.submitMessage,[('021','123'),(60,'x')])
+        self.assertRaises(cimd.CIMDError,self.smsc.deliverStatusReport,
+                          [('021','123'),('060','061006131036'),('063','061006131040')])
+    def testTrusted(self):
+        """ Check for trusted instance skipping validation """
+        smsc = cimd.SMSC(trusted=True)
+        self.assertEqual(smsc.encodeTextMsgParams(destAddr="12a"),[('021','12a')])
+        self.assertEqual(smsc.cimd.parseFrame(smsc.submitMessage([])).opCode,3)
+    def testRecordSize(self):
+        """ Check for queued message taking a fraction of tuple list memory """
+        def size(obj):
+            total = sys.getsizeof(obj)
+            if isinstance(obj, (list, tuple)):
+                total += sum([size(item) for item in obj])
+            return total
+        text = "Hello world"
+        options = tuple(self.smsc.encodeTextMsgParams(origAddr="555",statusReport=14,priority=1))
+        params = self.smsc.encodeTextMsgParams(destAddr="420123456789",userData=text,
+                                               origAddr="555",statusReport=14,priority=1)
+        listSize = size(params)
+        record = cimd.SubmitRecord("420123456789",text,options)
+        recordSize = sys.getsizeof(record) + sys.getsizeof(record.destAddr) + sys.getsizeof(text)
+        self.assertTrue(recordSize * 2 < listSize)
+        encoded = self.smsc.encodeRecord(params)
+        self.assertTrue(sys.getsizeof(encoded) + sys.getsizeof(encoded.body) < listSize / 2)
     def testEnquireMessageStatus(self):
         """ Check for message status enquiry """
         enquireResult = self.smsc.enquireMessageStatus("987654321","060904140021")
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+""" GSM 03.38 alphabet, CIMD user data codec and long message segmentation
+
+CIMD user_data carries GSM default alphabet characters as printable
+ASCII, characters outside ASCII as "_" followed by a two character
+combination and extension table characters as "_XX" followed by the
+representation of the basic character with the same code. Texts not
+covered by the alphabet are sent as UCS-2 in user_data_binary.
+
+Texts are split in one pass using precomputed character costs, septets
+for GSM 7-bit default alphabet and octets for UCS-2. Each segment of
+a long message gets concatenation user data header (UDH) with 8-bit or
+16-bit reference number."""
+
+import re
+import binascii
+import random
+import cimd
+
+# GSM 03.38 default alphabet, index is the septet value
+basicAlphabet = (u"@£$¥èéùìòÇ\nØø\rÅå"
+                 u"Δ_ΦΓΛΩΠΨΣΘΞ\x1bÆæßÉ"
+                 u" !\"#¤%&'()*+,-./0123456789:;<=>?"
+                 u"¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§"
+                 u"¿abcdefghijklmnopqrstuvwxyzäöñüà")
+
+# Extension table, code -> character, sent as escape + code
+extensionTable = {0x0A: u"\x0c", 0x14: u"^", 0x28: u"{", 0x29: u"}", 0x2F: u"\\",
+                  0x3C: u"[", 0x3D: u"~", 0x3E: u"]", 0x40: u"|", 0x65: u"€"}
+extensionAlphabet = u"".join(sorted(extensionTable.values()))
+
+# CIMD special combinations, basic alphabet code -> combination
+combinations = {
+    0x00: "Oa", 0x01: "L-", 0x03: "Y-", 0x04: "e`", 0x05: "e'", 0x06: "u`",
+    0x07: "i`", 0x08: "o`", 0x09: "C,", 0x0B: "O/", 0x0C: "o/", 0x0E: "A*",
+    0x0F: "a*", 0x10: "gd", 0x11: "--", 0x12: "gf", 0x13: "gg", 0x14: "gl",
+    0x15: "go", 0x16: "gp", 0x17: "gi", 0x18: "gs", 0x19: "gt", 0x1A: "gx",
+    0x1B: "XX", 0x1C: "AE", 0x1D: "ae", 0x1E: "ss", 0x1F: "E'", 0x22: "qq",
+    0x24: "ox", 0x40: "!!", 0x5B: 'A"', 0x5C: 'O"', 0x5D: "N~", 0x5E: 'U"',
+    0x5F: "so", 0x60: "??", 0x7B: 'a"', 0x7C: 'o"', 0x7D: "n~", 0x7E: 'u"',
+    0x7F: "a`",
+}
+
+# Septets per character, characters missing here need UCS-2
+gsmCosts = {}
+for char in basicAlphabet:
+    gsmCosts[char] = 1
+for char in extensionAlphabet:
+    gsmCosts[char] = 2
+del gsmCosts[u'\x1b']
+del char
+
+# Character -> CIMD user data representation
+basicRepresentation = []
+for code in range(128):
+    if code in combinations:
+        basicRepresentation.append('_' + combinations[code])
+    else:
+        basicRepresentation.append(str(basicAlphabet[code]))
+cimdChars = {}
+for code in range(128):
+    if code != 0x1B:
+        cimdChars[basicAlphabet[code]] = basicRepresentation[code]
+for code, char in extensionTable.items():
+    cimdChars[char] = '_XX' + basicRepresentation[code]
+del code, char
+
+# Special combination -> character, for decoding
+combinationChars = {}
+for code, combination in combinations.items():
+    combinationChars[combination] = basicAlphabet[code]
+del code, combination
+
+# Texts matching this are their own CIMD representation
+reVerbatim = re.compile(r"[A-Za-z0-9 !#$%&'()*+,\-./:;<=>?\n\r]*\Z")
+
+# Octets per UCS-2 character. Surrogate pair costs 4 octets, counted at
+# its first half, so that a pair is never split between segments.
+ucs2HighSurrogateCost = 4
+ucs2LowSurrogateCost = 0
+
+# Data coding schemes
+dcsDefault = 0
+dcsUCS2 = 8
+
+# Single message capacity, septets (GSM) or octets (UCS-2)
+singleLimit = {dcsDefault: 160, dcsUCS2: 140}
+
+# Segment capacity by reference number size, 8-bit reference UDH takes
+# 6 octets, 16-bit one 7 octets of the 140 available
+segmentLimit = {
+    8: {dcsDefault: 153, dcsUCS2: 134},
+    16: {dcsDefault: 152, dcsUCS2: 132},
+}
+
+maxSegments = 255
+
+def ucs2Cost(char):
+    code = ord(char)
+    if code < 0xD800 or 0xE000 <= code <= 0xFFFF:
+        return 2
+    if code < 0xDC00:
+        return ucs2HighSurrogateCost
+    if code < 0xE000:
+        return ucs2LowSurrogateCost
+    return 4                            # Outside BMP on wide builds
+
+def split(text, referenceBits=8):
+    """ Returns (data coding scheme, list of segment texts)
+
+    Default alphabet is used if it covers the whole text, UCS-2 otherwise.
+    A text fitting into a single message is returned as one segment."""
+    if isinstance(text, bytes):
+        text = text.decode('latin-1')
+    limits = segmentLimit[referenceBits]
+    gsmLimit = limits[dcsDefault]
+    ucsLimit = limits[dcsUCS2]
+    costs = gsmCosts
+    isGsm = True
+    gsmTotal = gsmUsed = ucsTotal = ucsUsed = 0
+    gsmStarts = [0]
+    ucsStarts = [0]
+    for i in range(len(text)):
+        char = text[i]
+        if isGsm:
+            cost = costs.get(char)
+            if cost is None:
+                isGsm = False
+            else:
+                gsmTotal += cost
+                gsmUsed += cost
+                if gsmUsed > gsmLimit:
+                    gsmStarts.append(i)
+                    gsmUsed = cost
+        cost = ucs2Cost(char)
+        ucsTotal += cost
+        ucsUsed += cost
+        if ucsUsed > ucsLimit:
+            ucsStarts.append(i)
+            ucsUsed = cost
+    if isGsm:
+        dataCoding, total, starts = dcsDefault, gsmTotal, gsmStarts
+    else:
+        dataCoding, total, starts = dcsUCS2, ucsTotal, ucsStarts
+    if total <= singleLimit[dataCoding]:
+        return dataCoding, [text]
+    if len(starts) > maxSegments:
+        raise cimd.CIMDError('Text too long')
+    starts.append(len(text))
+    return dataCoding, [text[starts[i]:starts[i + 1]] for i in range(len(starts) - 1)]
+
+def concatHeader(reference, total, sequence, referenceBits=8):
+    """ Returns concatenation UDH (including its length) as hex string """
+    if referenceBits == 8:
+        return '050003%02X%02X%02X' % (reference & 0xFF, total, sequence)
+    return '060804%04X%02X%02X' % (reference & 0xFFFF, total, sequence)
+
+def encodeUserData(text):
+    """ Returns text in CIMD user data representation
+
+    None is returned if the text is not covered by GSM default alphabet.
+    Byte strings are taken as latin-1."""
+    if isinstance(text, bytes) and not isinstance(text, str):
+        text = text.decode('latin-1')
+    if reVerbatim.match(text):
+        if not isinstance(text, str):
+            text = text.encode('ascii')   # Python 2 unicode
+        return text
+    if isinstance(text, bytes):
+        text = text.decode('latin-1')
+    parts = []
+    chars = cimdChars
+    for char in text:
+        representation = chars.get(char)
+        if representation is None:
+            return None
+        parts.append(representation)
+    return ''.join(parts)
+
+def decodeUserData(data):
+    """ Returns unicode text of CIMD user data (str, bytes or memoryview) """
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    if isinstance(data, bytes):
+        data = data.decode('latin-1')
+    if u'_' not in data:
+        return data
+    parts = []
+    i = 0
+    end = len(data)
+    while i < end:
+        char = data[i]
+        if char != u'_':
+            parts.append(char)
+            i += 1
+            continue
+        combination = data[i + 1:i + 3]
+        i += 3
+        if combination != u'XX':
+            char = combinationChars.get(combination)
+            if char is None:
+                raise cimd.CIMDError('Invalid special combination _' + combination)
+            parts.append(char)
+            continue
+        # Extension character, code is given by its basic representation
+        if data[i:i + 1] == u'_':
+            combination = data[i + 1:i + 3]
+            i += 3
+            code = basicAlphabet.find(combinationChars.get(combination, u'\x1b'))
+        else:
+            code = basicAlphabet.find(data[i:i + 1])
+            i += 1
+        if code not in extensionTable:
+            raise cimd.CIMDError('Invalid extension character')
+        parts.append(extensionTable[code])
+    return u''.join(parts)
+
+def ucs2Hex(text):
+    return binascii.hexlify(text.encode('utf-16-be')).decode('ascii').upper()
+
+def encodeText(text):
+    """ Returns encodeTextMsgParams arguments carrying text
+
+    Text covered by GSM default alphabet goes to user_data, other text
+    to user_data_binary as UCS-2 with data coding scheme 8."""
+    userData = encodeUserData(text)
+    if userData is not None:
+        return {'userData': userData}
+    if isinstance(text, bytes):
+        text = text.decode('latin-1')
+    return {'dataCoding': dcsUCS2, 'userDataBinary': str(ucs2Hex(text))}
+
+def messageText(frame):
+    """ Returns text of received cimd.CIMDFrame or None
+
+    user_data is decoded from CIMD representation, user_data_binary only
+    if data coding scheme says UCS-2."""
+    data = frame.getParamValue(33)
+    if data is not None:
+        return decodeUserData(data)
+    data = frame.getParamValue(34)
+    if data is None:
+        return None
+    dataCoding = frame.getParamValue(30)
+    if dataCoding is None or int(dataCoding) & 0x0C != dcsUCS2:
+        return None
+    return binascii.unhexlify(data).decode('utf-16-be')
+
+def userDataParams(dataCoding, segment):
+    """ Returns encodeTextMsgParams arguments carrying the segment """
+    if dataCoding == dcsUCS2:
+        return {'dataCoding': dcsUCS2, 'userDataBinary': str(ucs2Hex(segment))}
+    return {'userData': encodeUserData(segment)}
+
+class Segmenter:
+    """ Splits long texts into submit messages of one campaign
+
+    Reference numbers are taken from a per-campaign counter starting at
+    a random value, so parts of different texts for one handset do not
+    get mixed up."""
+
+    def __init__(self, smsc=None, referenceBits=8, reference=None):
+        if referenceBits not in segmentLimit:
+            raise cimd.CIMDError('Reference number has 8 or 16 bits')
+        if smsc is None:
+            smsc = cimd.SMSC()
+        self.smsc = smsc
+        self.referenceBits = referenceBits
+        if reference is None:
+            reference = random.randrange(1 << referenceBits)
+        self.reference = reference
+
+    def nextReference(self):
+        self.reference = (self.reference + 1) % (1 << self.referenceBits)
+        return self.reference
+
+    def encode(self, text, **msgParams):
+        """ Returns list of encoded message parameters, one per segment
+
+        msgParams are encodeTextMsgParams arguments other than user data."""
+        dataCoding, segments = split(text, self.referenceBits)
+        if len(segments) == 1:
+            params = dict(msgParams)
+            params.update(userDataParams(dataCoding, segments[0]))
+            return [self.smsc.encodeTextMsgParams(**params)]
+        reference = self.nextReference()
+        total = len(segments)
+        result = []
+        for i in range(total):
+            params = dict(msgParams)
+            params.update(userDataParams(dataCoding, segments[i]))
+            params['userDataHeader'] = concatHeader(reference, total, i + 1,
+                                                    self.referenceBits)
+            result.append(self.smsc.encodeTextMsgParams(**params))
+        return result
+
+    def submitMessages(self, text, **msgParams):
+        """ Returns submit messages of all segments """
+        return [self.smsc.submitMessage(params) for params in self.encode(text, **msgParams)]
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+""" Unit test for gsm.py """
+
+import gsm
+import cimd
+import unittest
+
+class SplitTestCase(unittest.TestCase):
+    def testAlphabet(self):
+        """ Check for complete cost tables """
+        self.assertEqual(len(gsm.basicAlphabet),128)
+        self.assertEqual(gsm.gsmCosts[u'@'],1)
+        self.assertEqual(gsm.gsmCosts[u'€'],2)
+        self.assertFalse(u'\x1b' in gsm.gsmCosts)
+    def testSingle(self):
+        """ Check for texts fitting into one message """
+        self.assertEqual(gsm.split(u'a' * 160),(0,[u'a' * 160]))
+        self.assertEqual(gsm.split(u'€' * 80),(0,[u'€' * 80]))
+        self.assertEqual(gsm.split(u'Ж' * 70),(8,[u'Ж' * 70]))
+    def testGsmSegments(self):
+        """ Check for default alphabet segment boundaries """
+        coding, segments = gsm.split(u'a' * 161)
+        self.assertEqual(coding,0)
+        self.assertEqual([len(s) for s in segments],[153,8])
+        # Extension character is never split from its escape
+        coding, segments = gsm.split(u'x' * 152 + u'€' + u'y' * 10)
+        self.assertEqual(segments,[u'x' * 152,u'€' + u'y' * 10])
+        coding, segments = gsm.split(u'a' * 305,16)
+        self.assertEqual([len(s) for s in segments],[152,152,1])
+    def testUcs2Segments(self):
+        """ Check for UCS-2 segment boundaries """
+        coding, segments = gsm.split(u'a' * 100 + u'Ж')
+        self.assertEqual(coding,8)
+        self.assertEqual([len(s) for s in segments],[67,34])
+        coding, segments = gsm.split(u'Ж' * 133,16)
+        self.assertEqual([len(s) for s in segments],[66,66,1])
+        # Surrogate pair on narrow builds is not split
+        pair = u'😀'
+        coding, segments = gsm.split(u'Ж' * 66 + pair + u'Ж' * 10)
+        self.assertEqual(u''.join(segments),u'Ж' * 66 + pair + u'Ж' * 10)
+        for segment in segments:
+            self.assertFalse(segment.startswith(u'\ude00'))
+    def testTooLong(self):
+        """ Check for error on more than 255 segments """
+        self.assertRaises(cimd.CIMDError,gsm.split,u'a' * (153 * 255 + 1))
+
+class CodecTestCase(unittest.TestCase):
+    def testAscii(self):
+        """ Check for plain ASCII passed as it is """
+        self.assertEqual(gsm.encodeUserData('Hello, world 1+1=2?'),'Hello, world 1+1=2?')
+        self.assertEqual(gsm.encodeUserData(u'Hello'),'Hello')
+        self.assertTrue(isinstance(gsm.encodeUserData(u'Hello'),str))
+        self.assertEqual(gsm.decodeUserData(b'Hello'),u'Hello')
+    def testSpecialCombinations(self):
+        """ Check for special combinations and extension characters """
+        text = u'@ä_"ΩÉ€{|^'
+        encoded = gsm.encodeUserData(text)
+        self.assertEqual(encoded,'_Oa_a"_--_qq_go_E\'_XXe_XX(_XX_!!_XX_gl')
+        self.assertEqual(gsm.decodeUserData(encoded),text)
+        self.assertEqual(gsm.decodeUserData(memoryview(encoded.encode('ascii'))),text)
+        self.assertRaises(cimd.CIMDError,gsm.decodeUserData,'_zz')
+    def testRoundTrip(self):
+        """ Check for every GSM character surviving encode and decode """
+        text = u''.join([char for char in gsm.basicAlphabet if char != u'\x1b'])
+        text += gsm.extensionAlphabet
+        encoded = gsm.encodeUserData(text)
+        self.assertTrue(all([32 <= ord(c) < 127 or c in '\n\r' for c in encoded]))
+        self.assertEqual(gsm.decodeUserData(encoded),text)
+    def testUcs2Fallback(self):
+        """ Check for UCS-2 in binary user data if GSM does not cover text """
+        self.assertEqual(gsm.encodeUserData(u'Жук'),None)
+        self.assertEqual(gsm.encodeText(u'Жук'),{'dataCoding':8,'userDataBinary':'04160443043A'})
+        self.assertEqual(gsm.encodeText(u'Ωmega'),{'userData':'_gomega'})
+    def testMessageText(self):
+        """ Check for text of received deliver message """
+        smsc = cimd.SMSC()
+        for text in (u'Stop', u'Ça va €', u'Жук'):
+            params = [('021','123'),('023','456'),('060','061006131036')]
+            params += smsc.encodeTextMsgParams(**gsm.encodeText(text))
+            frame = smsc.cimd.parseFrame(smsc.deliverMessage(params))
+            self.assertEqual(gsm.messageText(frame),text)
+        frame = smsc.cimd.parseFrame(smsc.alive())
+        self.assertEqual(gsm.messageText(frame),None)
+
+class SegmenterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.smsc = cimd.SMSC()
+    def testConcatHeader(self):
+        """ Check for 8-bit and 16-bit reference UDH """
+        self.assertEqual(gsm.concatHeader(0x1A,3,1),'0500031A0301')
+        self.assertEqual(gsm.concatHeader(0x1234,3,2,16),'06080412340302')
+    def testEncode(self):
+        """ Check for parameters of segmented text """
+        segmenter = gsm.Segmenter(self.smsc,reference=255)
+        params = segmenter.encode(u'a' * 200,destAddr='123',statusReport=14)
+        self.assertEqual(len(params),2)
+        self.assertEqual(params[0],[('021','123'),('032','050003000201'),
+                                    ('033','a' * 153),('056',14)])
+        self.assertEqual(params[1][1],('032','050003000202'))
+        # Next text gets next reference, single message gets no UDH
+        params = segmenter.encode(u'b' * 200,destAddr='123')
+        self.assertEqual(params[0][1],('032','050003010201'))
+        self.assertEqual(segmenter.encode(u'short',destAddr='123'),[[('021','123'),('033','short')]])
+    def testEncodeUcs2(self):
+        """ Check for UCS-2 segments in binary user data """
+        segmenter = gsm.Segmenter(self.smsc,referenceBits=16,reference=0)
+        params = segmenter.encode(u'Ж' * 71,destAddr='123')
+        self.assertEqual(len(params),2)
+        self.assertEqual(params[0][:3],[('021','123'),('030','8'),('032','06080400010201')])
+        self.assertEqual(params[0][3],('034','0416' * 66))
+        self.assertEqual(params[1][3],('034','0416' * 5))
+    def testSubmitMessages(self):
+        """ Check for submit message per segment """
+        segmenter = gsm.Segmenter(self.smsc)
+        messages = segmenter.submitMessages(u'a' * 400,destAddr='123')
+        self.assertEqual(len(messages),3)
+        for message in messages:
+            self.assertEqual(self.smsc.cimd.parseFrame(message).opCode,3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+""" Inbound message queue for CIMD clients
+
+deliver_msg and deliver_status_rep frames are acknowledged by the
+receive loop as soon as they are parsed and handed over to
+InboundQueue. Worker threads take them out in batches and pass them to
+the application, so slow application code never delays acks."""
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class InboundQueue:
+    """ Bounded queue of received cimd.CIMDFrame drained by worker threads
+
+    handler is called in a worker thread with a list of up to batchSize
+    frames. put() never blocks, if the queue is full the frame is
+    rejected and the client answers it with nack, so SMSC delivers it
+    again later. One queue may serve several sessions."""
+
+    sentinel = None
+
+    def __init__(self, handler, workers=2, maxSize=10000, batchSize=100):
+        self.log = logging.getLogger("InboundQueue")
+        self.handler = handler
+        self.workers = workers
+        self.batchSize = batchSize
+        self.queue = queue.Queue(maxSize)
+        self.threads = []
+        self.rejected = 0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.run, name="InboundWorker-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def put(self, frame):
+        """ Queues frame, returns False if the queue is full """
+        try:
+            self.queue.put_nowait(frame)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        return True
+
+    def run(self):
+        while True:
+            frame = self.queue.get()
+            if frame is self.sentinel:
+                break
+            batch = [frame]
+            stop = False
+            while len(batch) < self.batchSize:
+                try:
+                    frame = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is self.sentinel:
+                    stop = True
+                    break
+                batch.append(frame)
+            try:
+                self.handler(batch)
+            except Exception:
+                self.log.exception("[Inbound handler failed]")
+            if stop:
+                break
+
+    def stop(self):
+        """ Hands all queued frames to the handler and stops the workers """
+        for thread in self.threads:
+            self.queue.put(self.sentinel)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
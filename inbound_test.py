@@ -0,0 +1,92 @@
+""" Unit test for inbound.py """
+
+import inbound
+import cimd
+import timer
+import threading
+import unittest
+import asyncore
+import SMSCClient
+import SMSCSimulator
+from SMSCClient_test import loopUntil
+
+class InboundQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.smsc = cimd.SMSC()
+        self.batches = []
+        self.lock = threading.Lock()
+    def handler(self, batch):
+        with self.lock:
+            self.batches.append(batch)
+    def frame(self, packetNumber):
+        return self.smsc.cimd.parseFrame(self.smsc.cimd.createMessage(20, [(21, '123')],
+                                                                        packetNumber))
+    def testBatches(self):
+        """ Testing queued frames are handed over in batches and stop drains the queue """
+        queue = inbound.InboundQueue(self.handler, workers=1, batchSize=4)
+        for i in range(10):
+            self.assertTrue(queue.put(self.frame(2 * i)))
+        queue.start()
+        queue.stop()
+        self.assertEqual([len(batch) for batch in self.batches],[4,4,2])
+        self.assertEqual([frame.packetNumber for batch in self.batches for frame in batch],
+                         [2 * i for i in range(10)])
+    def testFull(self):
+        """ Testing full queue rejects frames without blocking """
+        queue = inbound.InboundQueue(self.handler, maxSize=2)
+        self.assertTrue(queue.put(self.frame(2)))
+        self.assertTrue(queue.put(self.frame(4)))
+        self.assertFalse(queue.put(self.frame(6)))
+        self.assertEqual(queue.rejected,1)
+    def testHandlerError(self):
+        """ Testing failing handler does not stop the worker """
+        def handler(batch):
+            if batch[0].packetNumber == 2:
+                raise ValueError('failed')
+            self.handler(batch)
+        queue = inbound.InboundQueue(handler, workers=1, batchSize=1).start()
+        queue.put(self.frame(2))
+        queue.put(self.frame(4))
+        queue.stop()
+        self.assertEqual([batch[0].packetNumber for batch in self.batches],[4])
+
+class ClientInboundTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+        self.frames = []
+    def tearDown(self):
+        asyncore.close_all()
+    def handler(self, batch):
+        self.frames.extend(batch)
+    def testAcknowledge(self):
+        """ Testing deliver_msg and deliver_status_rep are acked and queued """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, statusReports=True)
+        queue = inbound.InboundQueue(self.handler).start()
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',
+                                       scheduler=self.scheduler,inbound=queue)
+        self.assertTrue(loopUntil(lambda: simulator.loggedIn(), scheduler=self.scheduler))
+        simulator.deliverMessage('111', '222', 'hello')
+        client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='333',userData='x'))
+        self.assertTrue(loopUntil(lambda: simulator.counters.get(73) == 1,
+                                  scheduler=self.scheduler))
+        queue.stop()
+        self.assertEqual(simulator.counters.get(70),1)
+        self.assertEqual(simulator.sessions[0].unacked,{})
+        self.assertEqual(sorted([frame.opCode for frame in self.frames]),[20,23])
+        self.assertEqual(client.framesSent.get('deliver_msg_resp'),1)
+    def testNack(self):
+        """ Testing frames not fitting into the queue are answered with nack """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler)
+        queue = inbound.InboundQueue(self.handler, maxSize=1)
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',
+                                       scheduler=self.scheduler,inbound=queue)
+        self.assertTrue(loopUntil(lambda: simulator.loggedIn(), scheduler=self.scheduler))
+        simulator.deliverMessage('111', '222', 'first')
+        simulator.deliverMessage('111', '222', 'second')
+        self.assertTrue(loopUntil(lambda: simulator.counters.get(99) == 1,
+                                  scheduler=self.scheduler))
+        self.assertEqual(simulator.counters.get(70),1)
+        self.assertEqual(queue.rejected,1)
+
+if __name__ == "__main__":
+    unittest.main()
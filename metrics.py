@@ -0,0 +1,182 @@
+""" Metrics registry for CIMD clients
+
+Counters, gauges and fixed-bucket histograms with one optional label,
+cheap enough to be updated for every frame. snapshot() returns plain
+data, render() Prometheus text exposition format."""
+
+import bisect
+import os
+
+# Seconds, suitable for submit-to-response latency
+latencyBuckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def formatValue(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        if value == int(value):
+            return '%d' % value
+        return repr(value)
+    return str(value)
+
+def escapeLabel(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Counter:
+    """ Monotonic counter, values are kept per label value """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.values = {}
+
+    def inc(self, key=None, amount=1):
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, key=None):
+        return self.values.get(key, 0)
+
+    def snapshot(self):
+        return dict(self.values)
+
+    def samples(self):
+        """ Returns list of (suffix, labels, value) """
+        return [('', self.labels(key), value) for key, value in sorted(self.values.items())]
+
+    def labels(self, key):
+        if self.label is None or key is None:
+            return []
+        return [(self.label, key)]
+
+class Gauge(Counter):
+    """ Value which goes up and down """
+
+    kind = 'gauge'
+
+    def set(self, value, key=None):
+        self.values[key] = value
+
+class Histogram(Counter):
+    """ Distribution over fixed upper bounds
+
+    Per label value, counts of observations in each bucket are kept
+    together with their sum and number."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=latencyBuckets, label=None):
+        Counter.__init__(self, name, help, label)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, key=None):
+        data = self.values.get(key)
+        if data is None:
+            data = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def get(self, key=None):
+        """ Returns number of observations """
+        data = self.values.get(key)
+        return data[2] if data else 0
+
+    def snapshot(self):
+        result = {}
+        for key, (counts, total, count) in self.values.items():
+            result[key] = {'buckets': list(zip(self.buckets + (float('inf'),), counts)),
+                           'sum': total, 'count': count}
+        return result
+
+    def samples(self):
+        samples = []
+        for key, (counts, total, count) in sorted(self.values.items()):
+            labels = self.labels(key)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                samples.append(('_bucket', labels + [('le', formatValue(bound))], cumulative))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        return samples
+
+class Registry:
+    """ Named collection of metrics """
+
+    def __init__(self):
+        self.metrics = {}
+        self.exportTimer = None
+
+    def register(self, metric):
+        """ Returns metric registered under the same name, metric if none
+
+        Raises ValueError if the registered metric differs in kind or label."""
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if existing.kind != metric.kind or existing.label != metric.label:
+                raise ValueError('Metric %s already registered as %s with label %r'
+                                 % (metric.name, existing.kind, existing.label))
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, label=None):
+        """ Returns counter name, creating it on first use """
+        return self.register(Counter(name, help, label))
+
+    def gauge(self, name, help, label=None):
+        return self.register(Gauge(name, help, label))
+
+    def histogram(self, name, help, buckets=latencyBuckets, label=None):
+        return self.register(Histogram(name, help, buckets, label))
+
+    def snapshot(self):
+        """ Returns {metric name: {label value: value}} """
+        return dict((name, metric.snapshot()) for name, metric in self.metrics.items())
+
+    def render(self):
+        """ Returns metrics in Prometheus text exposition format """
+        lines = []
+        for name in sorted(self.metrics):
+            metric = self.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.help))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    labelText = ','.join(['%s="%s"' % (k, escapeLabel(v)) for k, v in labels])
+                    lines.append('%s%s{%s} %s' % (name, suffix, labelText, formatValue(value)))
+                else:
+                    lines.append('%s%s %s' % (name, suffix, formatValue(value)))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, target):
+        """ Writes rendered metrics to file name or passes them to callable
+
+        Files are replaced atomically, so a scraper never reads half of it."""
+        text = self.render()
+        if callable(target):
+            target(text)
+            return
+        tmpName = target + '.tmp'
+        f = open(tmpName, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        os.rename(tmpName, target)
+
+    def exportEvery(self, scheduler, interval, target):
+        """ Exports metrics every interval seconds using timer.Scheduler """
+        def export():
+            self.export(target)
+            self.exportTimer = scheduler.callLater(interval, export)
+        self.stopExport()
+        self.exportTimer = scheduler.callLater(interval, export)
+
+    def stopExport(self):
+        if self.exportTimer is not None:
+            self.exportTimer.cancel()
+            self.exportTimer = None
@@ -0,0 +1,70 @@
+""" Unit test for metrics.py """
+
+import metrics
+import timer
+import os
+import tempfile
+import unittest
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+    def testCounter(self):
+        """ Testing labelled counters and registration by name """
+        sent = self.registry.counter('frames_total','Frames','op')
+        sent.inc('submit_msg')
+        sent.inc('submit_msg',2)
+        sent.inc('alive')
+        self.assertTrue(self.registry.counter('frames_total','Frames','op') is sent)
+        self.assertRaises(ValueError,self.registry.gauge,'frames_total','Frames','op')
+        self.assertRaises(ValueError,self.registry.counter,'frames_total','Frames','code')
+        self.assertEqual(sent.get('submit_msg'),3)
+        self.assertEqual(sent.get('nack'),0)
+        self.assertEqual(self.registry.snapshot(),{'frames_total':{'submit_msg':3,'alive':1}})
+    def testHistogram(self):
+        """ Testing observations fall into fixed buckets """
+        latency = self.registry.histogram('latency','Latency',(0.1,1.0))
+        for value in (0.05,0.1,0.5,2.0):
+            latency.observe(value)
+        snapshot = latency.snapshot()[None]
+        self.assertEqual(snapshot['buckets'],[(0.1,2),(1.0,1),(float('inf'),1)])
+        self.assertEqual(snapshot['count'],4)
+        self.assertAlmostEqual(snapshot['sum'],2.65)
+    def testRender(self):
+        """ Testing Prometheus text format """
+        self.registry.counter('errors_total','Errors','code').inc(300)
+        self.registry.gauge('in_flight','In flight').set(4)
+        self.registry.histogram('latency','Latency',(0.5,),'op').observe(0.25,'alive')
+        expected = ['# HELP errors_total Errors',
+                    '# TYPE errors_total counter',
+                    'errors_total{code="300"} 1',
+                    '# HELP in_flight In flight',
+                    '# TYPE in_flight gauge',
+                    'in_flight 4',
+                    '# HELP latency Latency',
+                    '# TYPE latency histogram',
+                    'latency_bucket{op="alive",le="0.5"} 1',
+                    'latency_bucket{op="alive",le="+Inf"} 1',
+                    'latency_sum{op="alive"} 0.25',
+                    'latency_count{op="alive"} 1']
+        self.assertEqual(self.registry.render(),'\n'.join(expected)+'\n')
+    def testExport(self):
+        """ Testing export to callback and periodic export to file """
+        self.registry.counter('frames_total','Frames').inc()
+        texts = []
+        self.registry.export(texts.append)
+        self.assertEqual(texts,[self.registry.render()])
+        fileName = os.path.join(tempfile.mkdtemp(),'cimd.prom')
+        clock = [0]
+        scheduler = timer.Scheduler(clock=lambda: clock[0])
+        self.registry.exportEvery(scheduler,10,fileName)
+        clock[0] = 10
+        scheduler.run()
+        self.assertEqual(open(fileName).read(),self.registry.render())
+        self.registry.stopExport()
+        self.assertEqual(scheduler.nextTimeout(),None)
+        os.remove(fileName)
+        os.rmdir(os.path.dirname(fileName))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+""" Send rate limiting for CIMD clients
+
+TokenBucket allows rate messages per second with bursts up to burst
+messages. AIMDLimiter adapts the rate to the SMSC: it is cut by
+decrease factor when submits are answered with congestion error (10)
+or nack, at most once per cooldown seconds so that a burst of errors
+counts once, and grows additively, by increase messages per second for
+every second of successful sending. Each session has its own limiter,
+a TokenBucket shared by all sessions caps the total rate."""
+
+import time
+
+class TokenBucket:
+    """ Tokens refill continuously at rate per second up to burst
+
+    burst defaults to a tenth of second worth of messages, at least one."""
+
+    def __init__(self, rate, burst=None, clock=time.time):
+        self.clock = clock
+        self.fixedBurst = burst
+        self.rate = 0.0
+        self.burst = 1.0
+        self.setRate(rate)
+        self.tokens = self.burst
+        self.updated = clock()
+
+    def setRate(self, rate):
+        self.refill()
+        self.rate = float(rate)
+        if self.fixedBurst is not None:
+            self.burst = float(self.fixedBurst)
+        else:
+            self.burst = max(1.0, self.rate / 10)
+
+    def refill(self):
+        if not self.rate:
+            return
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self):
+        """ Returns number of messages which may be sent now """
+        self.refill()
+        return int(self.tokens + 1e-9)  # Refill is computed in floats
+
+    def take(self, count=1):
+        self.tokens -= count
+
+    def delay(self, count=1):
+        """ Returns seconds until count messages may be sent """
+        self.refill()
+        return max(0.0, (count - self.tokens) / self.rate)
+
+class AIMDLimiter(TokenBucket):
+    """ Token bucket with additive increase, multiplicative decrease
+
+    congestionRate is moving average of congested responses, rate is cut
+    only if it exceeds threshold. Rate stays within minRate..maxRate."""
+
+    def __init__(self, rate, minRate=1.0, maxRate=None, increase=1.0, decrease=0.5,
+                 cooldown=1.0, threshold=0.02, smoothing=0.1, burst=None, clock=time.time):
+        TokenBucket.__init__(self, rate, burst, clock)
+        self.minRate = minRate
+        self.maxRate = maxRate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.threshold = threshold
+        self.smoothing = smoothing
+        self.congestionRate = 0.0
+        self.lastDecrease = None
+        self.decreases = 0              # Counter
+
+    def success(self):
+        """ Accounts submit accepted by SMSC """
+        self.congestionRate *= 1 - self.smoothing
+        rate = self.rate + self.increase / self.rate
+        if self.maxRate is not None:
+            rate = min(rate, self.maxRate)
+        if rate != self.rate:
+            self.setRate(rate)
+
+    def congestion(self):
+        """ Accounts congestion error or nack, returns True if rate was cut """
+        self.congestionRate += (1 - self.congestionRate) * self.smoothing
+        if self.congestionRate <= self.threshold or self.rate <= self.minRate:
+            return False
+        now = self.clock()
+        if self.lastDecrease is not None and now - self.lastDecrease < self.cooldown:
+            return False
+        self.lastDecrease = now
+        self.setRate(max(self.minRate, self.rate * self.decrease))
+        self.tokens = 0.0               # Pause before the next message
+        self.decreases += 1
+        return True
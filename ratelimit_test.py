@@ -0,0 +1,108 @@
+""" Unit test for ratelimit.py """
+
+import ratelimit
+import timer
+import time
+import unittest
+import asyncore
+import SMSCClient
+import SMSCPool
+import SMSCSimulator
+from SMSCClient_test import loopUntil
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class TokenBucketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+    def testRefill(self):
+        """ Testing tokens refill at rate up to burst """
+        bucket = ratelimit.TokenBucket(100, clock=self.clock)
+        self.assertEqual(bucket.burst,10)
+        self.assertEqual(bucket.available(),10)
+        bucket.take(10)
+        self.assertEqual(bucket.available(),0)
+        self.assertAlmostEqual(bucket.delay(),0.01)
+        self.clock.now += 0.05
+        self.assertEqual(bucket.available(),5)
+        self.clock.now += 10
+        self.assertEqual(bucket.available(),10)
+        bucket = ratelimit.TokenBucket(5, burst=3, clock=self.clock)
+        self.assertEqual(bucket.available(),3)
+
+class AIMDLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = ratelimit.AIMDLimiter(100, minRate=10, maxRate=110, clock=self.clock)
+    def testDecrease(self):
+        """ Testing rate is halved once per cooldown down to minRate """
+        self.assertTrue(self.limiter.congestion())
+        self.assertEqual(self.limiter.rate,50)
+        self.assertEqual(self.limiter.available(),0)
+        self.assertFalse(self.limiter.congestion())
+        self.assertEqual(self.limiter.rate,50)
+        for i in range(5):
+            self.clock.now += 1
+            self.limiter.congestion()
+        self.assertEqual(self.limiter.rate,10)
+        self.assertEqual(self.limiter.decreases,4)
+    def testIncrease(self):
+        """ Testing rate grows by increase per second of successes up to maxRate """
+        self.limiter.congestion()
+        for i in range(50):
+            self.limiter.success()
+        self.assertAlmostEqual(self.limiter.rate,51,1)
+        self.assertTrue(self.limiter.congestionRate < 0.01)
+        for i in range(10000):
+            self.limiter.success()
+        self.assertEqual(self.limiter.rate,110)
+    def testThreshold(self):
+        """ Testing rare congestion below threshold keeps the rate """
+        limiter = ratelimit.AIMDLimiter(100, threshold=0.2, clock=self.clock)
+        self.assertFalse(limiter.congestion())
+        self.assertEqual(limiter.rate,100)
+        self.assertFalse(limiter.congestion())
+        self.assertTrue(limiter.congestion())
+
+class ClientRateTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+    def tearDown(self):
+        asyncore.close_all()
+    def testPacing(self):
+        """ Testing submits are paced by the limiter of the session """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler)
+        limiter = ratelimit.AIMDLimiter(100, burst=1, increase=0)
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',windowSize=8,
+                                       scheduler=self.scheduler,rateLimiter=limiter)
+        self.assertTrue(loopUntil(client.isReady, scheduler=self.scheduler))
+        start = time.time()
+        client.submitMessages([client.smscc.encodeTextMsgParams(destAddr='123',userData='x')
+                               for i in range(11)])
+        self.assertTrue(loopUntil(lambda: client.pending() == 0, scheduler=self.scheduler))
+        self.assertTrue(time.time() - start >= 0.09)
+        self.assertEqual(simulator.counters.get(3),11)
+    def testCongestion(self):
+        """ Testing congestion errors lower the rate of the session """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, congestionRate=1.0)
+        pool = SMSCPool.SMSCPool('127.0.0.1',simulator.port,'user','pass',sessions=2,
+                                 windowSize=4,scheduler=self.scheduler,rate=200,globalRate=300)
+        self.assertTrue(loopUntil(lambda: len(pool.activeSessions()) == 2,
+                                  scheduler=self.scheduler))
+        futures = pool.submitMessages([pool.smscc.encodeTextMsgParams(destAddr='123',
+                                                                      userData='x')
+                                       for i in range(8)])
+        self.assertTrue(loopUntil(lambda: pool.pending() == 0, scheduler=self.scheduler))
+        self.assertEqual([future.exception().code for future in futures],[10] * 8)
+        limiters = [session.rateLimiter for session in pool.sessions]
+        self.assertTrue(limiters[0] is not limiters[1])
+        self.assertTrue(pool.sessions[0].limiters[1] is pool.sessions[1].limiters[1])
+        self.assertEqual([limiter.rate for limiter in limiters],[100, 100])
+        self.assertEqual(pool.metrics.snapshot()['cimd_send_rate'],{0: 100, 1: 100})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+""" Unit test for reports.py """
+
+import reports
+import cimd
+import timer
+import inbound
+import unittest
+import asyncore
+import SMSCClient
+import SMSCSimulator
+from SMSCClient_test import loopUntil
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class ReportIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.smsc = cimd.SMSC()
+        self.clock = FakeClock()
+        self.index = reports.ReportIndex(maxEntries=100, ttl=80, generations=8,
+                                         clock=self.clock)
+    def report(self, destAddr, timestamp, status, error=None):
+        params = [(21, destAddr), (60, timestamp), (61, status)]
+        if error is not None:
+            params.append((62, error))
+        return self.smsc.cimd.parseFrame(self.smsc.cimd.createMessage(23, params, 2))
+    def testPackKey(self):
+        """ Testing keys keep leading zeros and plus sign apart """
+        self.assertEqual(reports.packKey('123', '250101120000'),1123250101120000)
+        self.assertNotEqual(reports.packKey('0123', '250101120000'),
+                            reports.packKey('123', '250101120000'))
+        self.assertNotEqual(reports.packKey('+123', '250101120000'),
+                            reports.packKey('123', '250101120000'))
+        self.assertEqual(reports.packKey(b'123', b'250101120000'),1123250101120000)
+        self.assertEqual(reports.packKey('abc', '250101120000'),'abc/250101120000')
+    def testAddPop(self):
+        """ Testing message IDs are found by address and timestamp once """
+        self.index.add('123', '250101120000', 'id1')
+        self.index.add('123', '250101120001', 'id2')
+        self.assertEqual(len(self.index),2)
+        self.assertEqual(self.index.get(b'123', b'250101120001'),'id2')
+        self.assertEqual(self.index.pop('123', '250101120001'),'id2')
+        self.assertEqual(self.index.pop('123', '250101120001'),None)
+        self.assertEqual((self.index.matched, self.index.unmatched),(1, 1))
+        self.assertEqual(len(self.index),1)
+    def testExpire(self):
+        """ Testing entries are dropped by generation after ttl """
+        self.index.add('1', '250101120000', 1)
+        self.clock.now += 50
+        self.index.add('2', '250101120000', 2)
+        self.clock.now += 45
+        self.assertEqual(self.index.expire(),1)
+        self.assertEqual(self.index.get('1', '250101120000'),None)
+        self.assertEqual(self.index.get('2', '250101120000'),2)
+        self.clock.now += 50
+        self.index.add('3', '250101120000', 3)
+        self.assertEqual(len(self.index),1)
+        self.assertEqual(self.index.expired,2)
+    def testMaxEntries(self):
+        """ Testing size stays bounded, oldest generation is evicted first """
+        for i in range(100):
+            self.index.add(str(i), '250101120000', i)
+        self.clock.now += 20
+        for i in range(100, 150):
+            self.index.add(str(i), '250101120000', i)
+        self.assertEqual(len(self.index),100)
+        self.assertEqual(self.index.evicted,50)
+        self.assertEqual(len([i for i in range(100, 150)
+                              if self.index.get(str(i), '250101120000') == i]),50)
+    def testEvictionOrder(self):
+        """ Testing the oldest entries of one generation are evicted first """
+        index = reports.ReportIndex(maxEntries=3, clock=self.clock)
+        for i in range(5):
+            index.add(str(i), '250101120000', i)
+        self.assertEqual([i for i in range(5) if index.get(str(i), '250101120000') == i],
+                         [2, 3, 4])
+        self.assertEqual(index.evicted,2)
+        # Matched entry is skipped, the next oldest one goes
+        index.pop('2', '250101120000')
+        for i in range(5, 7):
+            index.add(str(i), '250101120000', i)
+        self.assertEqual([i for i in range(7) if index.get(str(i), '250101120000') == i],
+                         [4, 5, 6])
+        self.assertEqual(index.evicted,3)
+    def testReplaced(self):
+        """ Testing repeated key replaces the message ID and is counted """
+        self.index.add('123', '250101120000', 'id1')
+        self.index.add('123', '250101120000', 'id2')
+        self.assertEqual(len(self.index),1)
+        self.assertEqual(self.index.replaced,1)
+        self.assertEqual(self.index.get('123', '250101120000'),'id2')
+    def testMatch(self):
+        """ Testing status reports are decoded and matched to message IDs """
+        self.index.add('123', '250101120000', 'id1')
+        report = self.index.match(self.report('123', '250101120000', 1))
+        self.assertEqual((report.messageId, report.statusText),('id1', 'In process'))
+        report = self.index.match(self.report('123', '250101120000', 3, 1))
+        self.assertEqual(report.messageId,'id1')
+        self.assertEqual(report.statusCode,3)
+        self.assertEqual(report.statusText,'Delivery failed')
+        self.assertEqual((report.errorCode, report.errorText),(1, 'Unknown subscriber'))
+        self.assertFalse(report.delivered())
+        self.assertEqual(len(self.index),0)
+        report = self.index.match(self.report('123', '250101120000', 4))
+        self.assertEqual(report.messageId,None)
+        self.assertEqual((self.index.matched, self.index.unmatched),(1, 1))
+        self.index.add('123', '250101120000', 'id2')
+        report = self.index.lookup(self.report('123', '250101120000', 4))
+        self.assertEqual((report.messageId, len(self.index)),('id2', 1))
+        self.index.settle(report)
+        self.assertEqual(len(self.index),0)
+        self.assertEqual(report.errorCode,None)
+
+class ClientReportsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+        self.items = []
+    def tearDown(self):
+        asyncore.close_all()
+    def testStatusReports(self):
+        """ Testing status reports reach the inbound queue with message IDs """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, statusReports=True)
+        queue = inbound.InboundQueue(self.items.extend).start()
+        index = reports.ReportIndex()
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',windowSize=4,
+                                       scheduler=self.scheduler,inbound=queue,reports=index)
+        client.submitMessages([client.smscc.encodeTextMsgParams(destAddr='42%d' % i,
+                                                                userData='x')
+                               for i in range(3)], messageIds=['a', 'b', 'c'])
+        self.assertTrue(loopUntil(lambda: simulator.counters.get(73) == 3,
+                                  scheduler=self.scheduler))
+        queue.stop()
+        self.assertEqual(sorted([(item.messageId, item.destAddr) for item in self.items]),
+                         [('a', '420'), ('b', '421'), ('c', '422')])
+        self.assertTrue(self.items[0].delivered())
+        self.assertEqual(len(index),0)
+    def testRejectedReport(self):
+        """ Testing report nacked for full queue keeps its entry """
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, statusReports=True)
+        queue = inbound.InboundQueue(self.items.extend, maxSize=1)
+        queue.put(None)
+        index = reports.ReportIndex()
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',
+                                       scheduler=self.scheduler,inbound=queue,reports=index)
+        client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='420',userData='x'),
+                             messageId='a')
+        self.assertTrue(loopUntil(lambda: simulator.counters.get(99) == 1,
+                                  scheduler=self.scheduler))
+        self.assertEqual(queue.rejected,1)
+        self.assertEqual(len(index),1)
+        self.assertEqual(index.matched,0)
+
+if __name__ == "__main__":
+    unittest.main()
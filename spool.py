@@ -0,0 +1,221 @@
+""" Crash-safe outbound spool for CIMD clients
+
+Submit frames are appended to memory-mapped journal segments before
+they are sent and marked acknowledged in place when SMSC answers them.
+Segments have fixed size and are deleted once no entry is pending.
+Entries of submits rejected by SMSC (error response or nack) are
+released, submits not answered in time or lost with the connection
+stay pending and are sent again by the client. After a crash,
+Spool.recovered holds the pending entries, they are sent again with
+new packet numbers.
+
+Record layout is state byte ('P' pending, 'A' acknowledged, 'R'
+released, zero ends the segment), 4-byte big-endian frame length and the frame. Frames are
+kept with packet number 000. Journal is made durable by commit(), one
+msync() for all records appended since the previous one, so clients
+commit a whole batch at once (group commit). Acknowledgements are not
+synced on their own, a message may be sent twice after an operating
+system crash, never lost."""
+
+import os
+import mmap
+import struct
+import cimd
+
+recordHeader = struct.Struct('>cI')
+pending = b'P'
+acked = b'A'
+released = b'R'
+framePrefix = b'\x0203:000\t'
+frameSuffix = b'\x03'
+
+class Segment:
+    """ One memory-mapped journal file """
+
+    def __init__(self, path, size):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self.size = os.fstat(fd).st_size
+            self.map = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.offset = 0                 # End of written records
+        self.synced = 0                 # End of records made durable
+        self.pending = 0                # Records not acknowledged
+        self.closed = False
+
+    def scan(self):
+        """ Returns offsets of pending records, stops at the first bad one """
+        offsets = []
+        offset = 0
+        data = self.map
+        while offset + recordHeader.size <= self.size:
+            state, length = recordHeader.unpack_from(data, offset)
+            end = offset + recordHeader.size + length
+            if state not in (pending, acked, released) or end > self.size or length < 2:
+                break
+            frame = data[offset + recordHeader.size:end]
+            if frame[:len(framePrefix)] != framePrefix or frame[-1:] != frameSuffix:
+                break                   # Torn write
+            if state == pending:
+                offsets.append(offset)
+            offset = end
+        self.offset = self.synced = offset
+        self.pending = len(offsets)
+        return offsets
+
+    def append(self, frame):
+        """ Writes record, returns its offset or None if it does not fit """
+        offset = self.offset
+        end = offset + recordHeader.size + len(frame)
+        if end > self.size:
+            return None
+        self.map[offset + recordHeader.size:end] = frame
+        # State goes last, half written record is never pending
+        self.map[offset:offset + recordHeader.size] = recordHeader.pack(pending, len(frame))
+        self.offset = end
+        self.pending += 1
+        return offset
+
+    def body(self, offset):
+        """ Returns parameter blocks of the record frame as native string """
+        length = recordHeader.unpack_from(self.map, offset)[1]
+        start = offset + recordHeader.size
+        return cimd.toNative(self.map[start + len(framePrefix):start + length - len(frameSuffix)])
+
+    def mark(self, offset, state):
+        """ Sets state of pending record, returns True if it was pending """
+        if self.map[offset:offset + 1] != pending:
+            return False
+        self.map[offset:offset + 1] = state
+        self.pending -= 1
+        return True
+
+    def sync(self):
+        if self.synced == self.offset:
+            return False
+        # msync() needs page aligned start
+        start = self.synced - self.synced % mmap.ALLOCATIONGRANULARITY
+        self.map.flush(start, self.offset - start)
+        self.synced = self.offset
+        return True
+
+    def close(self):
+        if not self.closed:
+            self.map.flush()
+            self.map.close()
+            self.closed = True
+
+class Spool:
+    """ Journal of submits in directory, one segment file after another
+
+    Entries are (segment, offset) pairs returned by append(). recovered
+    lists (entry, EncodedRecord) of pending entries found on open."""
+
+    suffix = '.journal'
+
+    def __init__(self, directory, segmentSize=16 * 1024 * 1024):
+        self.directory = directory
+        self.segmentSize = segmentSize
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.segments = []
+        self.recovered = []
+        self.commits = 0
+        names = sorted([name for name in os.listdir(directory) if name.endswith(self.suffix)])
+        for name in names:
+            segment = Segment(os.path.join(directory, name), segmentSize)
+            offsets = segment.scan()
+            if not offsets:
+                self.remove(segment)
+                continue
+            self.segments.append(segment)
+            for offset in offsets:
+                self.recovered.append(((segment, offset),
+                                       cimd.EncodedRecord(segment.body(offset))))
+        self.sequence = 0
+        if names:
+            self.sequence = int(names[-1][:-len(self.suffix)])
+        self.current = None
+        self.uncommitted = False
+
+    def newSegment(self):
+        self.sequence += 1
+        path = os.path.join(self.directory, '%08d%s' % (self.sequence, self.suffix))
+        self.current = Segment(path, self.segmentSize)
+        self.segments.append(self.current)
+
+    def remove(self, segment):
+        segment.close()
+        os.remove(segment.path)
+        if segment in self.segments:
+            self.segments.remove(segment)
+
+    def append(self, record):
+        """ Journals cimd.EncodedRecord of a submit, returns entry """
+        frame = framePrefix + cimd.toBytes(record.body) + frameSuffix
+        if recordHeader.size + len(frame) > self.segmentSize:
+            raise cimd.CIMDError('Message does not fit into spool segment')
+        offset = None
+        if self.current is not None:
+            offset = self.current.append(frame)
+        if offset is None:
+            if self.current is not None and not self.current.pending:
+                self.remove(self.current)
+            self.newSegment()
+            offset = self.current.append(frame)
+        self.uncommitted = True
+        return (self.current, offset)
+
+    def add(self, smscc, encodedMsgParams):
+        """ Encodes and journals submit parameters, returns (record, entry) """
+        if not isinstance(encodedMsgParams, cimd.EncodedRecord):
+            encodedMsgParams = smscc.encodeRecord(encodedMsgParams)
+        return encodedMsgParams, self.append(encodedMsgParams)
+
+    def mark(self, entry, state):
+        segment, offset = entry
+        if segment.closed:
+            return
+        if segment.mark(offset, state) and not segment.pending and segment is not self.current:
+            self.remove(segment)
+
+    def ack(self, entry):
+        """ Marks entry acknowledged, drops its segment once nothing is pending """
+        self.mark(entry, acked)
+
+    def release(self, entry):
+        """ Marks entry of submit rejected by SMSC (error response or nack)
+
+        The entry is not replayed after restart, the caller learns about
+        the failure from the response future and submits it again if it
+        wants to."""
+        self.mark(entry, released)
+
+    def record(self, entry):
+        """ Returns cimd.EncodedRecord of pending entry, e.g. to send it again """
+        segment, offset = entry
+        return cimd.EncodedRecord(segment.body(offset))
+
+    def commit(self):
+        """ Makes all appended records durable with one msync() """
+        if not self.uncommitted:
+            return
+        for segment in self.segments:
+            segment.sync()
+        self.uncommitted = False
+        self.commits += 1
+
+    def pending(self):
+        """ Returns number of entries not acknowledged """
+        return sum([segment.pending for segment in self.segments])
+
+    def close(self):
+        self.commit()
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+        self.current = None
@@ -0,0 +1,156 @@
+""" Unit test for spool.py """
+
+import spool
+import cimd
+import timer
+import shutil
+import tempfile
+import unittest
+import asyncore
+import SMSCClient
+import SMSCSimulator
+from SMSCClient_test import windowSMSC, loopUntil
+
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.smscc = cimd.SMSC()
+    def tearDown(self):
+        shutil.rmtree(self.directory, True)
+    def params(self, i):
+        return self.smscc.encodeTextMsgParams(destAddr='420%03d' % i, userData='text %d' % i)
+    def testRecover(self):
+        """ Testing only entries not acknowledged are recovered """
+        journal = spool.Spool(self.directory)
+        entries = [journal.add(self.smscc, self.params(i))[1] for i in range(5)]
+        journal.commit()
+        for entry in entries[:3]:
+            journal.ack(entry)
+        self.assertEqual(journal.pending(),2)
+        journal.close()
+        journal = spool.Spool(self.directory)
+        self.assertEqual([record.body for entry, record in journal.recovered],
+                         [self.smscc.encodeRecord(self.params(i)).body for i in (3, 4)])
+        journal.ack(journal.recovered[0][0])
+        journal.close()
+        self.assertEqual(len(spool.Spool(self.directory).recovered),1)
+    def testSegments(self):
+        """ Testing new segments are started and acknowledged ones deleted """
+        journal = spool.Spool(self.directory, segmentSize=256)
+        entries = [journal.add(self.smscc, self.params(i))[1] for i in range(20)]
+        self.assertTrue(len(journal.segments) > 2)
+        for entry in entries:
+            journal.ack(entry)
+        self.assertEqual(journal.segments,[journal.current])
+        journal.close()
+        journal = spool.Spool(self.directory, segmentSize=256)
+        self.assertEqual(journal.recovered,[])
+        self.assertEqual(journal.segments,[])
+        self.assertRaises(cimd.CIMDError, journal.append, cimd.EncodedRecord('033:' + 'x' * 300))
+    def testTornRecord(self):
+        """ Testing half written record ends the segment """
+        journal = spool.Spool(self.directory)
+        journal.add(self.smscc, self.params(1))
+        segment, offset = journal.add(self.smscc, self.params(2))[1]
+        segment.map[offset + spool.recordHeader.size] = b'x'
+        journal.close()
+        self.assertEqual(len(spool.Spool(self.directory).recovered),1)
+
+class ClientSpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = timer.Scheduler()
+        self.directory = tempfile.mkdtemp()
+    def tearDown(self):
+        asyncore.close_all()
+        shutil.rmtree(self.directory, True)
+    def testAckAndReplay(self):
+        """ Testing answered submits are acked and the rest is replayed renumbered """
+        journal = spool.Spool(self.directory)
+        server = windowSMSC(window=4)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=4,
+                                       scheduler=self.scheduler,spool=journal)
+        futures = client.submitMessages([client.smscc.encodeTextMsgParams(destAddr='42%d' % i,
+                                                                          userData='x')
+                                         for i in range(6)])
+        # Window of 4 is answered, the last 2 wait for the server forever
+        self.assertTrue(loopUntil(lambda: futures[3].done() and client.inFlight() == 2,
+                                  scheduler=self.scheduler))
+        self.assertEqual(journal.pending(),2)
+        self.assertTrue(journal.commits <= 2)
+        client.shutdown()
+        journal.close()
+        journal = spool.Spool(self.directory)
+        self.assertEqual(len(journal.recovered),2)
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=2,
+                                       scheduler=self.scheduler,spool=journal)
+        futures = client.replaySpool()
+        self.assertTrue(loopUntil(lambda: client.pending() == 0, scheduler=self.scheduler))
+        self.assertEqual(sorted([future.result().getParamValue(21) for future in futures]),
+                         [b'424', b'425'])
+        self.assertEqual([future.packetNumber for future in futures],[3, 5])
+        self.assertEqual(journal.pending(),0)
+        journal.close()
+    def testResendOnTimeout(self):
+        """ Testing unanswered submits stay pending and are sent again """
+        journal = spool.Spool(self.directory, segmentSize=128)
+        server = windowSMSC(window=4)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=4,
+                                       scheduler=self.scheduler,spool=journal,
+                                       responseTimeout=0.2)
+        futures = client.submitMessages([client.smscc.encodeTextMsgParams(destAddr='42%d' % i,
+                                                                          userData='x')
+                                         for i in range(6)])
+        # The last 2 are answered only after they are sent again
+        self.assertTrue(loopUntil(lambda: futures[4].done() and futures[5].done(),
+                                  scheduler=self.scheduler))
+        self.assertEqual([future.result().getParamValue(21) for future in futures[4:]],
+                         [b'424', b'425'])
+        self.assertEqual(server.channels[0].received.count(3),8)
+        self.assertEqual(journal.pending(),0)
+        self.assertEqual(journal.segments,[journal.current])
+        client.shutdown()
+        journal.close()
+    def testResendAfterReconnect(self):
+        """ Testing submits lost with the connection are sent after reconnect """
+        journal = spool.Spool(self.directory)
+        server = windowSMSC(window=2)
+        client = SMSCClient.SMSCClient('127.0.0.1',server.port,'user','pass',windowSize=2,
+                                       scheduler=self.scheduler,spool=journal,
+                                       reconnectDelay=0.01)
+        future = client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='421',
+                                                                       userData='x'))
+        self.assertTrue(loopUntil(lambda: server.channels and server.channels[0].held,
+                                  scheduler=self.scheduler))
+        server.channels[0].close()
+        self.assertTrue(loopUntil(lambda: len(server.channels) == 2 and
+                                  server.channels[1].held, scheduler=self.scheduler))
+        self.assertFalse(future.done())
+        self.assertEqual(journal.pending(),1)
+        other = client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='422',
+                                                                      userData='x'))
+        self.assertTrue(loopUntil(lambda: future.done() and other.done(),
+                                  scheduler=self.scheduler))
+        self.assertEqual(future.result().getParamValue(21),b'421')
+        self.assertEqual(journal.pending(),0)
+        client.shutdown()
+        journal.close()
+    def testReleaseOnError(self):
+        """ Testing entries of rejected submits are released, not replayed """
+        journal = spool.Spool(self.directory)
+        simulator = SMSCSimulator.SMSCSimulator(scheduler=self.scheduler, congestionRate=1.0)
+        client = SMSCClient.SMSCClient('127.0.0.1',simulator.port,'user','pass',
+                                       scheduler=self.scheduler,spool=journal)
+        future = client.submitMessage(client.smscc.encodeTextMsgParams(destAddr='421',
+                                                                       userData='x'))
+        self.assertTrue(loopUntil(future.done, scheduler=self.scheduler))
+        self.assertEqual(future.exception().code,10)
+        segment, offset = future.spoolEntry
+        self.assertEqual(segment.map[offset:offset + 1],spool.released)
+        self.assertEqual(journal.pending(),0)
+        client.shutdown()
+        journal.close()
+        self.assertEqual(spool.Spool(self.directory).recovered,[])
+
+if __name__ == "__main__":
+    unittest.main()
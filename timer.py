@@ -0,0 +1,192 @@
+""" Timers for asyncore based CIMD clients
+
+asyncore has no notion of time, Scheduler keeps timed calls and loop()
+runs them between asyncore polls."""
+
+import asyncore
+import heapq
+import math
+import select
+import time
+
+class Timer:
+    """ Scheduled call returned by Scheduler.callLater() """
+
+    def __init__(self, when, func, args):
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """ Prevents the call, cancelled timers are dropped lazily """
+        self.cancelled = True
+
+class WheelTimer(Timer):
+    """ Timer of TimerWheel, cancelling it stops the wheel once idle """
+
+    def __init__(self, wheel, when, func, args):
+        Timer.__init__(self, when, func, args)
+        self.wheel = wheel
+        self.tick = 0
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.wheel.removed()
+
+class Scheduler:
+    """ Heap of timed calls """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.timers = []
+        self.sequence = 0               # Keeps FIFO order of equal times
+
+    def callLater(self, delay, func, *args):
+        """ Schedules func(*args) after delay seconds, returns Timer """
+        timer = Timer(self.clock() + delay, func, args)
+        self.sequence += 1
+        heapq.heappush(self.timers, (timer.when, self.sequence, timer))
+        return timer
+
+    def nextTimeout(self):
+        """ Returns seconds to the next timer or None if there is none """
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if not self.timers:
+            return None
+        return max(self.timers[0][0] - self.clock(), 0)
+
+    def run(self):
+        """ Runs all expired timers, returns number of calls made """
+        now = self.clock()
+        calls = 0
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                timer.cancelled = True
+                timer.func(*timer.args)
+                calls += 1
+        return calls
+
+class TimerWheel:
+    """ Hashed timing wheel for many timeouts of similar length
+
+    Timers are hashed into slots of resolution seconds and fire up to one
+    resolution late. While the wheel holds timers, it keeps a single
+    Scheduler timer ticking instead of one heap entry per timeout, so
+    adding and cancelling a timeout costs O(1)."""
+
+    def __init__(self, scheduler=None, resolution=0.1, slots=512):
+        if scheduler is None:
+            scheduler = defaultScheduler
+        self.scheduler = scheduler
+        self.resolution = resolution
+        self.slots = [[] for i in range(slots)]
+        self.tick = 0                   # Last processed tick
+        self.count = 0                  # Timers neither fired nor cancelled
+        self.size = 0                   # Timers in slots, cancelled included
+        self.ticker = None
+
+    def callLater(self, delay, func, *args):
+        """ Schedules func(*args) after delay seconds, returns Timer """
+        now = self.scheduler.clock()
+        if not self.count:
+            # Idle wheel restarts at the current tick. Slots hold only
+            # cancelled timers now, they are dropped once there are many.
+            self.tick = int(now / self.resolution)
+            if self.size >= len(self.slots):
+                for slot in self.slots:
+                    del slot[:]
+                self.size = 0
+        timer = WheelTimer(self, now + delay, func, args)
+        timer.tick = max(int(math.ceil(timer.when / self.resolution)), self.tick + 1)
+        self.slots[timer.tick % len(self.slots)].append(timer)
+        self.count += 1
+        self.size += 1
+        self.wakeUp(timer.tick, now)
+        return timer
+
+    def wakeUp(self, tick, now):
+        """ Makes sure the ticker runs no later than at tick """
+        if self.ticker is not None:
+            if self.ticker.tick <= tick:
+                return
+            self.ticker.cancel()
+        self.ticker = self.scheduler.callLater(max(tick * self.resolution - now, 0),
+                                               self.advance)
+        self.ticker.tick = tick
+
+    def __len__(self):
+        return self.count
+
+    def removed(self):
+        """ Stops ticking when the last timer was cancelled
+
+        Cancelled timers stay in their slots until the wheel gets there."""
+        self.count -= 1
+        if not self.count and self.ticker is not None:
+            self.ticker.cancel()
+            self.ticker = None
+
+    def advance(self):
+        """ Fires timers of all ticks passed since the last call """
+        self.ticker = None
+        now = self.scheduler.clock()
+        target = int(now / self.resolution)
+        # More ticks than slots passed, each slot is visited once
+        first = max(self.tick + 1, target - len(self.slots) + 1)
+        expired = []
+        for tick in range(first, target + 1):
+            slot = self.slots[tick % len(self.slots)]
+            if not slot:
+                continue
+            waiting = []
+            for timer in slot:
+                if timer.cancelled:
+                    continue
+                if timer.tick > target:
+                    waiting.append(timer)   # Due in a later round
+                else:
+                    expired.append(timer)
+            self.size -= len(slot) - len(waiting)
+            slot[:] = waiting
+        self.tick = max(self.tick, target)
+        for timer in expired:
+            # Timer may get cancelled by an earlier call of this round
+            if not timer.cancelled:
+                timer.cancelled = True
+                self.count -= 1
+                timer.func(*timer.args)
+        if self.count:
+            self.wakeUp(self.tick + 1, self.scheduler.clock())
+        return len(expired)
+
+# Scheduler used by clients which are not given their own
+defaultScheduler = Scheduler()
+
+def loop(scheduler=None, timeout=1.0, count=None, usePoll=None):
+    """ Runs asyncore loop together with scheduled timers
+
+    Returns when there are neither channels nor timers left or after
+    count iterations. poll() is used where available, select() is
+    limited to FD_SETSIZE (usually 1024) sockets."""
+    if scheduler is None:
+        scheduler = defaultScheduler
+    if usePoll is None:
+        usePoll = hasattr(select, 'poll')
+    while count is None or count > 0:
+        wait = scheduler.nextTimeout()
+        if wait is None:
+            if not asyncore.socket_map:
+                break
+            wait = timeout
+        wait = min(wait, timeout)
+        if asyncore.socket_map:
+            asyncore.loop(timeout=wait, use_poll=usePoll, count=1)
+        else:
+            time.sleep(wait)            # Only timers left, e.g. reconnect
+        scheduler.run()
+        if count is not None:
+            count -= 1
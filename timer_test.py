@@ -0,0 +1,60 @@
+""" Unit test for timer.py """
+
+import timer
+import unittest
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+class TimerWheelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = timer.Scheduler(self.clock)
+        self.wheel = timer.TimerWheel(self.scheduler, resolution=0.1, slots=16)
+        self.fired = []
+    def runUntil(self, when):
+        while self.clock.now < when:
+            self.clock.now = min(self.clock.now + 0.05, when)
+            self.scheduler.run()
+    def testFire(self):
+        """ Testing timers fire in time, at most one resolution late """
+        self.wheel.callLater(0.3, self.fired.append, 'a')
+        self.wheel.callLater(0.1, self.fired.append, 'b')
+        self.runUntil(1000.25)
+        self.assertEqual(self.fired,['b'])
+        self.runUntil(1000.45)
+        self.assertEqual(self.fired,['b','a'])
+        self.assertEqual(len(self.wheel),0)
+        self.assertEqual(self.scheduler.nextTimeout(),None)
+    def testRounds(self):
+        """ Testing timers longer than one turn of the wheel """
+        self.wheel.callLater(5.0, self.fired.append, 'long')
+        self.wheel.callLater(0.2, self.fired.append, 'short')
+        self.runUntil(1004.9)
+        self.assertEqual(self.fired,['short'])
+        self.runUntil(1005.2)
+        self.assertEqual(self.fired,['short','long'])
+    def testCancel(self):
+        """ Testing cancelled timers do not fire and idle wheel stops ticking """
+        timers = [self.wheel.callLater(1.0, self.fired.append, i) for i in range(100)]
+        self.assertEqual(len(self.wheel),100)
+        for t in timers:
+            t.cancel()
+        self.assertEqual(len(self.wheel),0)
+        self.assertEqual(self.scheduler.nextTimeout(),None)
+        self.wheel.callLater(0.5, self.fired.append, 'x')
+        self.runUntil(1002.0)
+        self.assertEqual(self.fired,['x'])
+    def testCatchUp(self):
+        """ Testing late tick fires everything which expired meanwhile """
+        for i in range(5):
+            self.wheel.callLater(0.2 * (i + 1), self.fired.append, i)
+        self.clock.now += 10.0
+        self.scheduler.run()
+        self.assertEqual(sorted(self.fired),[0,1,2,3,4])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+""" Non-blocking logging for CIMD clients
+
+Log records are put into a queue by QueueHandler and written by
+QueueListener on a background thread, so the event loop never waits
+for file I/O. Messages are formatted by the writer thread, only for
+records which passed the level check. WireTrace logs sampled CIMD
+frames per opcode."""
+
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class QueueHandler(logging.Handler):
+    """ Handler putting records into a queue without formatting them
+
+    If the queue is full, records are dropped and counted, the caller
+    is never blocked."""
+
+    def __init__(self, recordQueue):
+        logging.Handler.__init__(self)
+        self.queue = recordQueue
+        self.dropped = 0
+
+    def emit(self, record):
+        # Traceback is rendered now, the frames do not survive the call
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class QueueListener:
+    """ Background thread passing queued records to handlers """
+
+    sentinel = None
+
+    def __init__(self, recordQueue, *handlers):
+        self.queue = recordQueue
+        self.handlers = handlers
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="QueueListener")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self.sentinel:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        """ Writes all queued records and stops the thread """
+        if self.thread is None:
+            return
+        self.queue.put(self.sentinel)
+        self.thread.join()
+        self.thread = None
+        for handler in self.handlers:
+            handler.flush()
+
+def setup(filename="client.log", level=logging.DEBUG, maxQueue=10000,
+          logger=None, handler=None):
+    """ Switches logger (root by default) to queued logging
+
+    Records go to handler or to a file handler for filename. Returns the
+    started QueueListener, stop() it to flush the log on exit."""
+    if handler is None:
+        handler = logging.FileHandler(filename, 'a')
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)-15s,%(msecs)d %(levelname)s:%(message)s", "%d.%m.%y %H:%M:%S"))
+    recordQueue = queue.Queue(maxQueue)
+    listener = QueueListener(recordQueue, handler)
+    if logger is None:
+        logger = logging.getLogger()
+    logger.addHandler(QueueHandler(recordQueue))
+    logger.setLevel(level)
+    listener.start()
+    return listener
+
+class WireTrace:
+    """ Logs CIMD frames at DEBUG level, sampled per opcode
+
+    sampling maps opcode to N, every N-th frame of that opcode is logged,
+    0 turns tracing of the opcode off. Opcodes not in sampling use
+    defaultRate. Nothing is formatted when DEBUG is disabled."""
+
+    def __init__(self, log, sampling=None, defaultRate=1):
+        self.log = log
+        self.sampling = dict(sampling or {})
+        self.defaultRate = defaultRate
+        self.counts = {}                # Opcode -> frames seen
+
+    def setSampling(self, opCode, rate):
+        self.sampling[opCode] = rate
+
+    def trace(self, direction, opCode, data):
+        """ Logs frame data if DEBUG is enabled and the sample is due """
+        if not self.log.isEnabledFor(logging.DEBUG):
+            return
+        rate = self.sampling.get(opCode, self.defaultRate)
+        if not rate:
+            return
+        count = self.counts.get(opCode, 0)
+        self.counts[opCode] = count + 1
+        if count % rate == 0:
+            self.log.debug("[%s] %r", direction, data)
@@ -0,0 +1,69 @@
+""" Unit test for wirelog.py """
+
+import wirelog
+import logging
+import unittest
+
+class listHandler(logging.Handler):
+    """ Collects formatted messages """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+class countedArg:
+    """ Counts how many times it was formatted """
+    def __init__(self):
+        self.formatted = 0
+    def __str__(self):
+        self.formatted += 1
+        return 'arg'
+
+class WireLogTestCase(unittest.TestCase):
+    def setUp(self):
+        # Logger outside of the logging hierarchy, handlers of test
+        # runners attached to registered loggers do not format its records
+        self.log = logging.Logger("wirelog_test")
+        self.collector = listHandler()
+        self.listener = wirelog.setup(logger=self.log, handler=self.collector)
+    def tearDown(self):
+        self.listener.stop()
+        self.log.handlers = []
+    def testQueuedLogging(self):
+        """ Testing records are formatted and written by the listener """
+        arg = countedArg()
+        self.log.info("value %s", arg)
+        self.listener.stop()
+        self.assertEqual(self.collector.messages,['value arg'])
+        self.assertEqual(arg.formatted,1)
+    def testLazyFormatting(self):
+        """ Testing disabled records are never formatted """
+        self.log.setLevel(logging.INFO)
+        arg = countedArg()
+        self.log.debug("value %s", arg)
+        self.listener.stop()
+        self.assertEqual(self.collector.messages,[])
+        self.assertEqual(arg.formatted,0)
+    def testDropWhenFull(self):
+        """ Testing full queue drops records instead of blocking """
+        handler = wirelog.QueueHandler(wirelog.queue.Queue(1))
+        record = self.log.makeRecord("wirelog_test", logging.INFO, "", 0, "msg", (), None)
+        handler.emit(record)
+        handler.emit(record)
+        self.assertEqual(handler.dropped,1)
+    def testSampling(self):
+        """ Testing per opcode sampling of wire trace """
+        trace = wirelog.WireTrace(self.log, {3: 2, 40: 0})
+        for i in range(4):
+            trace.trace("Push", 3, "submit %d" % i)
+            trace.trace("Push", 40, "alive")
+            trace.trace("CIMD", 53, "resp %d" % i)
+        self.listener.stop()
+        self.assertEqual(len(self.collector.messages),6)
+        self.assertEqual([m for m in self.collector.messages if 'submit' in m],
+                         ["[Push] 'submit 0'","[Push] 'submit 2'"])
+        self.assertEqual(trace.counts,{3: 4, 53: 4})
+
+if __name__ == "__main__":
+    unittest.main()